@@ -0,0 +1,213 @@
+import argparse
+import gzip
+import os
+import random
+import re
+import tempfile
+import time
+import tracemalloc
+from dependency_visualizer import FORMATS, closure_graph, load_graph, parse_packages_gz
+
+
+LOREM = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore"
+    " et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut"
+).split()
+
+
+def popular(rng, count):
+    """
+    Номер пакета-зависимости: низкие номера - библиотеки ядра (libc, libstdc++), от которых
+    зависит большинство пакетов, поэтому выбор сильно смещён к ним (fan-in по степенному закону).
+    """
+    return int(count * rng.random() ** 3)
+
+
+def relation(rng, count):
+    """
+    Случайное отношение в синтаксисе Debian: версии, альтернативы, виртуальные пакеты, архитектуры.
+    """
+    kind = rng.random()
+    if kind < 0.1:
+        return f"pkg{popular(rng, count)} | virtual{rng.randrange(500)}"
+    if kind < 0.15:
+        return f"python3:any (>= 3.{rng.randint(6, 12)})"
+    if kind < 0.2:
+        return f"virtual{rng.randrange(500)}"
+    return f"pkg{popular(rng, count)} (>= {rng.randint(1, 9)}.{rng.randint(0, 9)})"
+
+
+def dependencies(rng, i, count):
+    """
+    Отношения поля Depends пакета i. Число зависимостей распределено логнормально
+    (большинство пакетов - 1-5 зависимостей, редкие метапакеты - десятки); первые
+    2-4 пакета каждой сотни образуют цикл, как пары библиотека/данные в настоящем архиве.
+    """
+    deps = [relation(rng, count) for _ in range(min(int(rng.lognormvariate(1.0, 0.8)), 80))]
+    base = i - i % 100
+    length = 2 + base // 100 % 3
+    if i < base + length <= count:
+        deps.append(f"pkg{base + (i - base + 1) % length}")
+    return deps
+
+
+def generate_packages_gz(file_path, count, seed=0):
+    """
+    Создаёт синтетический Packages.gz из count строф, похожих на строфы архива Ubuntu:
+    поля и их порядок как у apt-ftparchive, описание переменной длины, Pre-Depends
+    и Provides у части пакетов, циклы зависимостей.
+    """
+    rng = random.Random(seed)
+    with gzip.open(file_path, "wt", encoding="utf-8", compresslevel=6) as f:
+        for i in range(count):
+            deps = dependencies(rng, i, count)
+            f.write(f"Package: pkg{i}\n")
+            f.write("Architecture: amd64\n")
+            f.write(f"Version: {rng.randint(0, 3)}:{rng.randint(1, 9)}.{rng.randint(0, 20)}-{rng.randint(1, 5)}ubuntu1\n")
+            f.write("Priority: optional\nSection: universe/libs\nOrigin: Ubuntu\n")
+            f.write("Maintainer: Ubuntu Developers <ubuntu-devel-discuss@lists.ubuntu.com>\n")
+            f.write(f"Installed-Size: {int(rng.lognormvariate(6, 1.5))}\n")
+            if i % 10 == 0:
+                f.write(f"Pre-Depends: {relation(rng, count)}\n")
+            if deps:
+                f.write(f"Depends: {', '.join(deps)}\n")
+            if i % 20 == 0:
+                f.write(f"Provides: virtual{i % 500}, pkg{i}-abi (= 1)\n")
+            f.write(f"Filename: pool/universe/p/pkg{i}/pkg{i}_1.0_amd64.deb\n")
+            f.write(f"Size: {int(rng.lognormvariate(10, 1.5))}\n")
+            f.write(f"MD5sum: {rng.getrandbits(128):032x}\n")
+            f.write(f"SHA256: {rng.getrandbits(256):064x}\n")
+            f.write(f"Homepage: https://example.org/pkg{i}\n")
+            f.write(f"Description: synthetic package {i}\n")
+            for _ in range(min(int(rng.lognormvariate(1.2, 0.7)), 40)):
+                f.write(" " + " ".join(rng.choices(LOREM, k=12)) + "\n")
+            f.write(f"Task: ubuntu-desktop\nDescription-md5: {rng.getrandbits(128):032x}\n\n")
+
+
+def parse_packages_gz_read_all(file_path):
+    """
+    Прежняя реализация: читает распакованный файл целиком. Используется как эталон для сравнения.
+    """
+    packages = {}
+    with gzip.open(file_path, "rt", encoding="utf-8") as f:
+        content = f.read()
+    for entry in content.split("\n\n"):
+        name = None
+        dependencies = []
+        for line in entry.split("\n"):
+            if line.startswith("Package:"):
+                name = line.split(": ")[1].strip()
+            elif line.startswith("Depends:"):
+                deps_raw = line.split(": ")[1].strip()
+                dependencies = [re.split(r" \(.*?\)", dep)[0] for dep in deps_raw.split(", ")]
+        if name:
+            packages[name] = dependencies
+    return packages
+
+
+def measure(parse, file_path, size_mb):
+    """
+    Скорость разбора (МБ распакованного текста в секунду) и пик памяти по tracemalloc.
+    Время и память замеряются разными прогонами: tracemalloc сильно замедляет разбор.
+    """
+    start = time.perf_counter()
+    packages = parse(file_path)
+    elapsed = time.perf_counter() - start
+    del packages
+    tracemalloc.start()
+    packages = parse(file_path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return len(packages), elapsed, size_mb / elapsed, peak / 2 ** 20
+
+
+def measure_closures(graph, depths, roots):
+    """
+    Задержка замыкания для каждой глубины: медиана и максимум по корням, в миллисекундах.
+    """
+    report = {}
+    for depth in depths:
+        samples = []
+        for root in roots:
+            start = time.perf_counter()
+            graph.closure(root, depth)
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        report[depth] = (samples[len(samples) // 2], samples[-1])
+    return report
+
+
+def measure_writers(graph, root, tmp_dir):
+    """
+    Время записи графа полного замыкания root в каждом формате и размер файла.
+    """
+    closure = closure_graph(graph, graph.closure(root, len(graph.names)))
+    report = {}
+    for name, (extension, writer) in FORMATS.items():
+        output_path = os.path.join(tmp_dir, "graph" + extension)
+        start = time.perf_counter()
+        with open(output_path, "w", encoding="utf-8") as f:
+            writer(closure, f)
+        report[name] = (time.perf_counter() - start, os.path.getsize(output_path) / 2 ** 20)
+    return len(closure), report
+
+
+def bench_index(file_path, tmp_dir, depths, root_count):
+    with gzip.open(file_path, "rb") as f:
+        size_mb = sum(len(chunk) for chunk in iter(lambda: f.read(1 << 20), b"")) / 2 ** 20
+    print(f"Индекс: {size_mb:.1f} МБ распакованного текста")
+    print(f"{'парсер':<12} {'пакетов':>8} {'время, с':>9} {'МБ/с':>7} {'пик памяти, МБ':>15}")
+    for name, parse in (("read-all", parse_packages_gz_read_all), ("streaming", parse_packages_gz)):
+        count, elapsed, speed, peak = measure(parse, file_path, size_mb)
+        print(f"{name:<12} {count:>8} {elapsed:>9.2f} {speed:>7.1f} {peak:>15.1f}")
+
+    cache_path = os.path.join(tmp_dir, "Packages.gz.cache")
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+    for name in ("кэш: запись", "кэш: чтение"):
+        start = time.perf_counter()
+        graph = load_graph(file_path, cache_path)
+        print(f"{name:<12} {time.perf_counter() - start:>9.3f} с")
+
+    rng = random.Random(0)
+    roots = rng.sample(range(graph.package_count), min(root_count, graph.package_count))
+    unbounded = len(graph.names)
+    print(f"{'глубина':<12} {'медиана, мс':>12} {'максимум, мс':>13}  ({len(roots)} корней)")
+    for depth, (median, worst) in measure_closures(graph, depths + [unbounded], roots).items():
+        label = "без предела" if depth == unbounded else str(depth)
+        print(f"{label:<12} {median:>12.2f} {worst:>13.2f}")
+
+    root = max(roots, key=lambda node: len(graph.closure(node, unbounded)))
+    nodes, report = measure_writers(graph, root, tmp_dir)
+    print(f"Запись графа {graph.names[root]} ({nodes} пакетов):")
+    for name, (elapsed, file_mb) in report.items():
+        print(f"  {name:<8} {elapsed:>8.3f} с {file_mb:>8.1f} МБ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора Packages.gz и графа зависимостей.")
+    parser.add_argument("--sizes", default="1000,70000",
+                        help="Размеры синтетических индексов через запятую (например 1000,70000,500000).")
+    parser.add_argument("--packages-gz", help="Готовый Packages.gz вместо синтетических.")
+    parser.add_argument("--corpus-dir", help="Каталог для синтетических индексов: созданные раньше переиспользуются.")
+    parser.add_argument("--depths", default="1,2,4,8", help="Глубины замыкания через запятую (плюс без предела).")
+    parser.add_argument("--roots", type=int, default=20, help="Число случайных корней для замера замыканий.")
+    args = parser.parse_args()
+    depths = [int(depth) for depth in args.depths.split(",")]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.packages_gz:
+            bench_index(args.packages_gz, tmp_dir, depths, args.roots)
+            return
+        corpus_dir = args.corpus_dir or tmp_dir
+        os.makedirs(corpus_dir, exist_ok=True)
+        for count in (int(size) for size in args.sizes.split(",")):
+            file_path = os.path.join(corpus_dir, f"Packages-{count}.gz")
+            if not os.path.exists(file_path):
+                generate_packages_gz(file_path, count)
+            print(f"== {count} пакетов, {os.path.getsize(file_path) / 2 ** 20:.1f} МБ сжатого индекса")
+            bench_index(file_path, tmp_dir, depths, args.roots)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,1416 @@
+import gc
 import gzip
+import hashlib
+import io
 import re
-from collections import defaultdict
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import accumulate
 from pathlib import Path
 import subprocess
+import tempfile
+from xml.sax.saxutils import quoteattr
 
+CACHE_MAGIC = b"DEPCACHE3\n"
 
-def parse_packages_gz(file_path):
+
+@contextmanager
+def paused_gc():
     """
-    Разбирает файл Packages.gz и возвращает словарь с зависимостями пакетов.
+    Отключает циклический сборщик мусора на время разбора: создаются сотни тысяч
+    списков и словарей без циклов, и повторные проходы сборщика по ним только тратят время.
     """
-    packages = {}
-    with gzip.open(file_path, "rt", encoding="utf-8") as f:
-        content = f.read()
-    package_entries = content.split("\n\n")
-
-    for entry in package_entries:
-        name = None
-        dependencies = []
-        for line in entry.split("\n"):
-            if line.startswith("Package:"):
-                name = line.split(": ")[1].strip()
-            elif line.startswith("Depends:"):
-                deps_raw = line.split(": ")[1].strip()
-                dependencies = [
-                    re.split(r" \(.*?\)", dep)[0] for dep in deps_raw.split(", ")
-                ]
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+@lru_cache(maxsize=None)
+def field_pattern(fields):
+    """
+    Регулярное выражение, находящее в тексте нужные поля (вместе со строками продолжения)
+    и пустые строки - границы строф.
+    """
+    names = "|".join(re.escape(field) for field in fields)
+    # Строка только из пробелов - тоже граница строфы, а не строка продолжения
+    return re.compile(r"\n(?:(" + names + r"):[ \t]*([^\n]*(?:\n[ \t]+\S[^\n]*)*)|(?=[ \t]*\n))")
+
+
+BLANK_LINE = re.compile(r"(?:^|(?<=\n))[ \t]+(?=\n)")
+
+
+def iter_blocks(stream, chunk_size=1 << 20):
+    """
+    Читает текстовый поток блоками, каждый из которых заканчивается на границе строфы.
+    В памяти одновременно находится не больше одного блока. Строки из одних пробелов
+    заменяются пустыми: они разделяют строфы так же, как пустые.
+    """
+    rest = ""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        chunk = rest + chunk
+        if " \n" in chunk or "\t\n" in chunk:
+            chunk = BLANK_LINE.sub("", chunk)
+        cut = chunk.rfind("\n\n")
+        if cut < 0:
+            rest = chunk
+            continue
+        yield chunk[:cut + 1]
+        rest = chunk[cut + 2:]
+    if rest:
+        yield rest
+
+
+def field_value(value):
+    """
+    Значение поля с присоединёнными строками продолжения.
+    """
+    return " ".join(part.strip() for part in value.split("\n")) if "\n" in value else value
+
+
+def iter_stanzas(stream, fields=("Package", "Depends")):
+    """
+    Потоково разбирает строфы формата Debian control из текстового потока.
+    Возвращает словари только с нужными полями; строки продолжения
+    (начинающиеся с пробела или табуляции) присоединяются к полю.
+    Поиск полей выполняет регулярное выражение по блоку, а не цикл по строкам.
+    """
+    pattern = field_pattern(tuple(fields))
+    for block in iter_blocks(stream):
+        stanza = {}
+        for field, value in pattern.findall("\n" + block):
+            if field:
+                stanza[field] = field_value(value)
+            elif stanza:
+                yield stanza
+                stanza = {}
+        if stanza:
+            yield stanza
+
+
+def iter_stanza_texts(stream):
+    """
+    Потоково возвращает текст каждой строфы целиком.
+    """
+    for block in iter_blocks(stream):
+        for text in block.split("\n\n"):
+            if text.strip():
+                yield text
+
+
+RELATION_FIELDS = ("Pre-Depends", "Depends")
+INDEX_FIELDS = ("Package", "Version", "Pre-Depends", "Depends", "Provides")
+PACKAGE_FIELD = re.compile(r"(?:^|\n)Package:[ \t]*(\S+)")
+
+
+RELATION_NAME = re.compile(r"(?:^|,)\s*([^\s,(:\[<]+)")
+RELATION = re.compile(r"\s*([^\s,|(:\[<]+)[^,|]*([,|]?)")
+
+
+def parse_relations(value):
+    """
+    Разбирает поле отношений Debian (Depends, Pre-Depends) в список групп альтернатив.
+    Группа без альтернатив - строка, с альтернативами - кортеж.
+    Ограничения версий, архитектур ([amd64]), профилей (<!nocheck>)
+    и квалификаторы архитектуры (pkg:any) отбрасываются: "a (>= 1) | b:any, c" -> [("a", "b"), "c"].
+    """
+    if "|" not in value:
+        return RELATION_NAME.findall(value)
+    groups = []
+    alternatives = []
+    for name, separator in RELATION.findall(value):
+        alternatives.append(name)
+        if separator != "|":
+            groups.append(alternatives[0] if len(alternatives) == 1 else tuple(alternatives))
+            alternatives = []
+    return groups
+
+
+def parse_provides(value):
+    """
+    Имена виртуальных пакетов из поля Provides (версии отбрасываются).
+    """
+    return RELATION_NAME.findall(value)
+
+
+def stanza_record(stanza):
+    """
+    Запись индекса по полям строфы: {"version": версия, "depends": группы альтернатив,
+    "provides": виртуальные имена}. Pre-Depends идут перед Depends и разрешаются так же.
+    """
+    groups = []
+    for field in RELATION_FIELDS:
+        value = stanza.get(field)
+        if value:
+            groups += parse_relations(value)
+    provides = stanza.get("Provides")
+    return {
+        "version": stanza.get("Version", ""),
+        "depends": groups,
+        "provides": parse_provides(provides) if provides else [],
+    }
+
+
+def read_index(lines):
+    """
+    Читает строфы индекса: {пакет: запись stanza_record}.
+    """
+    index = {}
+    for stanza in iter_stanzas(lines, INDEX_FIELDS):
+        name = stanza.get("Package")
         if name:
-            packages[name] = dependencies
+            index[name] = stanza_record(stanza)
+    return index
+
+
+def read_index_digests(stream, known=None):
+    """
+    То же, что read_index, но дополнительно возвращает хэши текста строф {пакет: 8 байт}.
+    known - хэши прежней версии индекса: совпавшие строфы не разбираются,
+    их запись в индексе - None.
+    """
+    pattern = field_pattern(INDEX_FIELDS)
+    index = {}
+    digests = {}
+    for text in iter_stanza_texts(stream):
+        match = PACKAGE_FIELD.search(text)
+        if match is None:
+            continue
+        name = match.group(1)
+        digest = digests[name] = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+        if known is not None and known.get(name) == digest:
+            index[name] = None
+            continue
+        stanza = {field: field_value(value) for field, value in pattern.findall("\n" + text) if field}
+        index[name] = stanza_record(stanza)
+    return index, digests
+
+
+def version_order(char):
+    """
+    Вес символа при сравнении версий Debian: '~' раньше всего, даже конца строки,
+    буквы раньше остальных знаков.
+    """
+    if char == "~":
+        return -1
+    if "0" <= char <= "9":
+        return 0
+    if char.isalpha():
+        return ord(char)
+    return ord(char) + 256 if char else 0
+
+
+def compare_version_parts(a, b):
+    """
+    Сравнение верхней части версии или ревизии по алгоритму dpkg:
+    чередующиеся нецифровые (посимвольно, с весами version_order) и числовые участки.
+    """
+    i = j = 0
+    while i < len(a) or j < len(b):
+        while (i < len(a) and not "0" <= a[i] <= "9") or (j < len(b) and not "0" <= b[j] <= "9"):
+            diff = version_order(a[i] if i < len(a) else "") - version_order(b[j] if j < len(b) else "")
+            if diff:
+                return diff
+            i += 1
+            j += 1
+        start = i
+        while i < len(a) and "0" <= a[i] <= "9":
+            i += 1
+        number_a = int(a[start:i] or 0)
+        start = j
+        while j < len(b) and "0" <= b[j] <= "9":
+            j += 1
+        number_b = int(b[start:j] or 0)
+        if number_a != number_b:
+            return number_a - number_b
+    return 0
+
+
+def split_version(version):
+    """
+    Разбивает версию Debian на (эпоха, верхняя версия, ревизия): "1:2.3-4" -> (1, "2.3", "4").
+    """
+    epoch = 0
+    if ":" in version:
+        head, version = version.split(":", 1)
+        epoch = int(head) if head.isdigit() else 0
+    upstream, _, revision = version.rpartition("-")
+    if not upstream:
+        return epoch, revision, ""
+    return epoch, upstream, revision
+
+
+def compare_versions(a, b):
+    """
+    Сравнивает версии Debian: отрицательное число, если a < b, 0 при равенстве, положительное, если a > b.
+    """
+    if a == b:
+        return 0
+    epoch_a, upstream_a, revision_a = split_version(a)
+    epoch_b, upstream_b, revision_b = split_version(b)
+    if epoch_a != epoch_b:
+        return epoch_a - epoch_b
+    return compare_version_parts(upstream_a, upstream_b) or compare_version_parts(revision_a, revision_b)
+
+
+def merge_indexes(indexes):
+    """
+    Объединяет индексы нескольких репозиториев (в порядке приоритета) в один.
+    Для каждого пакета остаётся запись с наибольшей версией, при равных версиях - из первого индекса;
+    в записи сохраняется номер исходного индекса ("origin").
+    """
+    merged = {}
+    for origin, index in enumerate(indexes):
+        for name, record in index.items():
+            record["origin"] = origin
+            current = merged.get(name)
+            if current is None or compare_versions(record["version"], current["version"]) > 0:
+                merged[name] = record
+    return merged
+
+
+def provider_index(index):
+    """
+    Индекс поставщиков: виртуальное имя -> пакеты, объявившие его в Provides, в порядке индекса.
+    """
+    providers = {}
+    for name, record in index.items():
+        for virtual in record["provides"]:
+            providers.setdefault(virtual, []).append(name)
+    return providers
+
+
+def resolve_dependencies(index, providers=None, records=None):
+    """
+    Превращает группы альтернатив в рёбра графа {пакет: зависимости}.
+    Из группы берётся первая альтернатива, которую можно удовлетворить: реальный пакет
+    или виртуальный, у которого есть поставщик (первый по порядку индекса).
+    Если удовлетворить группу нельзя, ребро ведёт к первой альтернативе как к отсутствующему пакету.
+    records - разрешить только эти записи {пакет: запись}; наличие пакетов проверяется по всему index.
+    """
+    if providers is None:
+        providers = provider_index(index)
+    # Виртуальное имя без реального пакета заменяется первым поставщиком
+    redirect = {virtual: names[0] for virtual, names in providers.items() if virtual not in index}
+    redirect_get = redirect.get
+
+    packages = {}
+    for name, record in (index if records is None else records).items():
+        groups = record["depends"]
+        deps = list(map(redirect_get, groups, groups))
+        if tuple in map(type, deps):
+            deps = [choose_alternative(group, index, redirect) if type(group) is tuple else group for group in deps]
+        packages[name] = list(dict.fromkeys(deps))  # Повторы рёбер убираются
     return packages
 
 
+def choose_alternative(group, index, redirect):
+    """
+    Первая альтернатива группы, которую можно удовлетворить, иначе первая альтернатива.
+    """
+    for alternative in group:
+        if alternative in index:
+            return alternative
+        if alternative in redirect:
+            return redirect[alternative]
+    return group[0]
+
+
+def read_packages_gz(file_path):
+    """
+    Читает индекс из файла Packages.gz (см. read_index).
+    """
+    with gzip.open(file_path, "rt", encoding="utf-8") as f, paused_gc():
+        return read_index(f)
+
+
+def parse_packages_gz(file_path):
+    """
+    Разбирает файл Packages.gz и возвращает словарь с зависимостями пакетов.
+    Файл читается потоково, в памяти не держится ни распакованный текст, ни его части.
+    """
+    index = read_packages_gz(file_path)
+    with paused_gc():
+        return resolve_dependencies(index)
+
+
+def parse_indexes(file_paths, jobs=None):
+    """
+    Разбирает несколько Packages.gz (по процессу на файл) и объединяет их через merge_indexes.
+    Возвращает словарь {пакет: зависимости} и номера исходных индексов пакетов в том же порядке.
+    Зависимости разрешаются уже по объединённому индексу, так что поставщики виртуальных
+    пакетов и альтернативы ищутся во всех репозиториях сразу.
+    """
+    jobs = min(jobs or os.cpu_count() or 1, len(file_paths))
+    if jobs <= 1:
+        indexes = [read_packages_gz(file_path) for file_path in file_paths]
+    else:
+        with ProcessPoolExecutor(jobs) as pool:
+            indexes = list(pool.map(read_packages_gz, file_paths))
+    index = merge_indexes(indexes)
+    with paused_gc():
+        return resolve_dependencies(index), [record["origin"] for record in index.values()]
+
+
+def file_hash(file_path):
+    """
+    SHA-256 файла, читаемого блоками.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_stamp(file_path):
+    """
+    Отметка исходного файла для проверки актуальности кэша.
+    """
+    st = os.stat(file_path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+class PackageGraph:
+    """
+    Граф зависимостей с пакетами, пронумерованными целыми числами, и смежностью в формате CSR:
+    зависимости узла i - targets[offsets[i]:offsets[i + 1]].
+    Первые package_count имён - пакеты из индекса, остальные только упоминаются в зависимостях.
+    origins[i] - номер репозитория из repos, из которого взят пакет i.
+    Обратная смежность (кто зависит от узла i) - reverse_targets[reverse_offsets[i]:reverse_offsets[i + 1]],
+    строится по прямой при первом обращении (build_reverse) и хранится в кэше.
+    digests, providers и alternatives - состояние разбора для инкрементального
+    обновления (см. update_graph); digests равен None, если состояние не сохранено.
+    Графу из кэша providers и alternatives разбираются только при первом обращении (state_loader).
+    """
+
+    def __init__(self, names, package_count, offsets, targets, origins=None, repos=None):
+        self.names = names
+        self.package_count = package_count
+        self.offsets = offsets
+        self.targets = targets
+        self.origins = origins if origins is not None else array("I", bytes(4 * package_count))
+        self.repos = repos or []
+        self.ids = {name: i for i, name in enumerate(names)}
+        self.reverse_offsets = None
+        self.reverse_targets = None
+        self.digests = None
+        self.state_loader = None
+        self._providers = {}
+        self._alternatives = {}
+
+    def _load_state(self):
+        if self.state_loader is not None:
+            self._providers, self._alternatives = self.state_loader()
+            self.state_loader = None
+
+    @property
+    def providers(self):
+        self._load_state()
+        return self._providers
+
+    @providers.setter
+    def providers(self, value):
+        self._load_state()
+        self._providers = value
+
+    @property
+    def alternatives(self):
+        self._load_state()
+        return self._alternatives
+
+    @alternatives.setter
+    def alternatives(self, value):
+        self._load_state()
+        self._alternatives = value
+
+    @classmethod
+    def from_packages(cls, packages, origins=None, repos=None):
+        """
+        Строит граф из словаря {пакет: зависимости}.
+        """
+        names = list(packages)
+        ids = {name: i for i, name in enumerate(names)}
+        offsets = array("I", [0])
+        targets = array("I")
+        for deps in packages.values():
+            for dep in deps:
+                dep_id = ids.get(dep)
+                if dep_id is None:
+                    dep_id = ids[dep] = len(names)
+                    names.append(dep)
+                targets.append(dep_id)
+            offsets.append(len(targets))
+        if origins is not None:
+            origins = array("I", origins)
+        return cls(names, len(packages), offsets, targets, origins, repos)
+
+    def __contains__(self, name):
+        node = self.ids.get(name)
+        return node is not None and node < self.package_count
+
+    def origin(self, name):
+        """
+        Репозиторий, из которого взят пакет; None для пакетов вне индекса.
+        """
+        node = self.ids.get(name)
+        if node is None or node >= self.package_count or not self.repos:
+            return None
+        return self.repos[self.origins[node]]
+
+    def dependencies(self, node):
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def closure(self, root, max_depth, known=None):
+        """
+        Итеративный обход в ширину от узла root: номера пакетов индекса на расстоянии
+        не больше max_depth, в порядке обхода. Каждый пакет посещается один раз,
+        на минимальной глубине.
+        known - уже вычисленные полные замыкания {узел: замыкание}; только для
+        неограниченной глубины: встретив такой узел, обход берёт его замыкание целиком.
+        """
+        if max_depth < 0 or root >= self.package_count:
+            return []
+        offsets, targets, package_count = self.offsets, self.targets, self.package_count
+        visited = bytearray(len(self.names))
+        visited[root] = 1
+        order = [root]
+        frontier = [root]
+        depth = 0
+        while frontier and depth < max_depth:
+            next_frontier = []
+            for node in frontier:
+                for dep in targets[offsets[node]:offsets[node + 1]]:
+                    if not visited[dep] and dep < package_count:
+                        visited[dep] = 1
+                        sub = known.get(dep) if known else None
+                        if sub is None:
+                            next_frontier.append(dep)
+                            continue
+                        # Всё, что достижимо из dep, уже входит в его замыкание: глубже не идём
+                        order.append(dep)
+                        for reached in sub:
+                            if not visited[reached]:
+                                visited[reached] = 1
+                                order.append(reached)
+            order.extend(next_frontier)
+            frontier = next_frontier
+            depth += 1
+        return order
+
+    def build_reverse(self):
+        """
+        Строит обратную смежность сортировкой подсчётом за один проход по рёбрам.
+        Зависящие пакеты каждого узла идут по возрастанию номеров.
+        """
+        offsets, targets = self.offsets, self.targets
+        degree = [0] * (len(self.names) + 1)
+        for dep in targets:
+            degree[dep + 1] += 1
+        self.reverse_offsets = array("I", accumulate(degree))
+        position = self.reverse_offsets.tolist()
+        reverse_targets = array("I", bytes(4 * len(targets)))
+        for node in range(self.package_count):
+            for dep in targets[offsets[node]:offsets[node + 1]]:
+                reverse_targets[position[dep]] = node
+                position[dep] += 1
+        self.reverse_targets = reverse_targets
+
+    def reverse_closure(self, root, max_depth):
+        """
+        Обход обратных рёбер в ширину: уровни [[root], зависящие от root, зависящие от них, ...]
+        не глубже max_depth. Каждый пакет попадает в один уровень - минимальный.
+        """
+        if self.reverse_offsets is None:
+            self.build_reverse()
+        offsets, targets = self.reverse_offsets, self.reverse_targets
+        visited = bytearray(len(self.names))
+        visited[root] = 1
+        levels = [[root]]
+        while len(levels) <= max_depth:
+            level = []
+            for node in levels[-1]:
+                for dependent in targets[offsets[node]:offsets[node + 1]]:
+                    if not visited[dependent]:
+                        visited[dependent] = 1
+                        level.append(dependent)
+            if not level:
+                break
+            levels.append(level)
+        return levels
+
+    def to_packages(self):
+        """
+        Обратное преобразование в словарь {пакет: зависимости}.
+        """
+        names, bounds = self.names, self.offsets.tolist()
+        deps = list(map(names.__getitem__, self.targets.tolist()))
+        return {names[i]: deps[bounds[i]:bounds[i + 1]] for i in range(self.package_count)}
+
+
+def write_cache(cache_path, graph, sources):
+    """
+    Сохраняет граф в компактном двоичном виде: таблица имён, целочисленные массивы
+    прямой и обратной смежности (смещения и номера узлов), номера репозиториев пакетов
+    и хэши строф, если они есть. providers и alternatives пишутся отдельным JSON-разделом
+    в конце файла, а не в заголовке: он нужен только для update_graph, а заголовок
+    разбирается при каждой загрузке.
+    sources - отметки исходных файлов в порядке graph.repos.
+    """
+    if graph.reverse_offsets is None:
+        graph.build_reverse()
+    names_blob = "\n".join(graph.names).encode("utf-8")
+    names_blob += b"\0" * (-len(names_blob) % 4)  # Выравнивание массивов по 4 байта
+    state = b""
+    if graph.digests is not None:
+        state = json.dumps({"providers": graph.providers, "alternatives": graph.alternatives}).encode("utf-8")
+    header = json.dumps({
+        "sources": sources,
+        "repos": graph.repos,
+        "byteorder": sys.byteorder,
+        "packages": graph.package_count,
+        "names": len(graph.names),
+        "names_bytes": len(names_blob),
+        "digests": graph.digests is not None,
+        "state_bytes": len(state),
+    }).encode("utf-8")
+    header += b" " * (-(len(CACHE_MAGIC) + 4 + len(header)) % 4)
+
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(CACHE_MAGIC + struct.pack("<I", len(header)) + header)
+        f.write(names_blob)
+        f.write(graph.offsets.tobytes())
+        f.write(graph.targets.tobytes())
+        f.write(graph.origins.tobytes())
+        f.write(graph.reverse_offsets.tobytes())
+        f.write(graph.reverse_targets.tobytes())
+        if graph.digests is not None:
+            f.write(b"".join(map(graph.digests.__getitem__, graph.names[:graph.package_count])))
+            f.write(state)
+    os.replace(tmp_path, cache_path)  # Читатели никогда не видят недописанный кэш
+
+
+def read_cache_header(cache_path):
+    """
+    Читает заголовок кэша; None, если кэша нет или он другого формата.
+    """
+    try:
+        with open(cache_path, "rb") as f:
+            if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+            (size,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(size))
+    except (OSError, ValueError, struct.error):
+        return None
+    if header.get("byteorder") != sys.byteorder:
+        return None
+    header["data_offset"] = len(CACHE_MAGIC) + 4 + size
+    return header
+
+
+def read_cache(cache_path, header):
+    """
+    Загружает граф из кэша через mmap: массивы копируются целиком, без разбора.
+    """
+    with open(cache_path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    start = header["data_offset"]
+    view = memoryview(data)
+    names = bytes(view[start:start + header["names_bytes"]]).rstrip(b"\0").decode("utf-8").split("\n")
+    start += header["names_bytes"]
+    offsets = array("I")
+    offsets.frombytes(view[start:start + (header["packages"] + 1) * 4])
+    start += len(offsets) * 4
+    targets = array("I")
+    targets.frombytes(view[start:start + offsets[-1] * 4])
+    start += len(targets) * 4
+    origins = array("I")
+    origins.frombytes(view[start:start + header["packages"] * 4])
+    start += len(origins) * 4
+    reverse_offsets = array("I")
+    reverse_offsets.frombytes(view[start:start + (header["names"] + 1) * 4])
+    start += len(reverse_offsets) * 4
+    reverse_targets = array("I")
+    reverse_targets.frombytes(view[start:start + len(targets) * 4])
+    start += len(reverse_targets) * 4
+    graph = PackageGraph(names, header["packages"], offsets, targets, origins, header["repos"])
+    graph.reverse_offsets, graph.reverse_targets = reverse_offsets, reverse_targets
+    if header["digests"]:
+        blob = bytes(view[start:start + graph.package_count * 8])
+        graph.digests = {name: blob[i * 8:i * 8 + 8] for i, name in enumerate(names[:graph.package_count])}
+        start += len(blob)
+        state = bytes(view[start:start + header["state_bytes"]])
+        graph.state_loader = lambda: read_state(state)
+    view.release()
+    data.close()
+    return graph
+
+
+def read_state(state):
+    """
+    Разбирает раздел кэша с providers и alternatives.
+    """
+    state = json.loads(state)
+    # В JSON кортежи альтернатив стали списками
+    alternatives = {
+        name: [tuple(group) if type(group) is list else group for group in groups]
+        for name, groups in state["alternatives"].items()
+    }
+    return state["providers"], alternatives
+
+
+def index_paths(packages_gz):
+    """
+    Список путей к индексам: принимает один путь или последовательность путей.
+    """
+    if isinstance(packages_gz, (str, os.PathLike)):
+        return [os.fspath(packages_gz)]
+    return [os.fspath(file_path) for file_path in packages_gz]
+
+
+def default_cache_path(file_paths):
+    """
+    Кэш одного индекса лежит рядом с ним; кэш объединения нескольких - рядом с первым,
+    с именем, зависящим от полного набора индексов.
+    """
+    if len(file_paths) == 1:
+        return f"{file_paths[0]}.cache"
+    key = hashlib.sha256("\n".join(map(os.path.abspath, file_paths)).encode("utf-8")).hexdigest()[:16]
+    return f"{file_paths[0]}.{key}.cache"
+
+
+def parse_graph(file_paths, jobs=None):
+    """
+    Граф из одного или нескольких индексов без кэша.
+    """
+    if len(file_paths) == 1:
+        return PackageGraph.from_packages(parse_packages_gz(file_paths[0]), repos=file_paths)
+    packages, origins = parse_indexes(file_paths, jobs)
+    return PackageGraph.from_packages(packages, origins, file_paths)
+
+
+def graph_from_index(index, digests, repos):
+    """
+    Граф одного индекса вместе с состоянием разбора для инкрементального обновления.
+    """
+    providers = provider_index(index)
+    graph = PackageGraph.from_packages(resolve_dependencies(index, providers), repos=repos)
+    graph.digests = digests
+    graph.providers = providers
+    graph.alternatives = {
+        name: record["depends"] for name, record in index.items() if tuple in map(type, record["depends"])
+    }
+    return graph
+
+
+def read_graph(file_path):
+    """
+    Граф из одного Packages.gz с хэшами строф, чтобы следующую версию индекса можно было применить через update_graph.
+    """
+    with gzip.open(file_path, "rt", encoding="utf-8") as f, paused_gc():
+        index, digests = read_index_digests(f)
+        return graph_from_index(index, digests, [file_path])
+
+
+def update_graph(graph, file_path):
+    """
+    Применяет новую версию индекса к графу по разнице строф: разбираются и разрешаются
+    только добавленные и изменённые строфы, а также пакеты, у которых в альтернативах
+    упомянут добавленный или удалённый пакет; зависимости остальных берутся из старого графа.
+    Возвращает None, если нужен полный разбор: нет хэшей строф или изменились поставщики
+    виртуальных пакетов (это меняет разрешение зависимостей во всём индексе).
+    """
+    if graph.digests is None or len(graph.repos) != 1:
+        return None
+    with gzip.open(file_path, "rt", encoding="utf-8") as f, paused_gc():
+        index, digests = read_index_digests(f, graph.digests)
+    provided = {}  # Пакет -> виртуальные имена по прежнему индексу
+    for virtual, names in graph.providers.items():
+        for name in names:
+            provided.setdefault(name, set()).add(virtual)
+    delta = {name for name in graph.digests if name not in digests}  # Добавленные и удалённые пакеты
+    if not delta.isdisjoint(provided):
+        return None
+    records = {}
+    for name, record in index.items():
+        if record is None:
+            continue
+        if set(record["provides"]) != provided.get(name, set()):
+            return None
+        if name not in graph.digests:
+            delta.add(name)
+        records[name] = record
+    if not delta.isdisjoint(graph.providers):
+        return None  # Виртуальное имя стало реальным пакетом или наоборот
+
+    alternatives = {name: groups for name, groups in graph.alternatives.items() if index.get(name, 0) is None}
+    for name, groups in alternatives.items():
+        if any(type(group) is tuple and not delta.isdisjoint(group) for group in groups):
+            records[name] = {"depends": groups}
+    with paused_gc():
+        resolved = resolve_dependencies(index, graph.providers, records)
+        previous = graph.to_packages()
+        packages = {name: resolved[name] if name in resolved else previous[name] for name in digests}
+    updated = PackageGraph.from_packages(packages, repos=graph.repos)
+    updated.digests = digests
+    updated.providers = graph.providers
+    for name, record in records.items():
+        if tuple in map(type, record["depends"]):
+            alternatives[name] = record["depends"]
+        else:
+            alternatives.pop(name, None)
+    updated.alternatives = {name: alternatives[name] for name in digests if name in alternatives}
+    return updated
+
+
+def load_graph(file_paths, cache_path=None, jobs=None):
+    """
+    Возвращает граф зависимостей из одного или нескольких Packages.gz, используя двоичный кэш.
+    Кэш действителен, пока у всех индексов совпадают размер и время изменения; если изменилось
+    только время, сверяется SHA-256 и кэш переиспользуется. Новая версия единственного индекса
+    применяется к закэшированному графу инкрементально (update_graph).
+    """
+    file_paths = index_paths(file_paths)
+    cache_path = cache_path or default_cache_path(file_paths)
+    sources = [file_stamp(file_path) for file_path in file_paths]
+    header = read_cache_header(cache_path)
+    if header is not None and header["repos"] == file_paths:
+        fresh = []
+        for cached, source, file_path in zip(header["sources"], sources, file_paths):
+            if cached["size"] != source["size"]:
+                break
+            if cached["mtime_ns"] != source["mtime_ns"] and cached["sha256"] != file_hash(file_path):
+                break
+            fresh.append({**source, "sha256": cached["sha256"]})
+        else:
+            graph = read_cache(cache_path, header)
+            if fresh != header["sources"]:
+                write_cache(cache_path, graph, fresh)
+            return graph
+
+    graph = None
+    if header is not None and header["repos"] == file_paths and header["digests"]:
+        graph = update_graph(read_cache(cache_path, header), file_paths[0])
+    if graph is None:
+        graph = read_graph(file_paths[0]) if len(file_paths) == 1 else parse_graph(file_paths, jobs)
+    try:
+        write_cache(cache_path, graph, [
+            {**source, "sha256": file_hash(file_path)} for source, file_path in zip(sources, file_paths)
+        ])
+    except OSError:
+        pass  # Кэш - только ускорение, без него работа продолжается
+    return graph
+
+
+def load_packages(file_paths, cache_path=None):
+    """
+    То же, что load_graph, но в виде словаря {пакет: зависимости}.
+    """
+    return load_graph(file_paths, cache_path).to_packages()
+
+
+def closure_graph(packages, closure):
+    """
+    Граф {пакет: зависимости} для списка номеров пакетов из замыкания.
+    """
+    name_of = packages.names.__getitem__
+    return {name_of(node): list(map(name_of, packages.dependencies(node))) for node in closure}
+
+
+def batch_closures(packages, roots, max_depth):
+    """
+    Замыкания для нескольких корней над одним графом: {корень: номера пакетов}
+    (None, если корня нет в индексе). При неограниченной глубине уже вычисленные
+    замыкания переиспользуются: обход, встретивший корень из памяти, не идёт глубже.
+    """
+    memo = {}
+    unbounded = max_depth >= len(packages.names)
+    results = {}
+    for name in roots:
+        root = packages.ids.get(name)
+        if root is None or root >= packages.package_count:
+            results[name] = None
+            continue
+        if root not in memo:
+            memo[root] = packages.closure(root, max_depth, memo if unbounded else None)
+        results[name] = memo[root]
+    return results
+
+
+_worker_packages = None
+
+
+def _init_batch_worker(packages_gz, no_cache):
+    # Каждый процесс пула загружает граф один раз (из двоичного кэша - за миллисекунды)
+    global _worker_packages
+    _worker_packages = load_index(packages_gz, no_cache)
+
+
+def _batch_worker(roots, max_depth):
+    return batch_closures(_worker_packages, roots, max_depth)
+
+
+def parallel_closures(packages_gz, packages, roots, max_depth, jobs, no_cache=False):
+    """
+    Распределяет корни по пулу процессов; внутри каждой части замыкания общие.
+    Номера пакетов совпадают во всех процессах, так как граф строится из одних и тех же индексов.
+    """
+    if jobs <= 1 or len(roots) < 2:
+        return batch_closures(packages, roots, max_depth)
+    chunk = -(-len(roots) // jobs)
+    parts = [roots[i:i + chunk] for i in range(0, len(roots), chunk)]
+    results = {}
+    with ProcessPoolExecutor(jobs, initializer=_init_batch_worker, initargs=(packages_gz, no_cache)) as pool:
+        for part in pool.map(_batch_worker, parts, [max_depth] * len(parts)):
+            results.update(part)
+    return results
+
+
 def build_dependency_graph(package_name, packages, max_depth):
     """
-    Рекурсивно строит граф зависимостей до указанной глубины.
+    Строит граф зависимостей до указанной глубины итеративным обходом в ширину.
+    packages - PackageGraph или словарь {пакет: зависимости}.
+    """
+    if not isinstance(packages, PackageGraph):
+        packages = PackageGraph.from_packages(packages)
+    root = packages.ids.get(package_name)
+    if root is None:
+        return {}
+    return closure_graph(packages, packages.closure(root, max_depth))
+
+
+def subgraph_edges(packages, nodes):
+    """
+    Подграф PackageGraph на узлах nodes: списки смещений и номеров зависимостей
+    и отметки членства (рёбра к узлам вне nodes пропускаются при обходе).
+    """
+    member = bytearray(len(packages.names))
+    for node in nodes:
+        member[node] = 1
+    return packages.offsets.tolist(), packages.targets.tolist(), member
+
+
+@paused_gc()
+def strongly_connected_components(packages, nodes):
+    """
+    Компоненты сильной связности подграфа на узлах nodes (номера пакетов, например замыкание)
+    итеративным алгоритмом Тарьяна за O(V + E), прямо по массивам CSR.
+    Компоненты возвращаются в обратном топологическом порядке: каждая - после всех,
+    от которых она зависит, то есть в порядке установки.
+    """
+    offsets, targets, member = subgraph_edges(packages, nodes)
+    index = [-1] * len(member)
+    low = [0] * len(member)
+    position = offsets[:]  # Следующее непросмотренное ребро каждого узла
+    on_stack = bytearray(len(member))
+    stack = []
+    components = []
+    counter = 0
+    for start in nodes:
+        if index[start] >= 0:
+            continue
+        index[start] = low[start] = counter
+        counter += 1
+        stack.append(start)
+        on_stack[start] = 1
+        work = [start]  # Явный стек вызовов
+        while work:
+            node = work[-1]
+            edge, end = position[node], offsets[node + 1]
+            descend = None
+            while edge < end:
+                succ = targets[edge]
+                edge += 1
+                if not member[succ]:
+                    continue
+                if index[succ] < 0:
+                    descend = succ
+                    break
+                if on_stack[succ] and index[succ] < low[node]:
+                    low[node] = index[succ]
+            position[node] = edge
+            if descend is not None:
+                index[descend] = low[descend] = counter
+                counter += 1
+                stack.append(descend)
+                on_stack[descend] = 1
+                work.append(descend)
+                continue
+            work.pop()
+            if work:
+                parent = work[-1]
+                if low[node] < low[parent]:
+                    low[parent] = low[node]
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member_node = stack.pop()
+                    on_stack[member_node] = 0
+                    component.append(member_node)
+                    if member_node == node:
+                        break
+                components.append(component)
+    return components
+
+
+def install_order(packages, nodes):
+    """
+    Порядок установки пакетов подграфа: зависимости раньше зависящих от них.
+    Возвращает список групп имён; группа из нескольких пакетов - цикл, ставится целиком.
+    """
+    names = packages.names
+    return [[names[node] for node in component] for component in strongly_connected_components(packages, nodes)]
+
+
+@paused_gc()
+def transitive_reduction(packages, nodes):
+    """
+    Транзитивное сокращение подграфа: убирает ребро u -> v, если v достижим из u другим путём.
+    Считается на конденсации (графе компонент сильной связности): компоненты обходятся
+    в порядке установки, достижимость каждой хранится битовым множеством (int),
+    а рёбра к последователям проверяются от ближайших к дальним.
+    Рёбра внутри циклов сохраняются, между компонентами остаётся по одному исходному ребру.
+    Возвращает граф {пакет: зависимости}.
     """
-    graph = defaultdict(list)
-    visited = set()
+    offsets, targets, member = subgraph_edges(packages, nodes)
+    components = strongly_connected_components(packages, nodes)
+    component_of = [0] * len(member)
+    for number, component in enumerate(components):
+        for node in component:
+            component_of[node] = number
+
+    names = packages.names
+    reduced = {names[node]: [] for node in nodes}
+    reach = [0] * len(components)  # Бит d - компонента d достижима
+    for number, component in enumerate(components):
+        edges = {}  # Компонента-последователь -> первое исходное ребро в неё
+        for node in component:
+            for succ in targets[offsets[node]:offsets[node + 1]]:
+                if not member[succ]:
+                    continue
+                target = component_of[succ]
+                if target == number:
+                    reduced[names[node]].append(names[succ])
+                elif target not in edges:
+                    edges[target] = (node, succ)
+        reachable = 0
+        # Чем больше номер, тем ближе компонента к текущей в топологическом порядке
+        for target in sorted(edges, reverse=True):
+            if reachable >> target & 1:
+                continue
+            node, succ = edges[target]
+            reduced[names[node]].append(names[succ])
+            reachable |= reach[target] | 1 << target
+        reach[number] = reachable
+    return reduced
 
-    def traverse(package, depth):
-        if depth > max_depth or package in visited or package not in packages:
-            return
-        visited.add(package)
-        dependencies = packages.get(package, [])
-        graph[package].extend(dependencies)
+
+@paused_gc()
+def fan_stats(packages, nodes):
+    """
+    Число зависимостей (fan-out) и зависящих пакетов (fan-in) каждого узла подграфа:
+    {пакет: (fan_in, fan_out)}.
+    """
+    offsets, targets, member = subgraph_edges(packages, nodes)
+    fan_in = [0] * len(member)
+    fan_out = {}
+    for node in nodes:
+        inside = [succ for succ in targets[offsets[node]:offsets[node + 1]] if member[succ]]
+        fan_out[node] = len(inside)
+        for succ in inside:
+            fan_in[succ] += 1
+    names = packages.names
+    return {names[node]: (fan_in[node], out) for node, out in fan_out.items()}
+
+
+def iter_edges(graph):
+    """
+    Рёбра графа {пакет: зависимости} без повторов, в порядке графа.
+    """
+    for package, dependencies in graph.items():
+        for dep in dict.fromkeys(dependencies):
+            yield package, dep
+
+
+def iter_nodes(graph):
+    """
+    Узлы графа без повторов: пакеты, затем зависимости, которых нет среди ключей.
+    """
+    seen = set(graph)
+    yield from graph
+    for dependencies in graph.values():
         for dep in dependencies:
-            traverse(dep, depth + 1)
+            if dep not in seen:
+                seen.add(dep)
+                yield dep
 
-    traverse(package_name, 0)
-    return graph
+
+def write_mermaid(graph, stream):
+    """
+    Записывает граф в формате Mermaid в текстовый поток, ребро за ребром.
+    """
+    stream.write("graph TD\n")
+    for package, dep in iter_edges(graph):
+        stream.write(f"  {package} --> {dep}\n")
+
+
+def dot_id(name):
+    return '"' + name.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def write_dot(graph, stream):
+    """
+    Записывает граф в формате Graphviz DOT.
+    """
+    stream.write("digraph dependencies {\n")
+    for node in iter_nodes(graph):
+        stream.write(f"  {dot_id(node)};\n")
+    for package, dep in iter_edges(graph):
+        stream.write(f"  {dot_id(package)} -> {dot_id(dep)};\n")
+    stream.write("}\n")
+
+
+def write_json(graph, stream, **meta):
+    """
+    Записывает граф в JSON: поля meta, затем "graph": {пакет: зависимости}.
+    Граф пишется по одному пакету, без построения всего документа в памяти.
+    """
+    stream.write("{")
+    for key, value in meta.items():
+        stream.write(f"{json.dumps(key)}: {json.dumps(value, ensure_ascii=False)}, ")
+    stream.write('"graph": {')
+    for i, (package, dependencies) in enumerate(graph.items()):
+        stream.write(f"{', ' if i else ''}{json.dumps(package, ensure_ascii=False)}: ")
+        stream.write(json.dumps(list(dict.fromkeys(dependencies)), ensure_ascii=False))
+    stream.write("}}\n")
+
+
+def write_graphml(graph, stream):
+    """
+    Записывает граф в формате GraphML.
+    """
+    stream.write(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+        '  <graph id="dependencies" edgedefault="directed">\n'
+    )
+    for node in iter_nodes(graph):
+        stream.write(f"    <node id={quoteattr(node)}/>\n")
+    for package, dep in iter_edges(graph):
+        stream.write(f"    <edge source={quoteattr(package)} target={quoteattr(dep)}/>\n")
+    stream.write("  </graph>\n</graphml>\n")
+
+
+# Форматы вывода: имя -> (расширение файла, функция записи)
+FORMATS = {
+    "mermaid": (".mmd", write_mermaid),
+    "dot": (".dot", write_dot),
+    "json": (".json", write_json),
+    "graphml": (".graphml", write_graphml),
+}
+WRITERS = {extension: writer for extension, writer in FORMATS.values()}
+WRITERS[".gv"] = write_dot
 
 
 def graph_to_mermaid(graph):
     """
     Преобразует граф зависимостей в формат Mermaid.
     """
-    lines = ["graph TD"]
-    for package, dependencies in graph.items():
-        for dep in dependencies:
-            lines.append(f"  {package} --> {dep}")
-    return "\n".join(lines)
+    stream = io.StringIO()
+    write_mermaid(graph, stream)
+    return stream.getvalue().rstrip("\n")
 
 
-def generate_graph_image(mermaid_code, output_path, visualizer_path):
+def generate_graph_image(graph, output_path, visualizer_path, via_file=False):
     """
-    Генерирует графическое изображение графа.
+    Генерирует графическое изображение графа внешним визуализатором.
+    graph - словарь графа или, как прежде, готовый код Mermaid строкой (graph_to_mermaid).
+    Код Mermaid передаётся через стандартный ввод ("-i -"); с via_file - через
+    временный файл с уникальным именем, который удаляется после запуска.
     """
-    temp_mermaid_file = Path("temp_graph.mmd")
-    temp_mermaid_file.write_text(mermaid_code, encoding="utf-8")
+    def emit(stream):
+        if isinstance(graph, str):
+            stream.write(graph)
+        else:
+            write_mermaid(graph, stream)
+
+    if not via_file:
+        with subprocess.Popen(
+            [visualizer_path, "-i", "-", "-o", str(output_path)],
+            stdin=subprocess.PIPE, text=True, encoding="utf-8",
+        ) as process:
+            try:
+                emit(process.stdin)
+            finally:
+                process.stdin.close()
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, process.args)
+        return
 
+    with tempfile.NamedTemporaryFile("w", suffix=".mmd", encoding="utf-8", delete=False) as f:
+        emit(f)
     try:
-        subprocess.run(
-            [visualizer_path, "-i", str(temp_mermaid_file), "-o", str(output_path)],
-            check=True
-        )
+        subprocess.run([visualizer_path, "-i", f.name, "-o", str(output_path)], check=True)
     finally:
-        temp_mermaid_file.unlink()
+        os.unlink(f.name)
+
+
+def load_index(packages_gz, no_cache=False):
+    """
+    Загружает граф одного или объединения нескольких индексов: из двоичного кэша или разбором без кэша.
+    """
+    if no_cache:
+        return parse_graph(index_paths(packages_gz))
+    return load_graph(packages_gz)
+
+
+def read_roots(roots_file):
+    """
+    Список корней из файла или стандартного ввода ('-'): по одному имени в строке,
+    пустые строки и комментарии (#) пропускаются, повторы убираются.
+    """
+    stream = sys.stdin if roots_file == "-" else open(roots_file, encoding="utf-8")
+    try:
+        roots = [line.strip() for line in stream]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return list(dict.fromkeys(root for root in roots if root and not root.startswith("#")))
+
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="dependency_visualizer.py batch",
+        description="Графы зависимостей для списка пакетов за один запуск.",
+    )
+    parser.add_argument("packages_gz", help="Путь к файлу Packages.gz.")
+    parser.add_argument("roots_file", help="Файл со списком пакетов ('-' - стандартный ввод).")
+    parser.add_argument("max_depth", type=int, help="Максимальная глубина анализа зависимостей.")
+    parser.add_argument("output", help="Каталог для графов по каждому пакету (с --merge - файл общего графа).")
+    parser.add_argument("--format", choices=list(FORMATS), default="mermaid", help="Формат вывода.")
+    parser.add_argument("--merge", action="store_true", help="Объединить графы всех пакетов в один.")
+    parser.add_argument("--jobs", type=int, default=1, help="Число процессов для вычисления замыканий.")
+    parser.add_argument("--index", action="append", default=[], metavar="PACKAGES_GZ",
+                        help="Дополнительный Packages.gz другого репозитория (можно указать несколько раз).")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать двоичный кэш разобранного индекса.")
+    args = parser.parse_args(argv)
+
+    indexes = [args.packages_gz] + args.index
+    packages = load_index(indexes, args.no_cache)
+    roots = read_roots(args.roots_file)
+    closures = parallel_closures(indexes, packages, roots, args.max_depth, args.jobs, args.no_cache)
+    for root, closure in closures.items():
+        if closure is None:
+            print(f"Пакет '{root}' не найден в файле Packages.gz.")
+
+    found = {root: closure for root, closure in closures.items() if closure is not None}
+    extension, writer = FORMATS[args.format]
+    if args.merge:
+        merged = list(dict.fromkeys(node for closure in found.values() for node in closure))
+        graphs = {args.output: (sorted(found), closure_graph(packages, merged))}
+    else:
+        os.makedirs(args.output, exist_ok=True)
+        graphs = {
+            os.path.join(args.output, root + extension): ([root], closure_graph(packages, closure))
+            for root, closure in found.items()
+        }
+    for output_path, (graph_roots, graph) in graphs.items():
+        with open(output_path, "w", encoding="utf-8") as f:
+            if writer is write_json:
+                meta = {"roots": graph_roots, "max_depth": args.max_depth}
+                if args.index:
+                    meta["origins"] = {name: packages.origin(name) for name in graph}
+                write_json(graph, f, **meta)
+            else:
+                writer(graph, f)
+    print(f"Графов сохранено: {len(graphs)} ({len(found)} из {len(roots)} пакетов)")
+
+
+def rdepends_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="dependency_visualizer.py rdepends",
+        description="Обратные зависимости: какие пакеты затронет удаление пакета.",
+    )
+    parser.add_argument("packages_gz", help="Путь к файлу Packages.gz.")
+    parser.add_argument("package_name", help=(
+        "Имя пакета. Зависимости от виртуального имени, у которого есть поставщик, "
+        "при разборе переносятся на первого поставщика - укажите его имя."
+    ))
+    parser.add_argument("max_depth", type=int, help="Максимальная глубина обратных зависимостей.")
+    parser.add_argument("--format", choices=["text", "json"], default="text", help="Формат вывода.")
+    parser.add_argument("--index", action="append", default=[], metavar="PACKAGES_GZ",
+                        help="Дополнительный Packages.gz другого репозитория (можно указать несколько раз).")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать двоичный кэш разобранного индекса.")
+    args = parser.parse_args(argv)
+
+    packages = load_index([args.packages_gz] + args.index, args.no_cache)
+    root = packages.ids.get(args.package_name)
+    if root is None:
+        print(f"Пакет '{args.package_name}' не найден в файле Packages.gz.")
+        providers = packages.providers.get(args.package_name)  # Известны для графа одного индекса
+        if providers:
+            print(f"'{args.package_name}' - виртуальный пакет, его предоставляют: {', '.join(providers)}")
+        return
+    levels = packages.reverse_closure(root, args.max_depth)
+    if args.format == "json":
+        rdepends = {packages.names[node]: depth for depth, level in enumerate(levels[1:], 1) for node in level}
+        json.dump({"package": args.package_name, "max_depth": args.max_depth, "rdepends": rdepends},
+                  sys.stdout, ensure_ascii=False)
+        print()
+        return
+    for depth, level in enumerate(levels[1:], 1):
+        for name in sorted(packages.names[node] for node in level):
+            print(f"{depth}\t{name}")
+    print(f"От '{args.package_name}' зависят {sum(map(len, levels)) - 1} пакетов")
+
+
+def analysis_parser(command, description):
+    parser = argparse.ArgumentParser(prog=f"dependency_visualizer.py {command}", description=description)
+    parser.add_argument("packages_gz", help="Путь к файлу Packages.gz.")
+    parser.add_argument("package_name", help="Имя анализируемого пакета.")
+    parser.add_argument("max_depth", type=int, help="Максимальная глубина анализа зависимостей.")
+    parser.add_argument("--index", action="append", default=[], metavar="PACKAGES_GZ",
+                        help="Дополнительный Packages.gz другого репозитория (можно указать несколько раз).")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать двоичный кэш разобранного индекса.")
+    return parser
+
+
+def load_closure(args):
+    """
+    Граф индекса и замыкание пакета из аргументов analysis_parser - те же узлы,
+    что строит build_dependency_graph; None, если пакета нет.
+    """
+    packages = load_index([args.packages_gz] + args.index, args.no_cache)
+    if args.package_name not in packages:
+        print(f"Пакет '{args.package_name}' не найден в файле Packages.gz.")
+        return None, None
+    return packages, packages.closure(packages.ids[args.package_name], args.max_depth)
+
+
+def cycles_main(argv):
+    parser = analysis_parser("cycles", "Циклы зависимостей (компоненты сильной связности) в графе пакета.")
+    args = parser.parse_args(argv)
+    packages, nodes = load_closure(args)
+    if packages is None:
+        return
+    cycles = [component for component in strongly_connected_components(packages, nodes) if len(component) > 1]
+    cycles.sort(key=len, reverse=True)
+    for component in cycles:
+        print(f"{len(component)}: {' '.join(sorted(packages.names[node] for node in component))}")
+    print(f"Циклов: {len(cycles)}")
+
+
+def order_main(argv):
+    parser = analysis_parser("order", "Порядок установки пакетов графа: зависимости раньше зависящих.")
+    args = parser.parse_args(argv)
+    packages, nodes = load_closure(args)
+    if packages is None:
+        return
+    for group in install_order(packages, nodes):
+        # Пакеты одного цикла выводятся одной строкой: их можно ставить только вместе
+        print(" ".join(sorted(group)))
+
+
+def reduce_main(argv):
+    parser = analysis_parser("reduce", "Транзитивное сокращение графа зависимостей пакета.")
+    parser.add_argument("output_path", nargs="?", help=(
+        "Файл для сокращённого графа (.mmd, .dot, .gv, .json, .graphml); без него - Mermaid в стандартный вывод."
+    ))
+    args = parser.parse_args(argv)
+    packages, nodes = load_closure(args)
+    if packages is None:
+        return
+    reduced = transitive_reduction(packages, nodes)
+    if args.output_path is None:
+        write_mermaid(reduced, sys.stdout)
+        return
+    writer = WRITERS.get(Path(args.output_path).suffix.lower())
+    if writer is None:
+        parser.error(f"неизвестный формат файла: {args.output_path}")
+    with open(args.output_path, "w", encoding="utf-8") as f:
+        writer(reduced, f)
+    edges = sum(map(len, reduced.values()))
+    print(f"Сокращённый граф ({edges} рёбер) сохранён в {args.output_path}")
+
+
+def stats_main(argv):
+    parser = analysis_parser("stats", "Статистика графа пакета: fan-in и fan-out узлов, циклы.")
+    parser.add_argument("--top", type=int, default=10, help="Сколько узлов с наибольшими значениями выводить.")
+    args = parser.parse_args(argv)
+    packages, nodes = load_closure(args)
+    if packages is None:
+        return
+    stats = fan_stats(packages, nodes)
+    components = strongly_connected_components(packages, nodes)
+    edges = sum(out for _, out in stats.values())
+    print(f"Пакетов: {len(stats)}, рёбер: {edges}, компонент сильной связности: {len(components)},"
+          f" наибольшая: {max(map(len, components))}")
+    for title, column in (("fan-out", 1), ("fan-in", 0)):
+        print(f"Наибольший {title}:")
+        for name, values in sorted(stats.items(), key=lambda item: (-item[1][column], item[0]))[:args.top]:
+            print(f"  {values[column]:>6}  {name}")
+
+
+COMMANDS = {
+    "batch": batch_main,
+    "rdepends": rdepends_main,
+    "cycles": cycles_main,
+    "order": order_main,
+    "reduce": reduce_main,
+    "stats": stats_main,
+}
+
 
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
 
-def main():
     parser = argparse.ArgumentParser(description="Визуализатор графа зависимостей пакета Ubuntu.")
     parser.add_argument("packages_gz", help="Путь к файлу Packages.gz.")
     parser.add_argument("visualizer_path", help="Путь к программе для визуализации графов.")
     parser.add_argument("package_name", help="Имя анализируемого пакета.")
     parser.add_argument("max_depth", type=int, help="Максимальная глубина анализа зависимостей.")
-    parser.add_argument("output_path", help="Путь для сохранения графического файла.")
-    args = parser.parse_args()
+    parser.add_argument("output_path", help=(
+        "Путь для сохранения графа. Расширения .mmd, .dot, .gv, .json и .graphml записываются"
+        " без внешней программы, остальные (например .png, .svg) - через визуализатор."
+    ))
+    parser.add_argument("--via-file", action="store_true",
+                        help="Передавать граф визуализатору через временный файл, а не стандартный ввод.")
+    parser.add_argument("--index", action="append", default=[], metavar="PACKAGES_GZ",
+                        help="Дополнительный Packages.gz другого репозитория (можно указать несколько раз).")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать двоичный кэш разобранного индекса.")
+    args = parser.parse_args(argv)
 
-    packages = parse_packages_gz(args.packages_gz)
+    packages = load_index([args.packages_gz] + args.index, args.no_cache)
     if args.package_name not in packages:
         print(f"Пакет '{args.package_name}' не найден в файле Packages.gz.")
         return
+    if args.index:
+        print(f"Пакет '{args.package_name}' взят из {packages.origin(args.package_name)}")
 
     graph = build_dependency_graph(args.package_name, packages, args.max_depth)
-    mermaid_code = graph_to_mermaid(graph)
-    generate_graph_image(mermaid_code, args.output_path, args.visualizer_path)
+    writer = WRITERS.get(Path(args.output_path).suffix.lower())
+    if writer is not None:
+        with open(args.output_path, "w", encoding="utf-8") as f:
+            writer(graph, f)
+    else:
+        generate_graph_image(graph, args.output_path, args.visualizer_path, args.via_file)
     print(f"Граф зависимостей сохранён в {args.output_path}")
 
 
@@ -1,6 +1,15 @@
+import gzip
+import io
+import json
+import os
+import sys
+import xml.etree.ElementTree as ET
 import pytest
 from unittest.mock import patch, mock_open
-from dependency_visualizer import parse_packages_gz, build_dependency_graph, graph_to_mermaid
+from dependency_visualizer import (
+    parse_packages_gz, parse_relations, build_dependency_graph, generate_graph_image, graph_to_mermaid, iter_blocks, iter_stanzas, load_packages, PackageGraph,
+    batch_closures, compare_versions, strongly_connected_components, install_order, transitive_reduction, fan_stats, load_graph, main, read_cache_header, read_index_digests, stanza_record, write_dot, write_graphml, write_json,
+)
 
 
 def test_parse_packages_gz():
@@ -23,6 +32,67 @@ def test_parse_packages_gz():
     assert packages == expected
 
 
+def test_iter_stanzas_continuation_lines():
+    text = (
+        "Package: pkg1\n"
+        "Description: first line\n"
+        " Depends: not-a-field\n"
+        "Depends: pkg2 (>= 1.0),\n"
+        " pkg3\n"
+        "\n"
+        "\n"
+        "Package: pkg2\n"
+    )
+    stanzas = list(iter_stanzas(io.StringIO(text)))
+    assert stanzas == [
+        {"Package": "pkg1", "Depends": "pkg2 (>= 1.0), pkg3"},
+        {"Package": "pkg2"},
+    ]
+
+
+def test_iter_stanzas_empty_lines():
+    # Пустые строки в начале, подряд и пустой ввод не ломают разбор полей
+    assert list(iter_stanzas(io.StringIO(""))) == []
+    assert list(iter_stanzas(io.StringIO("\n"))) == []
+    text = "\n\nPackage: a\nDepends: b\n\n\n\nPackage: b"
+    assert list(iter_stanzas(io.StringIO(text))) == [{"Package": "a", "Depends": "b"}, {"Package": "b"}]
+    assert list(read_index_digests(io.StringIO(text))[0]) == ["a", "b"]
+
+
+def test_iter_stanzas_whitespace_separator():
+    # Строка из одних пробелов разделяет строфы, в том числе на границе блоков чтения
+    text = "Package: a\nDepends: b,\n c\n \nPackage: b\n\t\nPackage: c\nDepends: a\n"
+    expected = [{"Package": "a", "Depends": "b, c"}, {"Package": "b"}, {"Package": "c", "Depends": "a"}]
+    assert list(iter_stanzas(io.StringIO(text))) == expected
+    stanzas = [stanza for block in iter_blocks(io.StringIO(text), chunk_size=7)
+               for stanza in iter_stanzas(io.StringIO(block))]
+    assert stanzas == expected
+
+
+def test_parse_relations():
+    assert parse_relations("a (>= 1.0) | b:any, c [amd64], d <!nocheck>") == [("a", "b"), "c", "d"]
+    assert parse_relations("libc6 (>= 2.34), python3:any") == ["libc6", "python3"]
+
+
+def test_parse_packages_gz_relations():
+    mock_gz_content = (
+        "Package: app\n"
+        "Pre-Depends: init-system-helpers\n"
+        "Depends: missing | mta, python3:any (>= 3.8), default-dbus\n\n"
+        "Package: postfix\n"
+        "Provides: mta, default-mta\n\n"
+        "Package: exim4\n"
+        "Provides: mta\n\n"
+        "Package: python3\n\n"
+        "Package: default-dbus\n"
+        "Provides: default-dbus\n\n"
+    )
+    with patch("gzip.open", mock_open(read_data=mock_gz_content)):
+        packages = parse_packages_gz("dummy_path")
+    # Альтернатива "missing" не удовлетворима, mta предоставляет первый поставщик; реальный пакет важнее виртуального
+    assert packages["app"] == ["init-system-helpers", "postfix", "python3", "default-dbus"]
+
+
 def test_build_dependency_graph():
     packages = {
         "pkg1": ["pkg2", "pkg3"],
@@ -40,6 +110,28 @@ def test_build_dependency_graph():
     assert graph == expected
 
 
+def test_build_dependency_graph_deep_chain():
+    # Цепочка глубже предела рекурсии Python
+    packages = {f"pkg{i}": [f"pkg{i + 1}"] for i in range(5000)}
+    packages["pkg5000"] = []
+    graph = build_dependency_graph("pkg0", PackageGraph.from_packages(packages), 10000)
+    assert len(graph) == 5001
+
+
+def test_build_dependency_graph_min_depth():
+    # pkg3 достижим по длинному пути раньше, чем по короткому; учитываться должна минимальная глубина
+    packages = {
+        "pkg1": ["pkg2", "pkg3"],
+        "pkg2": ["pkg3"],
+        "pkg3": ["pkg4"],
+        "pkg4": [],
+    }
+    graph = build_dependency_graph("pkg1", packages, 2)
+    assert graph == {"pkg1": ["pkg2", "pkg3"], "pkg2": ["pkg3"], "pkg3": ["pkg4"], "pkg4": []}
+    assert build_dependency_graph("pkg1", packages, 0) == {"pkg1": ["pkg2", "pkg3"]}
+    assert build_dependency_graph("missing", packages, 2) == {}
+
+
 def test_graph_to_mermaid():
     graph = {
         "pkg1": ["pkg2", "pkg3"],
@@ -48,3 +140,247 @@ def test_graph_to_mermaid():
     mermaid = graph_to_mermaid(graph)
     expected = "graph TD\n  pkg1 --> pkg2\n  pkg1 --> pkg3\n  pkg2 --> pkg4"
     assert mermaid.strip() == expected.strip()
+
+
+def test_streaming_writers_dedupe():
+    graph = {"pkg1": ["pkg2", "pkg2", 'odd"name'], "pkg2": ["pkg1"]}
+    dot = io.StringIO()
+    write_dot(graph, dot)
+    assert dot.getvalue().count('"pkg1" -> "pkg2";') == 1
+    assert '"odd\\"name";' in dot.getvalue()
+
+    graphml = io.StringIO()
+    write_graphml(graph, graphml)
+    root = ET.fromstring(graphml.getvalue())
+    ns = "{http://graphml.graphdrawing.org/xmlns}"
+    assert [node.get("id") for node in root.iter(ns + "node")] == ["pkg1", "pkg2", 'odd"name']
+    assert len(list(root.iter(ns + "edge"))) == 3
+
+    document = io.StringIO()
+    write_json(graph, document, roots=["pkg1"])
+    assert json.loads(document.getvalue()) == {
+        "roots": ["pkg1"], "graph": {"pkg1": ["pkg2", 'odd"name'], "pkg2": ["pkg1"]},
+    }
+
+
+def test_main_output_formats(tmp_path):
+    packages_gz = tmp_path / "Packages.gz"
+    write_packages_gz(packages_gz, "Package: pkg1\nDepends: pkg2\n\nPackage: pkg2\n\n")
+    # Внешний визуализатор получает код Mermaid через стандартный ввод
+    visualizer = tmp_path / "visualizer.py"
+    visualizer.write_text(
+        "import sys\n"
+        "assert sys.argv[1:3] == ['-i', '-']\n"
+        "open(sys.argv[4], 'w').write(sys.stdin.read())\n",
+        encoding="utf-8",
+    )
+    visualizer.chmod(0o755)
+    wrapper = tmp_path / "visualizer.sh"
+    wrapper.write_text(f"#!/bin/sh\nexec {sys.executable} {visualizer} \"$@\"\n", encoding="utf-8")
+    wrapper.chmod(0o755)
+
+    main([str(packages_gz), str(wrapper), "pkg1", "5", str(tmp_path / "graph.svg")])
+    assert (tmp_path / "graph.svg").read_text(encoding="utf-8") == "graph TD\n  pkg1 --> pkg2\n"
+    # Прежний вызов с готовым кодом Mermaid строкой
+    generate_graph_image(graph_to_mermaid({"a": ["b"]}), tmp_path / "text.svg", str(wrapper))
+    assert "a --> b" in (tmp_path / "text.svg").read_text(encoding="utf-8")
+    main([str(packages_gz), str(tmp_path / "missing-visualizer"), "pkg1", "5", str(tmp_path / "graph.dot")])
+    assert '"pkg1" -> "pkg2";' in (tmp_path / "graph.dot").read_text(encoding="utf-8")
+
+
+def write_packages_gz(path, content):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(content)
+
+
+def test_load_packages_cache(tmp_path):
+    packages_gz = tmp_path / "Packages.gz"
+    write_packages_gz(packages_gz, "Package: pkg1\nDepends: pkg2, virtual\n\nPackage: pkg2\n\n")
+    expected = {"pkg1": ["pkg2", "virtual"], "pkg2": []}
+    assert load_packages(str(packages_gz)) == expected
+    assert (tmp_path / "Packages.gz.cache").exists()
+
+    # Повторная загрузка и загрузка после touch не разбирают индекс заново
+    with patch("dependency_visualizer.read_index_digests", side_effect=AssertionError):
+        assert load_packages(str(packages_gz)) == expected
+        os.utime(packages_gz, ns=(0, 0))
+        assert load_packages(str(packages_gz)) == expected
+
+    write_packages_gz(packages_gz, "Package: pkg3\nDepends: pkg1\n\n")
+    assert load_packages(str(packages_gz)) == {"pkg3": ["pkg1"]}
+
+
+BATCH_PACKAGES = {
+    "app": ["lib1", "lib2"],
+    "lib1": ["libc"],
+    "lib2": ["lib1", "virtual"],
+    "libc": ["lib2"],  # Цикл lib1 -> libc -> lib2 -> lib1
+    "tool": ["libc"],
+}
+
+
+def test_batch_closures_match_single_queries():
+    graph = PackageGraph.from_packages(BATCH_PACKAGES)
+    roots = ["lib1", "app", "tool", "missing"]
+    for max_depth in (1, 100):
+        results = batch_closures(graph, roots, max_depth)
+        assert results["missing"] is None
+        for root in roots[:3]:
+            expected = set(graph.closure(graph.ids[root], max_depth))
+            assert set(results[root]) == expected
+
+
+def test_batch_cli(tmp_path):
+    packages_gz = tmp_path / "Packages.gz"
+    write_packages_gz(packages_gz, "".join(
+        f"Package: {name}\nDepends: {', '.join(deps)}\n\n" for name, deps in BATCH_PACKAGES.items()
+    ))
+    roots_file = tmp_path / "roots.txt"
+    roots_file.write_text("# корни\napp\ntool\napp\n", encoding="utf-8")
+
+    main(["batch", str(packages_gz), str(roots_file), "10", str(tmp_path / "out"), "--jobs", "2"])
+    assert sorted(os.listdir(tmp_path / "out")) == ["app.mmd", "tool.mmd"]
+    assert "  tool --> libc" in (tmp_path / "out" / "tool.mmd").read_text(encoding="utf-8")
+
+    merged = tmp_path / "merged.json"
+    main(["batch", str(packages_gz), str(roots_file), "1", str(merged), "--format", "json", "--merge"])
+    data = json.loads(merged.read_text(encoding="utf-8"))
+    assert data["roots"] == ["app", "tool"]
+    assert set(data["graph"]) == {"app", "lib1", "lib2", "tool", "libc"}
+
+
+def test_compare_versions():
+    ordered = ["1.0~rc1", "1.0", "1.0-1", "1.0-1ubuntu1", "1.0-2", "1.0a", "1.0.1", "1.2", "1.10", "1:0.9"]
+    for lower, higher in zip(ordered, ordered[1:]):
+        assert compare_versions(lower, higher) < 0
+        assert compare_versions(higher, lower) > 0
+    assert compare_versions("1.01-1", "1.1-1") == 0
+
+
+def test_merge_indexes(tmp_path):
+    main_gz = tmp_path / "main.gz"
+    updates_gz = tmp_path / "updates.gz"
+    write_packages_gz(main_gz, (
+        "Package: app\nVersion: 1.0-1\nDepends: libold\n\n"
+        "Package: libold\nVersion: 1.0\n\n"
+        "Package: libc\nVersion: 2.35-0ubuntu3.1\n\n"
+    ))
+    write_packages_gz(updates_gz, (
+        "Package: app\nVersion: 1.0-1ubuntu0.1\nDepends: libnew, libc\n\n"
+        "Package: libnew\nVersion: 2.0\n\n"
+        "Package: libc\nVersion: 2.35-0ubuntu3~bpo1\n\n"
+    ))
+    graph = load_graph([str(main_gz), str(updates_gz)], jobs=2)
+    assert graph.to_packages()["app"] == ["libnew", "libc"]
+    assert graph.origin("app") == str(updates_gz)
+    assert graph.origin("libc") == str(main_gz)
+    assert graph.origin("libnew") == str(updates_gz)
+
+    # Кэш объединения хранит и номера репозиториев
+    with patch("dependency_visualizer.parse_indexes", side_effect=AssertionError):
+        cached = load_graph([str(main_gz), str(updates_gz)])
+    assert cached.to_packages() == graph.to_packages()
+    assert cached.origin("app") == str(updates_gz)
+
+
+def test_reverse_closure():
+    graph = PackageGraph.from_packages(BATCH_PACKAGES)
+    levels = graph.reverse_closure(graph.ids["libc"], 10)
+    assert [sorted(graph.names[node] for node in level) for level in levels] == [
+        ["libc"], ["lib1", "tool"], ["app", "lib2"],
+    ]
+    assert len(graph.reverse_closure(graph.ids["virtual"], 1)) == 2
+
+
+def test_incremental_update(tmp_path):
+    packages_gz = tmp_path / "Packages.gz"
+    stanzas = {
+        "app": "Package: app\nDepends: web | httpd, lib1\n\n",
+        "lib1": "Package: lib1\nDepends: libc\n\n",
+        "libc": "Package: libc\n\n",
+        "httpd": "Package: httpd\n\n",
+        "tool": "Package: tool\nDepends: lib1\n\n",
+    }
+    write_packages_gz(packages_gz, "".join(stanzas.values()))
+    assert load_packages(str(packages_gz))["app"] == ["httpd", "lib1"]
+    # Состояние разбора не попадает в заголовок и читается только при обращении
+    assert "alternatives" not in read_cache_header(f"{packages_gz}.cache")
+    cached = load_graph(str(packages_gz))
+    assert cached.state_loader is not None
+    assert cached.alternatives == {"app": [("web", "httpd"), "lib1"]}
+    assert cached.state_loader is None
+
+    # Изменена одна строфа, удалён tool, добавлен web - первая альтернатива app
+    stanzas["lib1"] = "Package: lib1\nVersion: 2\nDepends: libc, libz\n\n"
+    del stanzas["tool"]
+    stanzas["web"] = "Package: web\n\n"
+    write_packages_gz(packages_gz, "".join(stanzas.values()))
+    with patch("dependency_visualizer.stanza_record", wraps=stanza_record) as parsed:
+        graph = load_graph(str(packages_gz))
+    assert sorted(call.args[0]["Package"] for call in parsed.call_args_list) == ["lib1", "web"]
+    assert graph.to_packages() == {
+        "app": ["web", "lib1"], "lib1": ["libc", "libz"], "libc": [], "httpd": [], "web": [],
+    }
+    levels = graph.reverse_closure(graph.ids["libc"], 5)
+    assert [sorted(graph.names[node] for node in level) for level in levels] == [["libc"], ["lib1"], ["app"]]
+
+    # Смена Provides требует полного разбора
+    stanzas["libc"] = "Package: libc\nProvides: libc-abi\n\n"
+    write_packages_gz(packages_gz, "".join(stanzas.values()))
+    with patch("dependency_visualizer.stanza_record", wraps=stanza_record) as parsed:
+        assert load_graph(str(packages_gz)).providers == {"libc-abi": ["libc"]}
+    assert parsed.call_count == 1 + len(stanzas)  # Изменённая строфа, затем весь индекс
+
+
+def test_rdepends_cli(tmp_path, capsys):
+    packages_gz = tmp_path / "Packages.gz"
+    write_packages_gz(packages_gz, "".join(
+        f"Package: {name}\nDepends: {', '.join(deps)}\n\n" for name, deps in BATCH_PACKAGES.items()
+    ))
+    main(["rdepends", str(packages_gz), "libc", "1"])
+    assert capsys.readouterr().out.splitlines() == ["1\tlib1", "1\ttool", "От 'libc' зависят 2 пакетов"]
+    main(["rdepends", str(packages_gz), "libc", "5", "--format", "json"])
+    data = json.loads(capsys.readouterr().out)
+    assert data["rdepends"] == {"lib1": 1, "tool": 1, "app": 2, "lib2": 2}
+
+    # Зависимости от виртуального имени перенесены на поставщика: он и указывается в rdepends
+    write_packages_gz(packages_gz, (
+        "Package: app\nDepends: mta\n\nPackage: exim4\nProvides: mta\n\nPackage: postfix\nProvides: mta\n\n"
+    ))
+    main(["rdepends", str(packages_gz), "mta", "2"])
+    assert capsys.readouterr().out.splitlines() == [
+        "Пакет 'mta' не найден в файле Packages.gz.", "'mta' - виртуальный пакет, его предоставляют: exim4, postfix",
+    ]
+    main(["rdepends", str(packages_gz), "exim4", "2"])
+    assert capsys.readouterr().out.splitlines() == ["1\tapp", "От 'exim4' зависят 1 пакетов"]
+
+
+def test_graph_analytics():
+    graph = PackageGraph.from_packages(BATCH_PACKAGES)
+    nodes = graph.closure(graph.ids["app"], 10)
+    components = [sorted(graph.names[node] for node in c) for c in strongly_connected_components(graph, nodes)]
+    assert components == [["lib1", "lib2", "libc"], ["app"]]
+    order = install_order(graph, range(graph.package_count))
+    assert sorted(order[0]) == ["lib1", "lib2", "libc"]
+    assert sorted(map(tuple, order[1:])) == [("app",), ("tool",)]
+
+    reduced = transitive_reduction(graph, nodes)
+    assert reduced["app"] == ["lib1"]  # Одно ребро в цикл вместо двух
+    assert reduced["libc"] == ["lib2"]
+
+    dag = PackageGraph.from_packages({"a": ["b", "c", "d"], "b": ["c"], "c": ["d"], "d": []})
+    assert transitive_reduction(dag, range(4)) == {"a": ["b"], "b": ["c"], "c": ["d"], "d": []}
+    assert fan_stats(dag, range(4)) == {"a": (0, 3), "b": (1, 1), "c": (2, 1), "d": (2, 0)}
+
+
+def test_analysis_cli(tmp_path, capsys):
+    packages_gz = tmp_path / "Packages.gz"
+    write_packages_gz(packages_gz, "".join(
+        f"Package: {name}\nDepends: {', '.join(deps)}\n\n" for name, deps in BATCH_PACKAGES.items()
+    ))
+    main(["cycles", str(packages_gz), "app", "10"])
+    assert capsys.readouterr().out.splitlines() == ["3: lib1 lib2 libc", "Циклов: 1"]
+    main(["order", str(packages_gz), "tool", "10"])
+    assert capsys.readouterr().out.splitlines() == ["lib1 lib2 libc", "tool"]
+    main(["reduce", str(packages_gz), "app", "10", str(tmp_path / "reduced.json")])
+    assert json.loads((tmp_path / "reduced.json").read_text(encoding="utf-8"))["graph"]["app"] == ["lib1"]
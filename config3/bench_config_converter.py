@@ -0,0 +1,244 @@
+import argparse
+import io
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from collections import ChainMap
+import toml
+from config_converter import TEMPLATE_NAME, ConfigConverter, ConfigSession, is_expression, parse_output, write_toml
+
+
+def make_config(size_mb, seed=0):
+    """
+    Синтетическая конфигурация, вывод которой занимает примерно size_mb мегабайт:
+    разделы магазинов с товарами - строки с подстановками, числа, списки и выражения.
+    """
+    rng = random.Random(seed)
+    data = {"Currency": "EUR", "Tax": 0.2}
+    products_per_store = 200
+    # Товар в выводе занимает около 300 байт
+    stores = max(1, int(size_mb * 2 ** 20 / 300 / products_per_store))
+    for s in range(stores):
+        store = {"City": f"City{rng.randrange(1000)}", "Open": True}
+        for p in range(products_per_store):
+            store[f"Product{p}"] = {
+                "Name": f"Item {s}-{p}",
+                "Label": "Item {Name} in {City}, {Currency}",
+                "Price": rng.randint(1, 5000),
+                "Count": rng.randint(0, 100),
+                "Total": "{Price * Count * (1 + Tax)}",
+                "Tags": [f"tag{rng.randrange(50)}" for _ in range(rng.randint(1, 5))],
+            }
+        data[f"Store{s}"] = store
+    return data
+
+
+def make_strings_config(size_mb, seed=0):
+    """
+    Конфигурация из строк с подстановками {name}: имена уровня сервиса, окружения,
+    корня и констант, списки строк - без выражений, чтобы замер показывал только подстановку.
+    """
+    rng = random.Random(seed)
+    data = {"Domain": "example.org", "Region": "eu-west"}
+    services_per_env = 100
+    # Сервис в выводе занимает около 1500 байт
+    envs = max(1, int(size_mb * 2 ** 20 / 1500 / services_per_env))
+    for e in range(envs):
+        env = {"Env": f"env{e}", "Tier": rng.choice(["prod", "stage", "dev"])}
+        for i in range(services_per_env):
+            env[f"Service{i}"] = {
+                "Name": f"svc{i}",
+                "Host": "host-{Name}.{Env}.{Region}.{Domain}",
+                "Url": "https://{Name}.{Env}.{Domain}:{Port}/{Version}",
+                "Port": 8000 + i,
+                "Image": "registry.{Domain}/{Tier}/{Name}:{Version}",
+                "Log": "/var/log/{Env}/{Name}.log",
+                "Owner": "team-{Tier}@{Domain}",
+                "Labels": ["app={Name}", "env={Env}", "tier={Tier}", "region={Region}"],
+                "Description": "Service {Name} in {Env} ({Tier}), region {Region}, unknown {Missing}",
+                "Plain": "no substitutions in this string at all",
+            }
+        data[f"Env{e}"] = env
+    return data
+
+
+class SubConverter(ConfigConverter):
+    """
+    Прежняя подстановка: новая ChainMap с константами для каждого значения и элемента списка,
+    re.sub с lambda для каждой строки. Используется как эталон для сравнения.
+    """
+
+    def resolve_value(self, value, scope, delay_expressions=False):
+        full_context = ChainMap(scope, self.constants)
+        if is_expression(value):
+            return value if delay_expressions else self._evaluate(value[1:-1], full_context)
+        elif isinstance(value, str):
+            return TEMPLATE_NAME.sub(lambda match: str(full_context.get(match.group(1), match.group(0))), value)
+        elif isinstance(value, dict):
+            return {k: self.resolve_value(v, full_context, delay_expressions) for k, v in value.items()}
+        elif isinstance(value, list):
+            return [self.resolve_value(item, full_context, delay_expressions) for item in value]
+        return value
+
+
+def render_concat(converter, values, indent=0):
+    """
+    Прежний способ вывода: каждый уровень собирает строку конкатенацией и возвращает её родителю.
+    Используется как эталон для сравнения.
+    """
+    output = "begin\n"
+    indent_str = '    ' * indent
+    for key, value in values.items():
+        if isinstance(value, dict):
+            output += f"{indent_str}    {key} := {render_concat(converter, value, indent + 1)};\n"
+        else:
+            output += f"{indent_str}    {key} := {converter.format_value(value)};\n"
+    return output + f"{indent_str}end"
+
+
+def measure(convert):
+    """
+    Время и пик памяти по tracemalloc; замеряются разными прогонами, так как tracemalloc замедляет работу.
+    """
+    start = time.perf_counter()
+    convert()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    convert()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+
+def measure_session(data, edits=200):
+    """
+    Задержка правок в ConfigSession, в миллисекундах (медиана и максимум): правка цены одного
+    товара (пересчитывается его Total) и повторный вывод после неё; время правки общего ключа Tax,
+    от которого зависят Total всех товаров.
+    """
+    start = time.perf_counter()
+    session = ConfigSession(data)
+    session.generate_output()
+    build = time.perf_counter() - start
+    rng = random.Random(1)
+    stores = [key for key in data if key.startswith("Store")]
+    samples = {"правка ключа": [], "вывод": []}
+    for i in range(edits):
+        path = (rng.choice(stores), f"Product{rng.randrange(200)}", "Price")
+        start = time.perf_counter()
+        session.set(path, 5000 + i)
+        samples["правка ключа"].append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        session.write_output(io.StringIO())
+        samples["вывод"].append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    changed = session.set("Tax", 0.25)
+    constant = (time.perf_counter() - start) * 1000
+    report = {}
+    for name, values in samples.items():
+        values.sort()
+        report[name] = (values[len(values) // 2], values[-1])
+    return build, report, constant, len(changed)
+
+
+def measure_parse(text):
+    """
+    Разбор выходного текста parse_output и запись разобранного в TOML (write_toml)
+    в сравнении с библиотекой toml на том же содержимом: toml.loads и toml.dumps.
+    """
+    size_mb = len(text.encode("utf-8")) / 2 ** 20
+    report = {}
+    start = time.perf_counter()
+    data = parse_output(text)
+    report["parse_output"] = time.perf_counter() - start
+    stream = io.StringIO()
+    start = time.perf_counter()
+    write_toml(data, stream)
+    report["write_toml"] = time.perf_counter() - start
+    toml_text = stream.getvalue()
+    start = time.perf_counter()
+    toml.loads(toml_text)
+    report["toml.loads"] = time.perf_counter() - start
+    start = time.perf_counter()
+    toml.dumps(data)
+    report["toml.dumps"] = time.perf_counter() - start
+    return size_mb, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк вывода ConfigConverter на больших конфигурациях.")
+    parser.add_argument("--sizes", default="10,100", help="Размеры вывода в МБ через запятую.")
+    parser.add_argument("--strings", action="store_true",
+                        help="Замерить подстановку {name} на конфигурации из строк вместо общего замера.")
+    parser.add_argument("--parse", action="store_true",
+                        help="Замерить обратный разбор вывода и запись в TOML вместо общего замера.")
+    parser.add_argument("--session", action="store_true", help="Замерить задержку правок в ConfigSession.")
+    parser.add_argument("--no-memory", action="store_true", help="Не замерять пик памяти (прогон с tracemalloc долгий).")
+    args = parser.parse_args()
+
+    converter = ConfigConverter()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, "output.cfg")
+        for size_mb in (float(size) for size in args.sizes.split(",")):
+            if args.strings:
+                data = make_strings_config(size_mb)
+                print(f"== конфигурация из строк на {size_mb:g} МБ вывода")
+                constants = {"Version": "1.4.2"}
+                times = {}
+                for name, converter in (("re.sub", SubConverter(constants)), ("шаблоны", ConfigConverter(constants))):
+                    scope = ChainMap({}, constants)
+                    converter.evaluate_block(data, scope, {})  # Прогрев кэшей выражений и шаблонов
+                    start = time.perf_counter()
+                    converter.evaluate_block(data, scope, {})
+                    times[name] = time.perf_counter() - start
+                    print(f"{name:<9} {times[name]:>7.2f} с")
+                print(f"ускорение: {times['re.sub'] / times['шаблоны']:.2f}x")
+                continue
+            data = make_config(size_mb)
+            if args.parse:
+                text_mb, report = measure_parse(ConfigConverter().generate_output(data))
+                print(f"== разбор вывода на {text_mb:.1f} МБ")
+                for name, elapsed in report.items():
+                    print(f"{name:<13} {elapsed:>7.2f} с {text_mb / elapsed:>7.1f} МБ/с")
+                continue
+            print(f"== конфигурация на {size_mb:g} МБ вывода")
+            start = time.perf_counter()
+            values = converter.evaluate_block(data, ChainMap({}, converter.constants), {})
+            print(f"вычисление значений: {time.perf_counter() - start:.2f} с")
+
+            def to_file():
+                with open(output_path, "w", encoding="utf-8") as f:
+                    converter.emit_block(values, f)
+
+            # Вывод уже вычисленного дерева: пик памяти - только то, что занимает сам вывод
+            cases = (
+                ("concat", lambda: render_concat(converter, values)),
+                ("stringio", lambda: converter.emit_block(values, io.StringIO())),
+                ("file", to_file),
+            )
+            print(f"{'вывод':<9} {'время, с':>9} {'МБ/с':>7} {'пик памяти, МБ':>15}")
+            for name, convert in cases:
+                if args.no_memory:
+                    start = time.perf_counter()
+                    convert()
+                    elapsed, peak = time.perf_counter() - start, float("nan")
+                else:
+                    elapsed, peak = measure(convert)
+                print(f"{name:<9} {elapsed:>9.2f} {size_mb / elapsed:>7.1f} {peak:>15.1f}")
+            print(f"размер файла: {os.path.getsize(output_path) / 2 ** 20:.1f} МБ")
+            start = time.perf_counter()
+            converter.generate_output(data)
+            print(f"generate_output целиком: {time.perf_counter() - start:.2f} с")
+            if args.session:
+                build, report, constant, changed = measure_session(data)
+                print(f"ConfigSession: построение и первый вывод {build:.2f} с")
+                print(f"{'операция':<14} {'медиана, мс':>12} {'максимум, мс':>13}")
+                for name, (median, worst) in report.items():
+                    print(f"{name:<14} {median:>12.3f} {worst:>13.3f}")
+                print(f"правка общего ключа Tax: {constant:.1f} мс, изменилось ключей: {changed}")
+
+
+if __name__ == "__main__":
+    main()
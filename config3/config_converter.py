@@ -1,83 +1,1070 @@
-import re
+import argparse
+import ast
 import copy
+import datetime
+import glob
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import sys
+from collections import ChainMap
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 import toml
 class ConfigError(Exception):
     """Класс для обработки ошибок конфигурации."""
     pass
 
+
+# Разрешённые конструкции выражений: арифметика, сравнения, логика, имена,
+# литералы, индексация и вызовы функций из белого списка
+ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+    ast.Constant, ast.Name, ast.Load, ast.Call, ast.List, ast.Tuple, ast.Subscript, ast.Slice,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub, ast.Not, ast.And, ast.Or,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+)
+MAX_INT_BITS = 1 << 16  # Наибольший размер целого результата, около 20 000 десятичных цифр
+MAX_SEQUENCE_LENGTH = 1 << 20  # Наибольшее общее число элементов и символов значения, включая вложенные
+
+
+def check_int_bits(bits):
+    if bits > MAX_INT_BITS:
+        raise ValueError(f"Слишком большое целое число: около {bits} бит")
+
+
+def sequence_size(value, limit=MAX_SEQUENCE_LENGTH):
+    """
+    Общее число элементов значения вместе с вложенными списками, словарями и символами строк;
+    один и тот же вложенный список считается столько раз, сколько раз он встречается
+    (столько его копий дадут str() и вывод). Обход останавливается, как только
+    размер превысил limit, поэтому даже [[0] * 2 ** 20] * 2 ** 20 проверяется быстро.
+    """
+    total = 0
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            total += len(item)
+        elif isinstance(item, (list, tuple)):
+            total += len(item)
+            if total <= limit:
+                stack.extend(item)
+        elif isinstance(item, dict):
+            total += len(item)
+            if total <= limit:
+                stack.extend(item.values())
+        if total > limit:
+            break
+    return total
+
+
+def check_sequence_size(size):
+    if size > MAX_SEQUENCE_LENGTH:
+        raise ValueError(f"Слишком большое значение: больше {MAX_SEQUENCE_LENGTH} элементов и символов")
+
+
+def safe_pow(base, exponent):
+    """
+    Возведение в степень с ограничением размера результата, чтобы 9 ** 9 ** 9
+    не останавливало конвертацию: для целых он оценивается заранее как
+    base.bit_length() * exponent. Вещественная степень вычисляется за постоянное время.
+    """
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0 and abs(base) > 1:
+        check_int_bits(base.bit_length() * exponent)
+    return base ** exponent
+
+
+def safe_mul(left, right):
+    """
+    Умножение с ограничением размера целого результата и размера повторённой строки
+    или списка - с учётом вложенных списков (sequence_size).
+    """
+    if isinstance(left, int) and isinstance(right, int):
+        check_int_bits(left.bit_length() + right.bit_length())
+    elif isinstance(left, (str, list, tuple)) and isinstance(right, int):
+        if right > 0:
+            check_sequence_size(sequence_size(left) * right)
+    elif isinstance(right, (str, list, tuple)) and isinstance(left, int):
+        return safe_mul(right, left)
+    return left * right
+
+
+def safe_mod(left, right):
+    """Остаток от деления; форматирование строк через % недоступно: ширина поля не ограничена."""
+    if isinstance(left, str):
+        raise ValueError("Форматирование строк через % недоступно")
+    return left % right
+
+
+def safe_sum(values, start=0):
+    """sum только для чисел: сложение списков и строк через sum растёт квадратично."""
+    if not isinstance(start, (int, float)):
+        raise ValueError("sum принимает только числовое начальное значение")
+    return sum(values, start)
+
+
+def safe_str(value=""):
+    """str с ограничением размера значения: текст списка растёт вместе с вложенными повторами."""
+    check_sequence_size(sequence_size(value))
+    return str(value)
+
+
+# Функции, доступные в выражениях; встроенные функции Python недоступны
+FUNCTIONS = {
+    "abs": abs, "bool": bool, "ceil": math.ceil, "float": float, "floor": math.floor, "int": int,
+    "len": len, "max": max, "min": min, "round": round, "sqrt": math.sqrt, "str": safe_str, "sum": safe_sum,
+}
+# Операторы, результат которых может быть сколь угодно большим, вычисляются через функции с проверкой размера
+SAFE_OPERATORS = {ast.Pow: "_pow", ast.Mult: "_mul", ast.Mod: "_mod"}
+OPERATOR_FUNCTIONS = {"_pow": safe_pow, "_mul": safe_mul, "_mod": safe_mod}
+SAFE_GLOBALS = {"__builtins__": {}, **OPERATOR_FUNCTIONS, **FUNCTIONS}
+KEY_NAME = re.compile(r"[A-Za-z_]\w*")
+TEMPLATE_NAME = re.compile(r"{(\w+)}")
+
+
+@lru_cache(maxsize=4096)
+def compile_template(value):
+    """
+    Разбирает строку с подстановками {name} в шаблон - кортеж сегментов, где на чётных
+    местах литералы, на нечётных имена. Результат кэшируется по содержимому строки:
+    одинаковые строки повторяются на каждом уровне конфигурации, и разбор делается один раз.
+    """
+    return tuple(TEMPLATE_NAME.split(value))
+
+
+def is_expression(value):
+    """Строка вида "{...}" - вычисляемое выражение."""
+    return isinstance(value, str) and value.startswith("{") and value.endswith("}")
+
+
+class SafeOperators(ast.NodeTransformer):
+    """Заменяет a ** b, a * b и a % b на вызовы safe_pow, safe_mul и safe_mod (см. SAFE_OPERATORS)."""
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        name = SAFE_OPERATORS.get(type(node.op))
+        if name is not None:
+            return ast.copy_location(ast.Call(ast.Name(name, ast.Load()), [node.left, node.right], []), node)
+        return node
+
+
+@lru_cache(maxsize=4096)
+def compile_expression(expression):
+    """
+    Разбирает выражение в AST, проверяет, что в нём только разрешённые конструкции,
+    и компилирует в байт-код. Результат кэшируется по тексту выражения.
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ConfigError(f"Синтаксическая ошибка в выражении: {expression}") from e
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise ConfigError(f"Недопустимая конструкция {type(node).__name__} в выражении: {expression}")
+        if isinstance(node, ast.Name) and node.id.startswith("_"):
+            raise ConfigError(f"Недопустимое имя {node.id} в выражении: {expression}")
+        if isinstance(node, ast.Call) and (
+            not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords
+        ):
+            raise ConfigError(f"Недопустимый вызов функции в выражении: {expression}")
+    tree = ast.fix_missing_locations(SafeOperators().visit(tree))
+    return compile(tree, "<expression>", "eval")
+
+
+@contextmanager
+def atomic_output(path):
+    """
+    Текстовый файл для записи через временный: он переименовывается в path только после
+    успешной записи, так что ошибка посреди вывода не оставляет недописанный файл,
+    а прежнее содержимое path остаётся нетронутым.
+    """
+    tmp_path = f"{os.fspath(path)}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 class ConfigConverter:
     def __init__(self, constants=None):
         """Инициализация с возможностью передачи констант."""
         self.constants = constants or {}
 
     def evaluate_expression(self, expression, context):
-        """Вычисляет выражение, используя переданные константы и текущий контекст."""
+        """
+        Вычисляет выражение, используя переданные константы и текущий контекст.
+        Выражение компилируется один раз (compile_expression), имена ищутся сначала
+        в контексте, затем в константах - без построения объединённого словаря.
+        """
+        return self._evaluate(expression, ChainMap(context, self.constants))
+
+    @staticmethod
+    def _evaluate(expression, scope):
+        """Вычисляет выражение в готовой области видимости scope (уже включающей константы)."""
+        code = compile_expression(expression)
+        if not OPERATOR_FUNCTIONS.keys().isdisjoint(code.co_names):
+            # Имена ищутся сначала в scope: ключ с именем _mul не должен подменить проверку оператора
+            scope = ChainMap(OPERATOR_FUNCTIONS, scope)
         try:
-            # Объединяем context и constants для поддержки всех переменных
-            full_context = {**self.constants, **context}
-            return eval(expression, {}, full_context)
+            value = eval(code, SAFE_GLOBALS, scope)
+            # Результат ограничен целиком: иначе ключи вида [a, a] удваивали бы размер на каждом уровне
+            check_sequence_size(sequence_size(value))
+            return value
         except Exception as e:
             raise ConfigError(f"Ошибка в вычислении выражения: {expression}") from e
 
     def resolve_constants(self, value, context=None, delay_expressions=False):
         """Подставляет константы и вычисляет выражения, если они есть."""
-        context = context or {}
-        full_context = {**self.constants, **context}  # Полный контекст для поиска констант
-
-        if isinstance(value, str) and value.startswith("{") and value.endswith("}"):
-            expression = value[1:-1]
-            if delay_expressions:
-                return value  # Откладываем выполнение выражения
-            return self.evaluate_expression(expression, full_context)
-        elif isinstance(value, str):
+        # Поиск сначала в контексте, затем в константах - без копирования словарей
+        scope = ChainMap(context if context is not None else {}, self.constants)
+        return self.resolve_value(value, scope, delay_expressions)
+
+    def resolve_value(self, value, scope, delay_expressions=False):
+        """
+        Как resolve_constants, но в готовой области видимости scope, которая уже включает
+        константы: она строится один раз на уровень, а не на каждое значение и элемент списка.
+        """
+        if isinstance(value, str):
+            if is_expression(value):
+                if delay_expressions:
+                    return value  # Откладываем выполнение выражения
+                return self._evaluate(value[1:-1], scope)
+            if "{" not in value:
+                return value
             # Подстановка значений констант внутри строки, если указаны {ключи}
-            pattern = re.compile(r"{(\w+)}")
-            return pattern.sub(lambda match: str(full_context.get(match.group(1), match.group(0))), value)
+            parts = compile_template(value)
+            if len(parts) == 1:
+                return value
+            segments = list(parts)
+            for i in range(1, len(parts), 2):
+                try:
+                    segments[i] = str(scope[parts[i]])
+                except KeyError:
+                    segments[i] = "{" + parts[i] + "}"  # Неизвестное имя остаётся как есть
+            return "".join(segments)
         elif isinstance(value, dict):
             # Рекурсивная обработка словарей
-            return {k: self.resolve_constants(v, full_context, delay_expressions) for k, v in value.items()}
+            return {k: self.resolve_value(v, scope, delay_expressions) for k, v in value.items()}
         elif isinstance(value, list):
             # Рекурсивная обработка списков
-            return [self.resolve_constants(item, full_context, delay_expressions) for item in value]
+            return [self.resolve_value(item, scope, delay_expressions) for item in value]
         return value
 
-    def format_value(self, value):
-        """Форматирует значение для вывода, обрабатывая строки и списки."""
+    def format_value(self, value, indent=0):
+        """
+        Форматирует значение для вывода, обрабатывая строки и списки.
+        Таблицы внутри массивов выводятся блоками begin ... end с отступом indent.
+        """
         if isinstance(value, str):
+            if '"' in value:
+                # В языке нет экранирования: кавычка закрыла бы строку, и текст читался бы как другие данные
+                raise ConfigError(f"Кавычка в строке не поддерживается в конфигурации: {value!r}")
             return f'"{value}"'
         elif isinstance(value, list):
-            formatted_list = ', '.join(f'"{item}"' if isinstance(item, str) else str(item) for item in value)
+            formatted_list = ', '.join(
+                self.format_block(item, indent) if isinstance(item, dict) else str(self.format_value(item, indent))
+                for item in value
+            )
             return f"<< {formatted_list} >>"
+        elif isinstance(value, (datetime.date, datetime.time)):
+            # В языке нет литерала даты: выведенный текст нельзя было бы разобрать обратно
+            raise ConfigError(f"Дата и время не поддерживаются в конфигурации: {value}")
         return value
 
-    def generate_output(self, data, indent=0, context=None):
-        """Рекурсивно обрабатывает входные данные и преобразует в конфигурацию."""
-        output = "begin\n"
-        indent_str = '    ' * indent  # Уровень отступов
+    def format_block(self, values, indent=0):
+        """Вычисленный блок строкой: для таблиц внутри массивов."""
+        stream = io.StringIO()
+        self.emit_block(values, stream, indent)
+        return stream.getvalue()
 
-        # Создаем локальный контекст на каждом уровне рекурсии
-        local_context = copy.deepcopy(context) if context else {}
-        local_context.update(self.constants)
+    def references(self, value, memo, block=True):
+        """
+        Имена, на которые ссылается значение: переменные выражений {...} и подстановки {name} в строках.
+        Для вложенного блока (block) - только свободные имена, не определённые в самом блоке;
+        результат для блока запоминается в memo по id, поэтому каждый блок обходится один раз.
+        """
+        if is_expression(value):
+            return [name for name in compile_expression(value[1:-1]).co_names if name not in OPERATOR_FUNCTIONS]
+        if isinstance(value, str):
+            return compile_template(value)[1::2] if "{" in value else ()
+        if isinstance(value, list):
+            names = set()
+            for item in value:
+                names.update(self.references(item, memo, block=False))
+            return names
+        if isinstance(value, dict):
+            key = (id(value), block)
+            if key not in memo:
+                names = set()
+                for item in value.values():
+                    names.update(self.references(item, memo, block))
+                memo[key] = names.difference(value) if block else names
+            return memo[key]
+        return ()
 
-        # Первый проход: добавляем простые значения в локальный контекст без вычисления выражений
-        for key, value in data.items():
-            if not re.match(r"^[A-Za-z_]\w*$", key):
+    def evaluation_order(self, data, memo):
+        """
+        Порядок вычисления ключей уровня: каждый ключ после ключей того же уровня, на которые он ссылается.
+        Топологическая сортировка обходом в глубину; цикл ссылок - ConfigError.
+        Имена ключей уровня проверяются до вычисления его значений.
+        """
+        for key in data:
+            if not KEY_NAME.fullmatch(key):
                 raise ConfigError(f"Неверное имя ключа: {key}")
-            # Сохраняем значение в контексте без вычисления сложных выражений
-            resolved_value = self.resolve_constants(value, local_context, delay_expressions=True)
-            local_context[key] = resolved_value
-
-        # Второй проход: вычисляем выражения, которые зависят от других переменных
-        for key, value in data.items():
-            resolved_value = self.resolve_constants(local_context[key], local_context, delay_expressions=False)
-            local_context[key] = resolved_value
-
-            # Обработка значений в зависимости от их типа
-            if isinstance(resolved_value, dict):
-                output += f"{indent_str}    {key} := {self.generate_output(resolved_value, indent + 1, local_context)};\n"
+        # Своё имя в значении ключа - ссылка на объемлющий уровень или константу, а не на сам ключ
+        deps = {
+            key: [name for name in self.references(value, memo) if name in data and name != key]
+            for key, value in data.items()
+        }
+        state = {}  # 1 - ключ на пути обхода, 2 - ключ уже в порядке
+        order = []
+        for start in data:
+            if start in state:
+                continue
+            state[start] = 1
+            stack = [(start, iter(deps[start]))]
+            while stack:
+                key, children = stack[-1]
+                for child in children:
+                    if state.get(child) == 1:
+                        path = [item for item, _ in stack]
+                        cycle = " -> ".join(path[path.index(child):] + [child])
+                        raise ConfigError(f"Циклическая зависимость ключей: {cycle}")
+                    if child not in state:
+                        state[child] = 1
+                        stack.append((child, iter(deps[child])))
+                        break
+                else:
+                    stack.pop()
+                    state[key] = 2
+                    order.append(key)
+        return order
+
+    def evaluate_block(self, data, scope, memo):
+        """
+        Вычисляет значения уровня в порядке зависимостей за один проход.
+        Область видимости - цепочка словарей (ChainMap): значения уровня, затем объемлющих
+        уровней, затем константы; контекст родителя не копируется.
+        """
+        values = {}
+        level = scope.new_child(values)
+        for key in self.evaluation_order(data, memo):
+            value = data[key]
+            if isinstance(value, dict):
+                values[key] = self.evaluate_block(value, level, memo)
+            else:
+                values[key] = self.resolve_value(value, level)
+        return {key: values[key] for key in data}  # Исходный порядок ключей для вывода
+
+    def emit_block(self, values, stream, indent=0, emit_nested=None):
+        """
+        Записывает вычисленный блок в текстовый поток по строке на ключ;
+        вложенные блоки пишутся в тот же поток, без промежуточных строк.
+        emit_nested(key, value, stream, indent) вызывается вместо вывода вложенного блока,
+        если задана: через неё ConfigSession выводит блоки из своего кэша.
+        """
+        indent_str = '    ' * indent  # Уровень отступов
+        stream.write("begin\n")
+        for key, value in values.items():
+            if not KEY_NAME.fullmatch(key):
+                raise ConfigError(f"Неверное имя ключа: {key}")
+            if isinstance(value, dict):
+                stream.write(f"{indent_str}    {key} := ")
+                if emit_nested is None:
+                    self.emit_block(value, stream, indent + 1)
+                else:
+                    emit_nested(key, value, stream, indent + 1)
+                stream.write(";\n")
+            else:
+                stream.write(f"{indent_str}    {key} := {self.format_value(value, indent + 1)};\n")
+        stream.write(f"{indent_str}end")
+
+    def write_output(self, data, stream, indent=0, context=None):
+        """
+        Преобразует входные данные в конфигурацию и пишет её в поток (файл, сокет, stdout):
+        сначала вычисляет все значения в порядке зависимостей между ключами,
+        затем выводит их в исходном порядке. Вместо потока можно передать путь:
+        файл пишется через временный (atomic_output) и при ошибке не меняется.
+        """
+        scope = ChainMap(context if context is not None else {}, self.constants)
+        values = self.evaluate_block(data, scope, {})
+        if isinstance(stream, (str, os.PathLike)):
+            with atomic_output(stream) as f:
+                self.emit_block(values, f, indent)
+        else:
+            self.emit_block(values, stream, indent)
+
+    def generate_output(self, data, indent=0, context=None):
+        """Преобразует входные данные в конфигурацию и возвращает её строкой."""
+        stream = io.StringIO()
+        self.write_output(data, stream, indent, context)
+        return stream.getvalue()
+
+
+class ConfigSession:
+    """
+    Долгоживущая сессия конвертации: хранит вычисленные значения, зависимости ключей
+    и выведенный текст блоков, так что после правки ключа или константы пересчитываются
+    только зависимые ключи, а заново выводятся только блоки, где они лежат.
+
+    Ключ адресуется путём - кортежем имён от корня (или строкой "Shop.Product.Price").
+    Для каждого скалярного ключа запоминается, к чему привязаны имена, на которые он
+    ссылается (выражения {...} и подстановки {name}): путь ключа ближайшего объемлющего
+    уровня, где имя определено, или - если такого нет - строка-имя константы.
+    """
+
+    def __init__(self, data, constants=None):
+        self.converter = ConfigConverter(dict(constants or {}))
+        self.data = copy.deepcopy(data)  # Правки меняют исходные данные, поэтому сессия держит свою копию
+        self.reload()
+
+    def reload(self):
+        """Полный пересчёт: значения, зависимости и кэш текста строятся заново."""
+        self.deps = {}  # Путь скалярного ключа -> привязки имён, на которые он ссылается
+        self.dependents = {}  # Привязка -> пути ключей, которые от неё зависят
+        self.texts = {}  # Путь блока -> его выведенный текст без вложенных блоков (см. _emit)
+        self.values = self._evaluate_block(self.data, (), ChainMap(self.converter.constants), (), {})
+
+    @staticmethod
+    def _path(path):
+        return tuple(path.split(".")) if isinstance(path, str) else tuple(path)
+
+    def _evaluate_block(self, data, path, scope, raws, memo):
+        """Как ConfigConverter.evaluate_block, но с записью зависимостей каждого ключа."""
+        values = {}
+        level = scope.new_child(values)
+        raws = (data,) + raws  # Исходные словари уровней, от внутреннего к корню
+        for key in self.converter.evaluation_order(data, memo):
+            value = data[key]
+            if isinstance(value, dict):
+                values[key] = self._evaluate_block(value, path + (key,), level, raws, memo)
+            else:
+                values[key] = self.converter.resolve_value(value, level)
+                self._track(path + (key,), value, raws)
+        return {key: values[key] for key in data}
+
+    def _track(self, key_path, value, raws):
+        """Запоминает привязки имён, на которые ссылается значение ключа key_path."""
+        bindings = []
+        for name in set(self.converter.references(value, {}, block=False)):
+            binding = name
+            for depth, level in enumerate(raws):
+                if name in level and (depth or name != key_path[-1]):
+                    binding = key_path[:len(key_path) - 1 - depth] + (name,)
+                    break
+            bindings.append(binding)
+            self.dependents.setdefault(binding, set()).add(key_path)
+        self.deps[key_path] = bindings
+
+    def _untrack(self, key_path):
+        for binding in self.deps.pop(key_path, ()):
+            self.dependents[binding].discard(key_path)
+
+    def _levels(self, level_path):
+        """Словари значений уровней на пути level_path, от внутреннего к корню."""
+        levels = [self.values]
+        for key in level_path:
+            levels.append(levels[-1][key])
+        return levels[::-1]
+
+    def _raw_levels(self, level_path):
+        levels = [self.data]
+        for key in level_path:
+            levels.append(levels[-1][key])
+        return levels[::-1]
+
+    def _forget(self, path, values):
+        """Убирает зависимости и кэш текста всех ключей поддерева path со значениями values."""
+        self.texts.pop(path, None)
+        for key, value in values.items():
+            if isinstance(value, dict):
+                self._forget(path + (key,), value)
+            else:
+                self._untrack(path + (key,))
+
+    def _propagate(self, edited, changed):
+        """
+        Пересчитывает ключи, зависящие от изменённых привязок changed, в порядке зависимостей.
+        Ключ вычисляется заново, только если изменилась хотя бы одна его зависимость
+        (или он сам отредактирован - edited); если значение не изменилось, дальше правка не идёт.
+        Возвращает множество путей ключей, значения которых изменились.
+        """
+        dirty = set(edited)
+        seen = changed | edited
+        stack = list(seen)
+        while stack:
+            binding = stack.pop()
+            for key_path in self.dependents.get(binding, ()):
+                if key_path not in dirty:
+                    dirty.add(key_path)
+                    stack.append(key_path)
+            if isinstance(binding, tuple):
+                # Изменение ключа меняет и объемлющие блоки, если на них ссылаются как на значения
+                for i in range(1, len(binding)):
+                    if binding[:i] not in seen:
+                        seen.add(binding[:i])
+                        stack.append(binding[:i])
+
+        def inputs(key_path):
+            # Зависимость от блока - это зависимость от всех его изменяемых ключей
+            for binding in self.deps[key_path]:
+                if binding in dirty:
+                    yield binding
+                elif isinstance(binding, tuple) and binding in seen:
+                    yield from (other for other in dirty if other[:len(binding)] == binding)
+
+        updated = set()
+        state = {}  # 1 - ключ на пути обхода, 2 - ключ уже пересчитан
+        for start in [*edited, *dirty]:  # Цикл, внесённый правкой, показывается от отредактированного ключа
+            if start in state:
+                continue
+            state[start] = 1
+            stack = [(start, inputs(start))]
+            while stack:
+                key_path, children = stack[-1]
+                for child in children:
+                    if state.get(child) == 1:
+                        path = [".".join(item) for item, _ in stack]
+                        cycle = " -> ".join(path[path.index(".".join(child)):] + [".".join(child)])
+                        raise ConfigError(f"Циклическая зависимость ключей: {cycle}")
+                    if child not in state:
+                        state[child] = 1
+                        stack.append((child, inputs(child)))
+                        break
+                else:
+                    stack.pop()
+                    state[key_path] = 2
+                    if key_path in edited or any(binding in changed for binding in self.deps[key_path]):
+                        if self._reevaluate(key_path):
+                            updated.add(key_path)
+                            changed.add(key_path)
+                            changed.update(key_path[:i] for i in range(1, len(key_path)))
+        return updated
+
+    def _reevaluate(self, key_path):
+        """Вычисляет ключ заново в области видимости его уровня; True, если значение изменилось."""
+        levels = self._levels(key_path[:-1])
+        raw = self._raw_levels(key_path[:-1])[0][key_path[-1]]
+        scope = ChainMap(*levels, self.converter.constants)
+        if key_path[-1] in self.converter.references(raw, {}, block=False):
+            # Своё имя ключ берёт с объемлющего уровня, как при полном вычислении (evaluation_order)
+            scope.maps[0] = {key: value for key, value in levels[0].items() if key != key_path[-1]}
+        value = self.converter.resolve_value(raw, scope)
+        old = levels[0][key_path[-1]]
+        if type(old) is type(value) and old == value:
+            return False
+        levels[0][key_path[-1]] = value
+        self.texts.pop(key_path[:-1], None)  # Текст объемлющих блоков не содержит текста вложенных
+        self._drop_texts(key_path, old)  # Значение-блок, полученное выражением
+        return True
+
+    def _drop_texts(self, path, value):
+        """Убирает кэш текста блока path и всех вложенных в него блоков."""
+        if isinstance(value, dict):
+            self.texts.pop(path, None)
+            for key, item in value.items():
+                self._drop_texts(path + (key,), item)
+
+    def _apply(self, edit, undo):
+        """Выполняет правку; при ошибке откатывает исходные данные и пересчитывает всё заново."""
+        try:
+            return edit()
+        except ConfigError:
+            undo()
+            self.reload()
+            raise
+
+    def set_constant(self, name, value):
+        """Меняет константу; возвращает пути ключей, значения которых изменились."""
+        constants = self.converter.constants
+        missing = name not in constants
+        old = constants.get(name)
+        constants[name] = value
+
+        def undo():
+            if missing:
+                del constants[name]
+            else:
+                constants[name] = old
+        return self._apply(lambda: self._propagate(set(), {name}), undo)
+
+    def set(self, path, value):
+        """
+        Задаёт значение ключа. Замена скалярного значения скалярным пересчитывает только зависимые ключи;
+        новый ключ, блок или замена блока пересчитывает объемлющий блок целиком.
+        Возвращает пути ключей, значения которых изменились.
+        """
+        path = self._path(path)
+        level = self._raw_levels(path[:-1])[0]
+        missing = path[-1] not in level
+        old = level.get(path[-1])
+        level[path[-1]] = value
+
+        def undo():
+            if missing:
+                del level[path[-1]]
+            else:
+                level[path[-1]] = old
+        if missing or isinstance(old, dict) or isinstance(value, dict):
+            return self._apply(lambda: self._rebuild(path[:-1]), undo)
+
+        def edit():
+            self._untrack(path)
+            self._track(path, value, tuple(self._raw_levels(path[:-1])))
+            return self._propagate({path}, set())
+        return self._apply(edit, undo)
+
+    def delete(self, path):
+        """Удаляет ключ или блок; объемлющий блок пересчитывается целиком."""
+        path = self._path(path)
+        level = self._raw_levels(path[:-1])[0]
+        old = level.pop(path[-1])
+        return self._apply(lambda: self._rebuild(path[:-1]), lambda: level.__setitem__(path[-1], old))
+
+    def _rebuild(self, level_path):
+        """Пересчитывает блок level_path со всем поддеревом и ключи вне его, зависящие от блока."""
+        levels = self._levels(level_path)
+        self._forget(level_path, levels[0])
+        raws = tuple(self._raw_levels(level_path))
+        scope = ChainMap(*levels[1:], self.converter.constants)
+        values = self._evaluate_block(raws[0], level_path, scope, raws[1:], {})
+        if level_path:
+            levels[1][level_path[-1]] = values
+        else:
+            self.values = values
+        changed = {level_path[:i] for i in range(1, len(level_path) + 1)}
+        updated = self._propagate(set(), changed)
+        stack = [(level_path, values)]
+        while stack:  # Все ключи пересчитанного поддерева
+            path, block = stack.pop()
+            for key, value in block.items():
+                if isinstance(value, dict):
+                    stack.append((path + (key,), value))
+                else:
+                    updated.add(path + (key,))
+        return updated
+
+    def _emit(self, path, values, stream):
+        """
+        Выводит блок path через ConfigConverter.emit_block. Кэшируется только собственный текст
+        блока - куски между его вложенными блоками, - так что каждый символ вывода хранится
+        один раз, а после правки ключа заново выводится только его блок.
+        """
+        parts = self.texts.get(path)
+        if parts is None:
+            parts = []  # Текст, имя вложенного блока, текст, ..., текст
+            buffer = io.StringIO()
+
+            def emit_nested(key, value, stream, indent):
+                parts.append(buffer.getvalue())
+                parts.append(key)
+                buffer.seek(0)
+                buffer.truncate()
+            self.converter.emit_block(values, buffer, len(path), emit_nested)
+            parts.append(buffer.getvalue())
+            self.texts[path] = parts
+        stream.write(parts[0])
+        for i in range(1, len(parts), 2):
+            self._emit(path + (parts[i],), values[parts[i]], stream)
+            stream.write(parts[i + 1])
+
+    def write_output(self, stream):
+        """Пишет текущую конфигурацию в поток; неизменившиеся блоки выводятся из кэша."""
+        self._emit((), self.values, stream)
+
+    def generate_output(self):
+        """Текущая конфигурация строкой, как ConfigConverter.generate_output."""
+        stream = io.StringIO()
+        self.write_output(stream)
+        return stream.getvalue()
+
+
+NUMBER = r"[-+]?(?:\d[\d.]*(?:[eE][-+]?\d+)?|inf\b|nan\b)"
+# Элемент блока целиком, одним совпадением: "имя := скаляр;", "имя := begin", "имя := <<" или "end;".
+# Группы: 1 - имя, 2 - строка, 3 - число, 4 - логическое, 5 - begin, 6 - <<, 7 - end, 8 - ';' после end
+ITEM = re.compile(
+    rf'\s*(?:([A-Za-z_]\w*)\s*:=\s*(?:"([^"]*)"\s*;|({NUMBER})\s*;|(True|False)\s*;|(begin)\b|(<<))|(end)\b\s*(;?))'
+)
+# Лексема внутри массива: строка, число, логическое, << или >>, begin, затем ',' или конец массива
+LIST_TOKEN = re.compile(rf'\s*(?:"([^"]*)"|({NUMBER})|(True|False)\b|(<<)|(>>)|(begin)\b)')
+LIST_SEPARATOR = re.compile(r"\s*([,;]|>>)")
+BEGIN = re.compile(r"\s*begin\b")
+
+
+def parse_number(token):
+    if token.lstrip("+-").isdigit():
+        return int(token)
+    try:
+        return float(token)
+    except ValueError:
+        raise ConfigError(f"Неверное число: {token}") from None
+
+
+def parse_error(text, pos, message):
+    """ConfigError с номером строки и началом неразобранного текста."""
+    pos += len(text[pos:pos + 1000]) - len(text[pos:pos + 1000].lstrip())
+    line = text.count("\n", 0, pos) + 1
+    fragment = text[pos:pos + 40].split("\n")[0]
+    return ConfigError(f"{message} в строке {line}: {fragment!r}")
+
+
+def parse_list(text, pos):
+    """
+    Массив << a, b, << c >>, begin d := 1; end >>, начиная сразу после открывающей <<.
+    Возвращает список и позицию после закрывающей >>; вложенные массивы и блоки - рекурсивно.
+    """
+    items = []
+    while True:
+        match = LIST_TOKEN.match(text, pos)
+        if match is None:
+            raise parse_error(text, pos, "Ожидалось значение массива")
+        pos = match.end()
+        kind = match.lastindex
+        if kind == 5:
+            if items:
+                raise parse_error(text, match.start(kind), "Ожидалось значение массива")
+            return items, pos  # Пустой массив
+        if kind == 1:
+            items.append(match.group(1))
+        elif kind == 2:
+            items.append(parse_number(match.group(2)))
+        elif kind == 3:
+            items.append(match.group(3) == "True")
+        elif kind == 4:
+            item, pos = parse_list(text, pos)
+            items.append(item)
+        else:
+            item, pos = parse_block(text, pos)
+            items.append(item)
+        match = LIST_SEPARATOR.match(text, pos)
+        if match is None or match.group(1) == ";":
+            raise parse_error(text, pos, "Ожидалось ',' или '>>' в массиве")
+        pos = match.end()
+        if match.group(1) == ">>":
+            return items, pos
+
+
+def parse_block(text, pos):
+    """
+    Блок begin ... end, начиная сразу после begin. Возвращает словарь и позицию после
+    его end (';' после end самого блока не читается). Элемент блока распознаётся
+    одним совпадением ITEM, вложенность блоков отслеживается стеком, а не рекурсией,
+    так что глубина не ограничена.
+    """
+    root = {}
+    stack = [root]
+    item = ITEM.match
+    while True:
+        match = item(text, pos)
+        if match is None:
+            if not text[pos:].strip():
+                raise ConfigError("Не хватает end в конце текста")
+            raise parse_error(text, pos, "Ожидалось 'имя := значение;' или end")
+        pos = match.end()
+        kind = match.lastindex
+        if kind == 2:
+            stack[-1][match.group(1)] = match.group(2)
+        elif kind == 3:
+            stack[-1][match.group(1)] = parse_number(match.group(3))
+        elif kind == 4:
+            stack[-1][match.group(1)] = match.group(4) == "True"
+        elif kind == 5:
+            block = stack[-1][match.group(1)] = {}
+            stack.append(block)  # ';' после блока проверяется при его end
+        elif kind == 6:
+            stack[-1][match.group(1)], pos = parse_list(text, pos)
+            match = LIST_SEPARATOR.match(text, pos)
+            if match is None or match.group(1) != ";":
+                raise parse_error(text, pos, "Ожидалось ';' после массива")
+            pos = match.end()
+        else:
+            stack.pop()
+            if not stack:
+                return root, match.end(7)
+            if not match.group(8):
+                raise parse_error(text, pos, "Ожидалось ';' после end")
+
+
+def parse_output(text):
+    """
+    Разбирает текст в формате generate_output (begin ... name := value; ... end)
+    в словарь той же структуры, что принимает generate_output: вложенные блоки -
+    словари, массивы << >> - списки, блоки внутри массивов - словари в списках.
+    Текст читается за один проход.
+    """
+    match = BEGIN.match(text)
+    if match is None:
+        raise parse_error(text, 0, "Конфигурация должна начинаться с begin")
+    root, pos = parse_block(text, match.end())
+    if text[pos:].strip():  # После end корневого блока текст должен закончиться
+        raise parse_error(text, pos, "Лишний текст после end")
+    return root
+
+
+def toml_value(value):
+    """Значение в синтаксисе TOML: строки в кавычках с экранированием, массивы и встроенные таблицы."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "nan"
+        if math.isinf(value):
+            return "inf" if value > 0 else "-inf"
+        return repr(value)
+    if isinstance(value, str):
+        return json.dumps(value, ensure_ascii=False).replace("\x7f", "\\u007f")
+    if isinstance(value, list):
+        # Библиотека toml (как и TOML до версии 1.0) не читает массивы из значений разных типов
+        if len(set(map(type, value))) > 1:
+            raise ConfigError(f"Массив из значений разных типов нельзя записать в TOML: {value!r}")
+        return "[" + ", ".join(toml_value(item) for item in value) + "]"
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{toml_key(key)} = {toml_value(item)}" for key, item in value.items()) + "}"
+    raise ConfigError(f"Значение нельзя записать в TOML: {value!r}")
+
+
+def toml_key(key):
+    return key if KEY_NAME.fullmatch(key) else json.dumps(key, ensure_ascii=False)
+
+
+def write_toml(data, stream):
+    """
+    Пишет словарь в поток в формате TOML: сначала скалярные ключи таблицы,
+    затем вложенные таблицы с заголовками [a.b] - по таблице за раз, без сборки
+    всего текста в памяти.
+    """
+    stack = [((), data)]
+    while stack:
+        path, table = stack.pop()
+        if path:
+            stream.write(f"\n[{'.'.join(toml_key(key) for key in path)}]\n")
+        children = []
+        for key, value in table.items():
+            if isinstance(value, dict):
+                children.append((path + (key,), value))
             else:
-                formatted_value = self.format_value(resolved_value)
-                output += f"{indent_str}    {key} := {formatted_value};\n"
+                stream.write(f"{toml_key(key)} = {toml_value(value)}\n")
+        stack.extend(reversed(children))
+
+
+MANIFEST_NAME = ".config_converter_manifest.json"
+OUTPUT_EXTENSION = ".cfg"
+
+
+def collect_sources(patterns):
+    """
+    Входные TOML-файлы с путями относительно своего корня: для каталога - все *.toml
+    в его дереве, для шаблона glob - совпадения относительно части пути до первого
+    спецсимвола, для отдельного файла - его имя. Повторы убираются.
+    """
+    sources = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            root = pattern
+            paths = glob.glob(os.path.join(glob.escape(pattern), "**", "*.toml"), recursive=True)
+        elif glob.has_magic(pattern):
+            parts = pattern.replace(os.sep, "/").split("/")
+            prefix = []
+            for part in parts:
+                if glob.has_magic(part):
+                    break
+                prefix.append(part)
+            root = "/".join(prefix) or "."
+            paths = glob.glob(pattern, recursive=True)
+        else:
+            root = os.path.dirname(pattern) or "."
+            paths = [pattern]
+        for path in sorted(paths):
+            if os.path.isfile(path):
+                sources.setdefault(os.path.normpath(path), os.path.relpath(path, root))
+    return sources
+
+
+def output_path(source, relative, output_dir):
+    """Путь результата: в output_dir с тем же относительным путём или рядом с исходным файлом."""
+    base = os.path.join(output_dir, relative) if output_dir else source
+    return os.path.splitext(base)[0] + OUTPUT_EXTENSION
+
+
+def content_hash(content, constants_hash):
+    """SHA-256 содержимого файла вместе с хэшем констант: смена констант делает устаревшими все файлы."""
+    return hashlib.sha256(constants_hash.encode() + content).hexdigest()
+
+
+def read_manifest(manifest_path):
+    """Манифест прошлого запуска {исходный файл: {"hash", "output"}}; повреждённый или отсутствующий - пустой."""
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            return json.load(f)["files"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def write_manifest(manifest_path, files):
+    """Записывает манифест через временный файл, чтобы прерванный запуск не оставил его недописанным."""
+    directory = os.path.dirname(manifest_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with atomic_output(manifest_path) as f:
+        json.dump({"version": 1, "files": files}, f, indent=1, sort_keys=True)
+
+
+_worker_converter = None
+
+
+def _init_convert_worker(constants):
+    """Конвертер с общими константами создаётся один раз на процесс, а не на каждый файл."""
+    global _worker_converter
+    _worker_converter = ConfigConverter(constants)
+
+
+def convert_file(task):
+    """
+    Преобразует один TOML-файл в конфигурацию. Результат пишется во временный файл и
+    переименовывается, так что при ошибке старый результат остаётся нетронутым.
+    Возвращает (исходный файл, хэш, текст ошибки или None) - ошибки не прерывают пакет.
+    """
+    source, output, constants_hash = task
+    try:
+        with open(source, "rb") as f:
+            content = f.read()
+        digest = content_hash(content, constants_hash)
+        data = toml.loads(content.decode("utf-8"))
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        _worker_converter.write_output(data, output)
+        return source, digest, None
+    except Exception as e:  # Любая ошибка в файле (в том числе RecursionError на глубокой вложенности) - отказ этого файла
+        return source, None, f"{type(e).__name__}: {e}"
+
+
+def convert_files(tasks, constants, jobs):
+    """
+    Преобразует файлы в пуле процессов; при одном процессе - в текущем.
+    Файлы раздаются пачками: для тысяч мелких файлов накладные расходы на передачу заданий заметнее самой работы.
+    """
+    jobs = min(jobs or os.cpu_count() or 1, len(tasks))
+    if jobs <= 1:
+        _init_convert_worker(constants)
+        return [convert_file(task) for task in tasks]
+    chunksize = max(1, len(tasks) // (jobs * 8))
+    with ProcessPoolExecutor(jobs, initializer=_init_convert_worker, initargs=(constants,)) as pool:
+        return list(pool.map(convert_file, tasks, chunksize=chunksize))
+
+
+def totoml_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="config_converter.py totoml",
+        description="Обратное преобразование: конфигурация begin ... end в TOML.",
+    )
+    parser.add_argument("source", help="Файл конфигурации ('-' - стандартный ввод).")
+    parser.add_argument("output", nargs="?", help="TOML-файл результата (по умолчанию - стандартный вывод).")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.source == "-":
+            text = sys.stdin.read()
+        else:
+            with open(args.source, encoding="utf-8") as f:
+                text = f.read()
+        data = parse_output(text)
+    except (ConfigError, OSError, UnicodeDecodeError) as e:
+        print(f"{args.source}: {e}", file=sys.stderr)
+        return 1
+    try:
+        if args.output is None:
+            write_toml(data, sys.stdout)
+        else:
+            with atomic_output(args.output) as f:
+                write_toml(data, f)
+    except (ConfigError, OSError) as e:
+        print(f"{args.output or args.source}: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+COMMANDS = {
+    "totoml": totoml_main,
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+
+    parser = argparse.ArgumentParser(description="Пакетное преобразование TOML-файлов в конфигурации.")
+    parser.add_argument("sources", nargs="+", help="Каталоги (все *.toml в дереве), шаблоны glob или файлы.")
+    parser.add_argument("-o", "--output", help="Каталог результатов; по умолчанию .cfg пишется рядом с исходным файлом.")
+    parser.add_argument("--constants", help="TOML-файл с константами, общими для всех файлов.")
+    parser.add_argument("--jobs", type=int, help="Число процессов (по умолчанию - число процессоров).")
+    parser.add_argument("--manifest", help=f"Файл манифеста хэшей (по умолчанию {MANIFEST_NAME} в каталоге результатов).")
+    parser.add_argument("--force", action="store_true", help="Преобразовать все файлы, не глядя на манифест.")
+    args = parser.parse_args(argv)
+
+    constants = {}
+    if args.constants:
+        with open(args.constants, encoding="utf-8") as f:
+            constants = toml.load(f)
+    constants_hash = hashlib.sha256(json.dumps(constants, sort_keys=True, default=str).encode()).hexdigest()
+    manifest_path = args.manifest or os.path.join(args.output or ".", MANIFEST_NAME)
+    previous = {} if args.force else read_manifest(manifest_path)
+
+    sources = collect_sources(args.sources)
+    # Записи о файлах, не входящих в этот запуск, сохраняются: манифест может быть общим для разных запусков
+    files = {source: entry for source, entry in previous.items() if source not in sources}
+    outputs = {source: output_path(source, relative, args.output) for source, relative in sources.items()}
+    # Файлы с одинаковым путём результата (одноимённые файлы из разных корней) перезаписали бы друг друга
+    claimed = {}
+    for source, output in outputs.items():
+        claimed.setdefault(os.path.normcase(os.path.abspath(output)), []).append(source)
+    conflicts = {}
+    for claimants in claimed.values():
+        if len(claimants) > 1:
+            for source in claimants:
+                conflicts[source] = ", ".join(other for other in claimants if other != source)
+    tasks = []
+    for source, output in outputs.items():
+        if source in conflicts:
+            continue
+        entry = previous.get(source)
+        if entry and entry.get("output") == output and os.path.exists(output):
+            try:
+                with open(source, "rb") as f:
+                    unchanged = content_hash(f.read(), constants_hash) == entry.get("hash")
+            except OSError:
+                unchanged = False
+            if unchanged:
+                files[source] = entry
+                continue
+        tasks.append((source, output, constants_hash))
+
+    errors = 0
+    for (source, output, _), (_, digest, error) in zip(tasks, convert_files(tasks, constants, args.jobs)):
+        if error is None:
+            files[source] = {"hash": digest, "output": output}
+        else:
+            errors += 1
+            print(f"{source}: {error}", file=sys.stderr)
+    converted = len(tasks) - errors
+    for source, others in conflicts.items():
+        errors += 1
+        print(f"{source}: путь результата {outputs[source]} совпадает с результатом {others}", file=sys.stderr)
+    write_manifest(manifest_path, files)
+    print(f"Преобразовано: {converted}, без изменений: {len(sources) - len(tasks) - len(conflicts)}, ошибок: {errors}")
+    return 1 if errors else 0
+
 
-        output += f"{indent_str}end"
-        return output
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,10 @@
+import io
+import json
+import random
+import string
 import pytest
 import toml
-from config_converter import ConfigConverter, ConfigError
+from config_converter import ConfigConverter, ConfigError, compile_expression, compile_template, ConfigSession, main, parse_output, write_toml
 
 def normalize_whitespace(text):
     """Утилита для удаления лишних пробелов и символов новой строки"""
@@ -95,3 +99,392 @@ def test_invalid_key_name():
     """)
     with pytest.raises(ConfigError, match="Неверное имя ключа"):
         converter.generate_output(toml_data)
+    # Имя ключа проверяется раньше, чем вычисляются значения уровня
+    with pytest.raises(ConfigError, match="Неверное имя ключа"):
+        converter.generate_output({"value": "{missing + 1}", "1bad": 1})
+
+# Тест безопасного вычислителя выражений
+def test_safe_expression_engine():
+    converter = ConfigConverter(constants={"base": 4, "items": [3, 1, 2]})
+    context = {"base": 5}
+    assert converter.evaluate_expression("base * 2 + 1", context) == 11
+    assert converter.evaluate_expression("max(items) if len(items) > 2 else 0", context) == 3
+    assert converter.evaluate_expression("sqrt(16) + 2 ** 3", context) == 12
+    assert converter.evaluate_expression("items[1:] == [1, 2] and not base < 0", context) is True
+    assert converter.evaluate_expression("1 ** 10 ** 9 + 2 ** 0.5 ** 2 + 7 % 4", context) == 1 + 2 ** 0.25 + 3
+    assert converter.evaluate_expression("len('ab' * 1000) + len(3 * [0]) + sum(items, 0.5)", context) == 2009.5
+    for expression in ("().__class__", "__import__('os')", "open('x')", "[x for x in items]", "lambda: 1",
+                       "9 ** 9 ** 9", "((9 ** 999) ** 999) ** 999", "10 ** 999 * 10 ** 999 * 10 ** 999" + " * 10 ** 999" * 20,
+                       "'x' * 10 ** 9", "10 ** 9 * [0]", "[[0] * 2 ** 20] * 2 ** 20", "len(str([[0] * 2 ** 10] * 2 ** 9 + [[0] * 2 ** 10] * 2 ** 9 + [[0] * 2 ** 10] * 2 ** 9))", "'%0999999999d' % 1", "sum([[0] * 1000] * 1000, [])",
+                       "missing + 1", "1 +"):
+        with pytest.raises(ConfigError):
+            converter.evaluate_expression(expression, context)
+
+# Размер значений ограничен и между ключами; ключи с именами вспомогательных функций операторов их не подменяют
+def test_expression_limits_across_keys():
+    converter = ConfigConverter()
+    with pytest.raises(ConfigError, match="Ошибка в вычислении выражения"):
+        converter.generate_output({"a": "{[0] * 2 ** 19}", "b": "{[a, a, a]}"})
+    output = converter.generate_output({"_mul": "v{x}", "_pow": 1, "x": "{2 * 3 ** 2 % 7}"})
+    assert parse_output(output) == {"_mul": "v4", "_pow": 1, "x": 4}
+
+# Выражение разбирается один раз, повторные вычисления берут байт-код из кэша
+def test_expression_cache():
+    compile_expression.cache_clear()
+    converter = ConfigConverter()
+    for value in range(100):
+        assert converter.evaluate_expression("value * 2", {"value": value}) == value * 2
+    info = compile_expression.cache_info()
+    assert (info.misses, info.hits) == (1, 99)
+
+# Ключи вычисляются в порядке зависимостей, а не в порядке записи
+def test_dependency_ordered_evaluation():
+    converter = ConfigConverter()
+    toml_data = toml.loads("""
+    total = "{price * count}"
+    label = "Итого: {total}"
+    price = "{base + 5}"
+    base = 10
+    count = 3
+    [Nested]
+    doubled = "{total * 2}"
+    """)
+    expected_output = """
+    begin
+        total := 45;
+        label := "Итого: 45";
+        price := 15;
+        base := 10;
+        count := 3;
+        Nested := begin
+            doubled := 90;
+        end;
+    end
+    """
+    generated_output = converter.generate_output(toml_data)
+    assert normalize_whitespace(generated_output) == normalize_whitespace(expected_output)
+
+# Циклические ссылки между ключами
+def test_reference_cycle():
+    converter = ConfigConverter()
+    toml_data = toml.loads("""
+    a = "{b + 1}"
+    b = "{c + 1}"
+    c = "prefix {a}"
+    """)
+    with pytest.raises(ConfigError, match="a -> b -> c -> a"):
+        converter.generate_output(toml_data)
+
+# Ссылка ключа на своё имя берёт значение объемлющего уровня или константы, а не образует цикл
+def test_self_reference():
+    converter = ConfigConverter({"name": "x"})
+    assert parse_output(converter.generate_output({"name": "prefix-{name}"})) == {"name": "prefix-x"}
+    data = {"name": "outer", "Inner": {"name": "{name}-inner"}}
+    assert parse_output(converter.generate_output(data)) == {"name": "outer", "Inner": {"name": "outer-inner"}}
+    session = ConfigSession({"name": "prefix-{name}", "other": "{name}!"}, {"name": "x"})
+    assert session.set_constant("name", "y") == {("name",), ("other",)}
+    assert parse_output(session.generate_output()) == {"name": "prefix-y", "other": "prefix-y!"}
+
+# Потоковый вывод совпадает с generate_output
+def test_write_output_stream(tmp_path):
+    converter = ConfigConverter(constants={"PI": 3.1415})
+    toml_data = toml.loads("""
+    name = "Circle"
+    [Shape]
+    radius = 10
+    tags = ["a", "b"]
+    area = "{PI * radius ** 2}"
+    """)
+    output_path = tmp_path / "out.cfg"
+    with open(output_path, "w", encoding="utf-8") as f:
+        converter.write_output(toml_data, f)
+    stream = io.StringIO()
+    converter.write_output(toml_data, stream)
+    assert output_path.read_text(encoding="utf-8") == stream.getvalue() == converter.generate_output(toml_data)
+    assert f"    area := {3.1415 * 10 ** 2};\n" in stream.getvalue()
+
+    # Ошибка посреди вывода в файл по пути не оставляет недописанный файл и не трогает прежний
+    converter.write_output(toml_data, str(output_path))
+    before = output_path.read_text(encoding="utf-8")
+    assert before == stream.getvalue()
+    toml_data["Shape"]["created"] = toml.loads("d = 1979-05-27")["d"]
+    with pytest.raises(ConfigError, match="Дата и время"):
+        converter.write_output(toml_data, output_path)
+    assert output_path.read_text(encoding="utf-8") == before
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["out.cfg"]
+
+# Пакетное преобразование: общие константы, пропуск неизменённых файлов, ошибки не прерывают пакет
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_batch_main(tmp_path, capsys, jobs):
+    source_dir = tmp_path / "configs"
+    (source_dir / "shop").mkdir(parents=True)
+    (source_dir / "app.toml").write_text('name = "App"\ntimeout = "{BASE * 2}"\n', encoding="utf-8")
+    (source_dir / "shop" / "cart.toml").write_text('items = 3\ntotal = "{items * BASE}"\n', encoding="utf-8")
+    (source_dir / "broken.toml").write_text('a = "{b}"\nb = "{a}"\n', encoding="utf-8")
+    (source_dir / "deep.toml").write_text("[" + ".".join(["a"] * 1500) + "]\nx = 1\n", encoding="utf-8")
+    constants_path = tmp_path / "constants.toml"
+    constants_path.write_text("BASE = 10\n", encoding="utf-8")
+    output_dir = tmp_path / "out"
+    argv = [str(source_dir), "-o", str(output_dir), "--constants", str(constants_path), "--jobs", jobs]
+
+    assert main(argv) == 1
+    captured = capsys.readouterr()
+    assert "broken.toml: ConfigError: Циклическая зависимость ключей" in captured.err
+    assert "deep.toml: RecursionError" in captured.err
+    assert "Преобразовано: 2, без изменений: 0, ошибок: 2" in captured.out
+    assert "timeout := 20;" in (output_dir / "app.cfg").read_text(encoding="utf-8")
+    assert "total := 30;" in (output_dir / "shop" / "cart.cfg").read_text(encoding="utf-8")
+    assert not (output_dir / "broken.cfg").exists()
+    (source_dir / "deep.toml").unlink()
+
+    (source_dir / "broken.toml").write_text('a = 1\n', encoding="utf-8")
+    assert main(argv) == 0
+    assert "Преобразовано: 1, без изменений: 2, ошибок: 0" in capsys.readouterr().out
+
+    constants_path.write_text("BASE = 5\n", encoding="utf-8")
+    assert main(argv) == 0
+    assert "Преобразовано: 3, без изменений: 0, ошибок: 0" in capsys.readouterr().out
+    assert "total := 15;" in (output_dir / "shop" / "cart.cfg").read_text(encoding="utf-8")
+
+    assert main([str(source_dir / "**" / "cart.toml"), "-o", str(output_dir), "--constants", str(constants_path)]) == 0
+    assert "без изменений: 1" in capsys.readouterr().out
+
+# Одноимённые файлы из разных корней не перезаписывают общий результат, а считаются ошибками
+def test_batch_output_conflict(tmp_path, capsys):
+    for name, value in (("d1", 1), ("d2", 2)):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "a.toml").write_text(f"value = {value}\n", encoding="utf-8")
+    (tmp_path / "d1" / "b.toml").write_text("value = 4\n", encoding="utf-8")
+    output_dir = tmp_path / "out"
+    assert main([str(tmp_path / "d1"), str(tmp_path / "d2"), "-o", str(output_dir), "--jobs", "1"]) == 1
+    captured = capsys.readouterr()
+    assert "Преобразовано: 1, без изменений: 0, ошибок: 2" in captured.out
+    assert f"{tmp_path / 'd1' / 'a.toml'}: путь результата" in captured.err
+    assert f"совпадает с результатом {tmp_path / 'd1' / 'a.toml'}" in captured.err
+    assert not (output_dir / "a.cfg").exists()
+    manifest = json.loads((output_dir / ".config_converter_manifest.json").read_text(encoding="utf-8"))
+    assert list(manifest["files"]) == [str(tmp_path / "d1" / "b.toml")]
+
+# Сессия: после правки пересчитываются только зависимые ключи, вывод совпадает с полной конвертацией
+def test_config_session():
+    constants = {"Tax": 0.2, "Currency": "EUR"}
+    toml_data = toml.loads("""
+    Shop = "Main"
+    [Cart]
+    price = 10
+    count = 3
+    total = "{price * count * (1 + Tax)}"
+    label = "{Shop}: {total} {Currency} total"
+    [Cart.Item]
+    name = "Pen"
+    title = "Item {name} from {Shop}"
+    [Other]
+    value = 1
+    """)
+    session = ConfigSession(toml_data, constants)
+
+    def check():
+        expected = ConfigConverter(dict(session.converter.constants)).generate_output(session.data)
+        assert session.generate_output() == expected
+
+    check()
+    assert session.set("Cart.count", 4) == {("Cart", "count"), ("Cart", "total"), ("Cart", "label")}
+    check()
+    assert session.set(("Cart", "price"), 10) == set()  # Значение не изменилось - зависимые не пересчитываются
+    assert session.set_constant("Currency", "USD") == {("Cart", "label")}
+    check()
+    assert session.set("Shop", "Outlet") == {("Shop",), ("Cart", "label"), ("Cart", "Item", "title")}
+    check()
+    session.set("Cart.Item.name", "Pencil")
+    session.set("Cart.Item.Shop", "Corner")  # Новый ключ перекрывает Shop для title
+    assert "title := \"Item Pencil from Corner\";" in session.generate_output()
+    check()
+    session.set("Other", {"value": "{Tax * 10}"})
+    session.delete("Cart.Item")
+    check()
+    assert session.generate_output() == ConfigConverter(dict(session.converter.constants)).generate_output(session.data)
+    assert toml_data["Cart"]["count"] == 3  # Исходные данные не меняются
+
+    before = session.generate_output()
+    with pytest.raises(ConfigError, match="Cart.price -> Cart.total -> Cart.price"):
+        session.set("Cart.price", "{total}")
+    assert session.generate_output() == before  # Правка с циклом откатывается
+
+    # Кэш хранит собственный текст каждого блока один раз, без текста вложенных блоков
+    cached = sum(len(part) for parts in session.texts.values() for part in parts[::2])
+    assert cached == len(before)
+    # Блок, полученный выражением, выводится заново при смене константы
+    session = ConfigSession({"Deep": {"Web": "{Secrets}"}}, {"Secrets": {"Token": "a", "Inner": {"Id": 1}}})
+    session.generate_output()
+    session.set_constant("Secrets", {"Token": "b", "Inner": {"Id": 2}})
+    check()
+
+# Шаблоны подстановок разбираются один раз и переиспользуются
+def test_template_cache():
+    compile_template.cache_clear()
+    assert compile_template("Host {Name}.{Domain}:{Port}") == ("Host ", "Name", ".", "Domain", ":", "Port", "")
+    converter = ConfigConverter(constants={"Domain": "example.org"})
+    toml_data = toml.loads("""
+    [A]
+    Name = "a"
+    Port = 80
+    Host = "Host {Name}.{Domain}:{Port}"
+    Tags = ["{Name}-tag", "keep {Unknown}"]
+    [B]
+    Name = "b"
+    Port = 81
+    Host = "Host {Name}.{Domain}:{Port}"
+    """)
+    output = converter.generate_output(toml_data)
+    assert 'Host := "Host a.example.org:80";' in output and 'Host := "Host b.example.org:81";' in output
+    assert 'Tags := << "a-tag", "keep {Unknown}" >>;' in output
+    assert compile_template.cache_info().hits > 0
+
+def random_value(rng, depth):
+    """
+    Случайное значение для проверки разбора: строки без фигурных скобок (они - подстановки),
+    однотипные массивы, массивы таблиц и массивы из значений разных типов.
+    """
+    kind = rng.randrange(7 if depth < 4 else 4)
+    if kind == 0:
+        return rng.randint(-10 ** 12, 10 ** 12)
+    if kind == 1:
+        return rng.uniform(-1e6, 1e6) * rng.choice([1, 1e-9, 1e20])
+    if kind == 2:
+        return "".join(rng.choices(string.ascii_letters + string.digits + " \n\t:=;,<>'\"\\привет", k=rng.randint(0, 20)))
+    if kind == 3:
+        return rng.random() < 0.5
+    if kind == 4:
+        item = rng.choice([
+            lambda: rng.randint(-99, 99), lambda: rng.choice(["a", "b c", ""]), lambda: [rng.randint(0, 9)],
+            lambda: random_block(rng, depth + 1),
+        ])
+        return [item() for _ in range(rng.randint(0, 5))]
+    if kind == 5:
+        return [random_value(rng, depth + 1) for _ in range(rng.randint(2, 4))]
+    return random_block(rng, depth)
+
+
+def random_block(rng, depth):
+    names = ["begin", "end", "_x"] + [rng.choice(string.ascii_letters) + str(i) for i in range(8)]
+    return {name: random_value(rng, depth + 1) for name in rng.sample(names, rng.randint(0, 6))}
+
+
+def quoted_strings(value):
+    """Есть ли в значении строка с кавычкой."""
+    if isinstance(value, dict):
+        return any(quoted_strings(item) for item in value.values())
+    if isinstance(value, list):
+        return any(quoted_strings(item) for item in value)
+    return isinstance(value, str) and '"' in value
+
+
+def mixed_arrays(value):
+    """Есть ли в значении массив из значений разных типов."""
+    if isinstance(value, dict):
+        return any(mixed_arrays(item) for item in value.values())
+    if isinstance(value, list):
+        return len(set(map(type, value))) > 1 or any(mixed_arrays(item) for item in value)
+    return False
+
+
+# Разбор выходного языка обратно: случайные конфигурации проходят круг data -> текст -> data -> TOML -> data
+def test_parse_output_roundtrip():
+    converter = ConfigConverter()
+    for seed in range(300):
+        rng = random.Random(seed)
+        data = random_value(rng, 0) if seed % 10 else {}
+        if not isinstance(data, dict):
+            data = {"value": data}
+        if quoted_strings(data):
+            with pytest.raises(ConfigError, match="Кавычка в строке"):
+                converter.generate_output(data)
+            continue
+        text = converter.generate_output(data)
+        parsed = parse_output(text)
+        assert parsed == data, seed
+        assert converter.generate_output(parsed) == text
+        stream = io.StringIO()
+        if mixed_arrays(parsed):
+            with pytest.raises(ConfigError, match="разных типов"):
+                write_toml(parsed, stream)
+        else:
+            write_toml(parsed, stream)
+            assert toml.loads(stream.getvalue()) == data, seed
+
+
+# Массивы таблиц TOML ([[a]] и a = [{...}]) выводятся блоками внутри << >> и читаются обратно
+def test_parse_output_array_of_tables():
+    converter = ConfigConverter()
+    data = toml.loads("""
+    inline = [{x = 1}, {x = 2, tags = ["a"]}]
+    [[servers]]
+    name = "alpha"
+    [servers.limits]
+    cpu = 2
+    [[servers]]
+    name = "beta"
+    """)
+    text = converter.generate_output(data)
+    assert "servers := << begin" in text
+    parsed = parse_output(text)
+    assert parsed == data
+    stream = io.StringIO()
+    write_toml(parsed, stream)
+    assert toml.loads(stream.getvalue()) == data
+
+
+# Входные данные, которые язык не может передать без потерь, отвергаются с ConfigError
+def test_roundtrip_rejected_inputs():
+    converter = ConfigConverter()
+    data = toml.loads("when = 1979-05-27T07:32:00Z\nday = 1979-05-27\nat = 07:32:00\n")
+    for key, value in data.items():
+        with pytest.raises(ConfigError, match="Дата и время"):
+            converter.generate_output({key: value})
+        with pytest.raises(ConfigError, match="Дата и время"):
+            converter.generate_output({"items": [value]})
+    with pytest.raises(ConfigError, match="разных типов"):
+        write_toml(parse_output('begin x := << 1, "a" >>; end'), io.StringIO())
+    # В строках нет экранирования: кавычка закрыла бы строку, поэтому вывод отказывает
+    for data in ({"k": 'a"; b := "c'}, {"k": ["ok", 'say "hi"']}, {"k": [{"x": '"'}]}):
+        with pytest.raises(ConfigError, match="Кавычка в строке"):
+            converter.generate_output(data)
+
+
+def test_parse_output_errors():
+    assert parse_output("begin end") == {}
+    assert parse_output('begin x := << << 1 >>, << >> >>; y := -inf; end')["x"] == [[1], []]
+    for text, message in [
+        ("x := 1;", "начинаться с begin"),
+        ("begin\n  x := 1\nend", "в строке 2: 'x := 1'"),
+        ("begin\n  x := @;\nend", "в строке 2"),
+        ("begin x := begin y := 1; end; ", "Не хватает end"),
+        ("begin x := begin y := 1; end end", "Ожидалось ';' после end"),
+        ("begin x := << 1, 2; end", "в массиве"),
+        ("begin x := << 1, >>; end", "Ожидалось значение массива"),
+        ("begin x := 1; end end", "Лишний текст"),
+        ("begin x := maybe; end", "Ожидалось 'имя := значение;'"),
+    ]:
+        with pytest.raises(ConfigError, match=message):
+            parse_output(text)
+
+
+def test_totoml_main(tmp_path, capsys):
+    source = tmp_path / "app.cfg"
+    source.write_text(ConfigConverter().generate_output({"name": "App", "Limits": {"cpu": 2, "tags": ["a"]}}), encoding="utf-8")
+    assert main(["totoml", str(source)]) == 0
+    assert toml.loads(capsys.readouterr().out) == {"name": "App", "Limits": {"cpu": 2, "tags": ["a"]}}
+    source.write_text("begin x := ; end", encoding="utf-8")
+    assert main(["totoml", str(source), str(tmp_path / "out.toml")]) == 1
+    assert "app.cfg: Ожидалось 'имя := значение;' или end в строке 1" in capsys.readouterr().err
+    assert main(["totoml", str(tmp_path / "missing.cfg")]) == 1
+    assert "missing.cfg: [Errno 2]" in capsys.readouterr().err
+    source.write_bytes(b"begin x := \"\xff\"; end")
+    assert main(["totoml", str(source)]) == 1
+    assert "app.cfg: 'utf-8' codec can't decode" in capsys.readouterr().err
+    source.write_text('begin x := << 1, "a" >>; end', encoding="utf-8")
+    assert main(["totoml", str(source), str(tmp_path / "out.toml")]) == 1
+    assert "out.toml: Массив из значений разных типов" in capsys.readouterr().err
+    assert not (tmp_path / "out.toml").exists()
+    assert main(["totoml", str(source), str(tmp_path / "no" / "out.toml")]) == 1
+    assert "out.toml: [Errno 2]" in capsys.readouterr().err
@@ -0,0 +1,212 @@
+"""
+Бенчмарки эмулятора на синтетических архивах.
+
+Запуск как скрипта печатает отчёт (python bench_emulator.py --sizes 1000,100000,1000000),
+запуск через pytest с установленным pytest-benchmark - те же замеры в виде бенчмарков
+(pytest bench_emulator.py, размеры задаются переменной BENCH_SIZES).
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+import zipfile
+import yaml
+from main import ShellEmulator
+
+try:
+    import pytest  # Нужен только для запуска через pytest, скрипту не требуется
+except ImportError:
+    pytest = None
+try:
+    import pytest_benchmark
+except ImportError:
+    pytest_benchmark = None
+
+COMMANDS = ['ls', 'cd', 'mkdir', 'chown']
+
+
+def make_archive(fs_path, entries, fan_out=100):
+    """
+    Создаёт синтетический архив: entries файлов, разложенных по двухуровневым директориям.
+    Каждый четвёртый файл - повторяющееся содержимое, как у вендоренных библиотек.
+    """
+    with zipfile.ZipFile(fs_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for i in range(entries):
+            data = b'vendored\n' * 16 if i % 4 == 0 else b'%d\n' % i * 16
+            zip_file.writestr(f'd{i // (fan_out * fan_out)}/s{i // fan_out % fan_out}/f{i}.txt', data)
+
+
+def make_emulator(tmp_dir, fs_path, **options):
+    config_path = os.path.join(tmp_dir, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump({'username': 'bench', 'fs_path': fs_path, 'journal_fsync': False, **options}, f)
+    emulator = ShellEmulator(config_path)
+    emulator.stdout = open(os.devnull, 'w')
+    return emulator
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def bench_recursive(emulator):
+    """Время рекурсивной команды и эквивалентного цикла одиночных команд, по парам."""
+    root = emulator.lookup([])
+    paths = []  # Все пути поддерева для циклов из одиночных команд
+    stack = [('', root)]
+    while stack:
+        path, node = stack.pop()
+        if path:
+            paths.append(path)
+        if node.children:
+            stack.extend((f'{path}/{name}'.lstrip('/'), child) for name, child in node.children.items())
+    dirs = ['/' + p for p in paths if emulator.lookup(p.split('/')).is_dir]
+    files = [p for p in paths if not emulator.lookup(p.split('/')).is_dir]
+    deep = '/'.join(f'p{i}' for i in range(50))
+
+    def chown_loop():
+        for path in paths:
+            emulator.execute_command(f'chown loop /{path}')
+
+    def mkdir_loop():
+        for i in range(1, 51):
+            emulator.execute_command('mkdir /' + '/'.join(f'q{j}' for j in range(i)))
+
+    def find_loop():
+        for path in dirs:
+            emulator.execute_command(f'cd {path}')
+            emulator.execute_command('ls')
+        emulator.execute_command('cd /')
+
+    def du_loop():
+        for path in files:
+            emulator.execute_command(f'du /{path}')
+
+    return [
+        ('chown -R', timed(lambda: emulator.execute_command('chown -R bench /')), timed(chown_loop)),
+        ('mkdir -p', timed(lambda: emulator.execute_command(f'mkdir -p /{deep}')), timed(mkdir_loop)),
+        ('find', timed(lambda: emulator.execute_command('find /')), timed(find_loop)),
+        ('du', timed(lambda: emulator.execute_command('du /')), timed(du_loop)),
+    ]
+
+
+def measure_init(fs_path, lazy, tmp_dir):
+    """Время init_fs и пиковый RSS; выполняется в отдельном процессе, чтобы замеры не смешивались."""
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    emulator = make_emulator(tmp_dir, fs_path, lazy=lazy, journal=False)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    emulator.close()
+    return elapsed, peak / 1024, (peak - before) / 1024  # ru_maxrss в Linux - в килобайтах
+
+
+def command_script(emulator, count):
+    """Команды ls/cd/mkdir/chown по существующим путям архива."""
+    dirs = sorted(emulator.lookup([]).children)
+    script = []
+    for i in range(count):
+        top = dirs[i % len(dirs)]
+        script += [
+            ('cd', f'cd /{top}'),
+            ('ls', 'ls'),
+            ('mkdir', f'mkdir bench{i}'),
+            ('chown', f'chown bench /{top}'),
+        ]
+    return script
+
+
+def measure_commands(emulator, count):
+    """Задержка каждой команды в микросекундах: медиана, 99-й перцентиль и среднее."""
+    samples = {cmd: [] for cmd in COMMANDS}
+    for cmd, command in command_script(emulator, count):
+        start = time.perf_counter()
+        emulator.execute_command(command)
+        samples[cmd].append((time.perf_counter() - start) * 1e6)
+    report = {}
+    for cmd, values in samples.items():
+        values.sort()
+        report[cmd] = (values[len(values) // 2], values[int(len(values) * 0.99)], sum(values) / len(values))
+    return report
+
+
+def bench_sizes():
+    return [int(size) for size in os.environ.get('BENCH_SIZES', '1000,100000').split(',')]
+
+
+if pytest is not None:
+    requires_benchmark = pytest.mark.skipif(pytest_benchmark is None, reason="нужен pytest-benchmark")
+
+    @pytest.fixture(scope='module', params=bench_sizes())
+    def archive(request, tmp_path_factory):
+        tmp_dir = tmp_path_factory.mktemp(f'fs{request.param}')
+        fs_path = str(tmp_dir / 'filesystem.zip')
+        make_archive(fs_path, request.param)
+        return str(tmp_dir), fs_path
+
+
+    @requires_benchmark
+    @pytest.mark.parametrize('lazy', [False, True])
+    def test_init_fs(benchmark, archive, lazy):
+        tmp_dir, fs_path = archive
+        emulator = make_emulator(tmp_dir, fs_path, lazy=lazy, journal=False)
+        benchmark(emulator.init_fs)
+        emulator.close()
+
+
+    @requires_benchmark
+    @pytest.mark.parametrize('cmd', COMMANDS)
+    def test_command_latency(benchmark, archive, cmd):
+        tmp_dir, fs_path = archive
+        emulator = make_emulator(tmp_dir, fs_path, lazy=True, journal_fsync=False)
+        # Команды повторяются по кругу: pytest-benchmark сам выбирает число раундов
+        commands = itertools.cycle([command for name, command in command_script(emulator, 1000) if name == cmd])
+        benchmark(lambda: emulator.execute_command(next(commands)))
+        emulator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки эмулятора на синтетических архивах.")
+    parser.add_argument("--sizes", default="1000,100000", help="Размеры архивов через запятую (например 1000,100000,1000000).")
+    parser.add_argument("--commands", type=int, default=1000, help="Число повторов каждой команды.")
+    parser.add_argument("--timing-log", help="Включить замер времени в execute_command и сохранить гистограммы в файл.")
+    parser.add_argument("--recursive", action="store_true", help="Сравнить рекурсивные команды с циклом одиночных.")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')  # Чистый процесс для каждого замера RSS
+    for entries in (int(size) for size in args.sizes.split(',')):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            fs_path = os.path.join(tmp_dir, 'filesystem.zip')
+            make_archive(fs_path, entries)
+            print(f"== {entries} файлов, архив {os.path.getsize(fs_path) / 2 ** 20:.1f} МБ")
+            for lazy in (False, True):
+                with context.Pool(1) as pool:
+                    elapsed, peak, growth = pool.apply(measure_init, (fs_path, lazy, tmp_dir))
+                mode = 'lazy' if lazy else 'eager'
+                print(f"init_fs {mode:<6} {elapsed:8.3f} с, пиковый RSS {peak:8.1f} МБ (+{growth:.1f} МБ)")
+
+            options = {'lazy': True, 'journal_fsync': False}
+            if args.timing_log:
+                options['timing_log'] = args.timing_log
+            emulator = make_emulator(tmp_dir, fs_path, **options)
+            print(f"{'команда':<8} {'p50, мкс':>10} {'p99, мкс':>10} {'среднее, мкс':>14}")
+            for cmd, (p50, p99, mean) in measure_commands(emulator, args.commands).items():
+                print(f"{cmd:<8} {p50:>10.1f} {p99:>10.1f} {mean:>14.1f}")
+            if args.recursive:
+                print(f"{'команда':<10} {'рекурсивно, с':>14} {'цикл, с':>10} {'ускорение':>10}")
+                for name, single, loop in bench_recursive(emulator):
+                    print(f"{name:<10} {single:>14.4f} {loop:>10.4f} {loop / single:>9.1f}x")
+            emulator.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import bisect
+import json
+import os
+import shutil
+import threading
+import zipfile
+
+
+def subtree_range(paths, path):
+    """Границы поддерева path в отсортированном списке путей: все потомки идут подряд."""
+    if not path:
+        return 0, len(paths)
+    return bisect.bisect_left(paths, path + '/'), bisect.bisect_left(paths, path + '0')  # '0' следует за '/'
+
+
+def compact_archive(fs_path, records):
+    """
+    Переписывает архив с учётом записей журнала.
+    Владельцы сохраняются в комментариях записей архива, владелец корня - в комментарии архива.
+    """
+    tmp_path = fs_path + '.compact'
+    with zipfile.ZipFile(fs_path) as src, zipfile.ZipFile(tmp_path, 'w') as dst:
+        infos = src.infolist()
+        # Отсортированный список всех путей архива, включая неявные директории
+        paths = set()
+        for info in infos:
+            parts = [p for p in info.filename.split('/') if p]
+            paths.update('/'.join(parts[:i]) for i in range(1, len(parts) + 1))
+        paths = sorted(paths)
+
+        owners = {}  # Путь -> владелец для изменённых узлов
+        for record in records:
+            path, owner = record['path'], record['owner']
+            if record['op'] == 'mkdir':
+                # Недостающие родители (mkdir -p) создаются с тем же владельцем
+                parts = path.split('/')
+                for i in range(1, len(parts) + 1):
+                    prefix = '/'.join(parts[:i])
+                    pos = bisect.bisect_left(paths, prefix)
+                    if pos == len(paths) or paths[pos] != prefix:
+                        paths.insert(pos, prefix)
+                        owners[prefix] = owner
+            elif record.get('recursive'):
+                start, end = subtree_range(paths, path)
+                for child in paths[start:end]:
+                    owners[child] = owner
+            owners[path] = owner
+
+        seen = set()
+        for info in infos:
+            path = info.filename.strip('/')
+            seen.add(path)
+            new_info = zipfile.ZipInfo(info.filename, info.date_time)
+            new_info.compress_type = info.compress_type
+            new_info.external_attr = info.external_attr
+            new_info.comment = owners[path].encode('utf-8') if path in owners else info.comment
+            if info.is_dir():
+                dst.writestr(new_info, b'')
+            else:
+                with src.open(info) as s, dst.open(new_info, 'w', force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as d:
+                    shutil.copyfileobj(s, d)
+        # Корень не имеет записи в архиве: его владелец хранится в комментарии архива
+        root_owner = owners.pop('', None)
+        dst.comment = root_owner.encode('utf-8') if root_owner is not None else src.comment
+        # Узлы без записи в архиве - это новые или неявные директории
+        for path, owner in owners.items():
+            if path not in seen:
+                new_info = zipfile.ZipInfo(path + '/')
+                new_info.external_attr = 0o40755 << 16 | 0x10
+                new_info.comment = owner.encode('utf-8')
+                dst.writestr(new_info, b'')
+    os.replace(tmp_path, fs_path)
+
+
+class Journal:
+    """Дописываемый журнал изменений виртуальной файловой системы, хранится рядом с архивом."""
+
+    def __init__(self, fs_path, fsync=True, batch_size=1, compact_bytes=1024 * 1024):
+        self.fs_path = fs_path
+        self.path = fs_path + '.journal'
+        self.fsync = fsync
+        self.batch_size = batch_size  # Сколько записей копить перед сбросом на диск
+        self.compact_bytes = compact_bytes  # Порог размера журнала для уплотнения архива
+        self.lock = threading.Lock()
+        self.pending = []
+        self.compaction = None  # Фоновый поток уплотнения
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def replay(self):
+        """Возвращает записи журнала в порядке добавления."""
+        with self.lock:
+            self._flush()
+            return self._read(0, self.file.tell())[0]
+
+    def append(self, record):
+        """Добавляет запись; на диск она попадает пачками по batch_size."""
+        with self.lock:
+            self.pending.append(json.dumps(record, ensure_ascii=False) + '\n')
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+            if self.compaction is None and self.file.tell() >= self.compact_bytes:
+                self.compaction = threading.Thread(target=self.compact, daemon=True)
+                self.compaction.start()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        self.file.write(''.join(self.pending))
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.pending.clear()
+
+    def _read(self, start, end):
+        # Читает записи из диапазона байтов журнала
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            chunk = f.read(end - start)
+        return [json.loads(line) for line in chunk.splitlines() if line.strip()], chunk
+
+    def compact(self):
+        """Переносит записи журнала в новый архив и оставляет в журнале только более поздние."""
+        try:
+            with self.lock:
+                self._flush()
+                offset = self.file.tell()
+            records = self._read(0, offset)[0]
+            compact_archive(self.fs_path, records)
+            with self.lock:
+                self._flush()
+                tail = self._read(offset, self.file.tell())[1]
+                self.file.close()
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                self.file = open(self.path, 'a', encoding='utf-8')
+        finally:
+            self.compaction = None
+
+    def wait(self):
+        """Дожидается завершения фонового уплотнения."""
+        compaction = self.compaction
+        if compaction is not None:
+            compaction.join()
+
+    def close(self):
+        self.wait()
+        with self.lock:
+            self._flush()
+            self.file.close()
@@ -1,7 +1,132 @@
-import os
+import argparse
+import copy
+import fnmatch
+import hashlib
+import json
+import posixpath
+import struct
+import sys
 import zipfile
 import io
+import mmap
+import threading
+import time
+from collections import OrderedDict, namedtuple
 import yaml
+from journal import Journal
+
+
+class Node:
+    """Узел дерева виртуальной файловой системы (директория или файл)."""
+    __slots__ = ('name', 'parent', 'children', 'data', 'owner')
+
+    def __init__(self, name, parent=None, is_dir=True, data=None, owner='system'):
+        self.name = name
+        self.parent = parent
+        self.children = {} if is_dir else None  # Дочерние узлы только у директорий
+        self.data = data
+        self.owner = owner
+
+    @property
+    def is_dir(self):
+        return self.children is not None
+
+
+class PathLocks:
+    """
+    Блокировки путей для сессий, разделяющих одно дерево.
+    Блокировка выбирается по хешу пути, поэтому память не растёт с числом путей и сессий.
+    """
+
+    def __init__(self, size=64):
+        self.locks = [threading.Lock() for _ in range(size)]
+
+    def __call__(self, parts):
+        return self.locks[hash('/'.join(parts)) % len(self.locks)]
+
+
+class BlobStore:
+    """
+    Хранилище содержимого файлов по хешу: одинаковые файлы хранятся один раз,
+    для каждого содержимого ведётся счётчик ссылок.
+    """
+
+    def __init__(self):
+        self.blobs = {}  # Хеш -> [содержимое, число ссылок]
+        self.refs = 0
+        self.logical_bytes = 0  # Размер всех ссылок, как если бы копии хранились отдельно
+        self.resident_bytes = 0  # Уникальное содержимое, скопированное в память
+        self.mapped_bytes = 0  # Уникальное содержимое - срезы отображения архива без копирования
+        self.lock = threading.Lock()
+
+    def add(self, data):
+        """Добавляет ссылку на содержимое и возвращает его хеш."""
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        with self.lock:
+            blob = self.blobs.get(key)
+            if blob is None:
+                self.blobs[key] = [data, 1]
+                if isinstance(data, memoryview):
+                    self.mapped_bytes += len(data)
+                else:
+                    self.resident_bytes += len(data)
+            else:
+                blob[1] += 1
+            self.refs += 1
+            self.logical_bytes += len(data)
+        return key
+
+    def get(self, key):
+        return self.blobs[key][0]
+
+    def release(self, key):
+        """Снимает ссылку; содержимое удаляется, когда ссылок не осталось."""
+        with self.lock:
+            blob = self.blobs[key]
+            blob[1] -= 1
+            self.refs -= 1
+            self.logical_bytes -= len(blob[0])
+            if blob[1] == 0:
+                del self.blobs[key]
+                if isinstance(blob[0], memoryview):
+                    self.mapped_bytes -= len(blob[0])
+                else:
+                    self.resident_bytes -= len(blob[0])
+
+    def clear(self):
+        with self.lock:
+            for data, _ in self.blobs.values():
+                if isinstance(data, memoryview):
+                    data.release()  # Иначе отображение архива нельзя закрыть
+            self.blobs.clear()
+            self.refs = self.logical_bytes = self.resident_bytes = self.mapped_bytes = 0
+
+
+# Результат команды в пакетном режиме: текст команды, её вывод и код завершения
+CommandResult = namedtuple('CommandResult', ['command', 'output', 'code'])
+
+
+class MappedFile(io.RawIOBase):
+    """Файловый объект только для чтения поверх mmap (нужен zipfile, mmap не реализует seekable)."""
+
+    def __init__(self, fs_map):
+        self.fs_map = fs_map
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.fs_map.seek(offset, whence)
+        return self.fs_map.tell()
+
+    def tell(self):
+        return self.fs_map.tell()
+
+    def read(self, size=-1):
+        return self.fs_map.read(None if size is None or size < 0 else size)
 
 
 class ShellEmulator:
@@ -11,29 +136,197 @@ class ShellEmulator:
         self.username = self.config.get('username', 'user')
         self.fs_path = self.config['fs_path']
         self.current_dir = '/'
+        self.stdout = None  # Поток вывода команд (None - sys.stdout)
+        # Ленивый режим: архив отображается в память, файлы распаковываются по требованию
+        self.lazy = self.config.get('lazy', False)
+        self.cache_bytes = self.config.get('cache_bytes', 64 * 1024 * 1024)
+        # Журнал изменений: fsync, размер пачки и порог уплотнения настраиваются
+        self.use_journal = self.config.get('journal', False)
+        self.journal_fsync = self.config.get('journal_fsync', True)
+        self.journal_batch = self.config.get('journal_batch', 1)
+        self.compact_bytes = self.config.get('compact_bytes', 1024 * 1024)
+        # Замер времени команд: гистограммы пишутся в timing_log при закрытии
+        self.timing_log = self.config.get('timing_log')
+        self.timings = {} if self.timing_log else None
+        self.timings_lock = threading.Lock()
 
         # Инициализация виртуальной файловой системы
-        self.fs = {}  # Словарь для хранения файловой системы
-        self.owners = {}  # Словарь для хранения владельцев файлов
+        self.root = Node('')  # Корень дерева директорий, владельцы хранятся в узлах
+        self.fs_map = None  # mmap архива
+        self.zip_file = None
+        self.journal = None
+        self.blobs = BlobStore()  # Содержимое файлов, хранящееся по хешу
+        self.blob_cache = OrderedDict()  # LRU-кэш ленивого режима: смещение записи -> хеш содержимого
+        self.cache_lock = threading.Lock()
+        self.path_locks = PathLocks()
         self.init_fs()
 
+    def session(self, username=None):
+        """
+        Создаёт сессию над той же загруженной ФС: дерево, архив, кэш и журнал общие,
+        собственные только текущая директория, пользователь и поток вывода.
+        """
+        session = copy.copy(self)
+        session.username = username or self.username
+        session.current_dir = '/'
+        session.stdout = None
+        return session
+
     def load_config(self, config_file):
         with open(config_file, 'r') as file:
             return yaml.safe_load(file)
 
     def init_fs(self):
-        # Загружаем виртуальную файловую систему из zip-архива в словари
+        # Загружаем виртуальную файловую систему из zip-архива в дерево директорий
+        self.close()
+        self.root = Node('')
+        # Архив отображается в память, а не читается целиком: в ленивом режиме
+        # читается только центральный каталог, несжатые файлы не копируются вовсе
         with open(self.fs_path, 'rb') as f:
-            zip_buffer = io.BytesIO(f.read())
-        with zipfile.ZipFile(zip_buffer) as zip_file:
-            for file_info in zip_file.infolist():
-                path = file_info.filename
-                if file_info.is_dir():
-                    self.fs[path] = None  # None для директорий
-                else:
-                    with zip_file.open(path) as file:
-                        self.fs[path] = file.read()  # Содержимое файла в байтах
-                self.owners[path] = 'system'  # По умолчанию владелец 'system'
+            self.fs_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.zip_file = zipfile.ZipFile(MappedFile(self.fs_map))
+        self.index_archive(self.zip_file)
+        if self.use_journal:
+            # Повторяем изменения, сделанные после последнего уплотнения архива
+            self.journal = Journal(self.fs_path, self.journal_fsync, self.journal_batch, self.compact_bytes)
+            for record in self.journal.replay():
+                self.apply_record(record)
+
+    def index_archive(self, zip_file):
+        # Строит дерево директорий по записям архива
+        self.root.owner = zip_file.comment.decode('utf-8') or 'system'  # Владелец корня - комментарий архива
+        for file_info in zip_file.infolist():
+            parts = [p for p in file_info.filename.split('/') if p]
+            if not parts:
+                continue
+            parent = self.make_dirs(parts[:-1])
+            owner = file_info.comment.decode('utf-8') or 'system'  # Владелец из комментария записи
+            if file_info.is_dir():
+                self.make_dirs(parts).owner = owner
+            elif self.lazy:
+                # Вместо содержимого храним описание записи архива
+                parent.children[parts[-1]] = Node(parts[-1], parent, is_dir=False, data=file_info, owner=owner)
+            else:
+                # В узле хранится хеш содержимого, одинаковые файлы делят одну копию
+                key = self.blobs.add(self.read_member(file_info))
+                parent.children[parts[-1]] = Node(parts[-1], parent, is_dir=False, data=key, owner=owner)
+
+    def apply_record(self, record):
+        # Применяет запись журнала к дереву; повторное применение ничего не меняет
+        parts = [p for p in record['path'].split('/') if p]
+        if record['op'] == 'mkdir':
+            # Недостающие родители (mkdir -p) получают того же владельца
+            self.make_dirs(parts, record['owner']).owner = record['owner']
+        elif record['op'] == 'chown':
+            node = self.lookup(parts)
+            if node is not None:
+                for child in (self.walk(node) if record.get('recursive') else [node]):
+                    child.owner = record['owner']
+
+    def persist(self, op, parts, owner, recursive=False):
+        # Сохраняет изменение в журнал за O(1), без перезаписи архива;
+        # рекурсивная операция записывается одной записью, а не записью на каждый узел
+        if self.journal is not None:
+            record = {'op': op, 'path': '/'.join(parts), 'owner': owner}
+            if recursive:
+                record['recursive'] = True
+            self.journal.append(record)
+
+    def walk(self, node):
+        # Обход поддерева за один проход без рекурсии
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.children:
+                stack.extend(node.children.values())
+
+    def file_size(self, node):
+        # Размер файла без распаковки: в ленивом режиме берётся из записи архива
+        if isinstance(node.data, zipfile.ZipInfo):
+            return node.data.file_size
+        return len(self.blobs.get(node.data))
+
+    def close(self):
+        # Сбрасывает журнал и замеры времени, освобождает отображение архива и кэш распакованных файлов
+        if self.timings is not None:
+            self.write_timings()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if self.zip_file is not None:
+            self.zip_file.close()
+            self.zip_file = None
+        self.blob_cache.clear()
+        self.blobs.clear()
+        if self.fs_map is not None:
+            try:
+                self.fs_map.close()
+            except BufferError:
+                pass  # Содержимое ещё используется снаружи, отображение закроется сборщиком мусора
+            self.fs_map = None
+
+    def read_member(self, file_info):
+        # Несжатая запись отдаётся срезом отображения архива без копирования,
+        # сжатая распаковывается (единственная копия)
+        offset = file_info.header_offset
+        if (file_info.compress_type == zipfile.ZIP_STORED and not file_info.flag_bits & 0x1
+                and self.fs_map[offset:offset + 4] == b'PK\x03\x04'):
+            name_len, extra_len = struct.unpack_from('<HH', self.fs_map, offset + 26)
+            start = offset + 30 + name_len + extra_len
+            return memoryview(self.fs_map)[start:start + file_info.file_size]
+        return self.zip_file.read(file_info)
+
+    def read_file(self, node):
+        # Возвращает содержимое файла, распаковывая его из архива при первом обращении
+        if not isinstance(node.data, zipfile.ZipInfo):
+            return self.blobs.get(node.data)
+        offset = node.data.header_offset
+        with self.cache_lock:
+            key = self.blob_cache.get(offset)
+            if key is not None:
+                self.blob_cache.move_to_end(offset)
+                return self.blobs.get(key)
+        data = self.read_member(node.data)
+        key = self.blobs.add(data)
+        with self.cache_lock:
+            if offset in self.blob_cache:
+                self.blobs.release(key)
+            else:
+                self.blob_cache[offset] = key
+            data = self.blobs.get(self.blob_cache[offset])
+            # Вытесняем давно не использованные файлы, пока скопированное содержимое превышает лимит
+            while self.blobs.resident_bytes > self.cache_bytes and len(self.blob_cache) > 1:
+                _, old = self.blob_cache.popitem(last=False)
+                self.blobs.release(old)
+        return data
+
+    def make_dirs(self, parts, owner='system'):
+        # Возвращает узел директории по пути, создавая недостающие промежуточные директории
+        node = self.root
+        for part in parts:
+            child = node.children.get(part)
+            if child is None:
+                child = Node(part, node, owner=owner)
+                node.children[part] = child
+            node = child
+        return node
+
+    def split_path(self, path):
+        # Нормализует путь относительно текущей директории и разбивает его на компоненты
+        full_path = posixpath.normpath(posixpath.join('/', self.current_dir, path))
+        return [p for p in full_path.split('/') if p]
+
+    def lookup(self, parts):
+        # Поиск узла по списку компонентов пути за O(глубина)
+        node = self.root
+        for part in parts:
+            if not node.is_dir:
+                return None
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
 
     def run(self):
         while True:
@@ -43,68 +336,285 @@ class ShellEmulator:
                     self.execute_command(command.strip())
             except (KeyboardInterrupt, EOFError):
                 print("\nExiting shell.")
+                self.close()
                 break
+            except SystemExit:
+                self.close()
+                raise
 
     def execute_command(self, command):
+        # Выполняет команду и возвращает код завершения (0 - успех)
+        if self.timings is None:
+            return self.dispatch(command)
+        start = time.perf_counter()
+        try:
+            return self.dispatch(command)
+        finally:
+            self.record_timing(command.split()[0], time.perf_counter() - start)
+
+    def record_timing(self, cmd, elapsed):
+        # Гистограмма по степеням двойки: корзина N содержит команды, выполнявшиеся < N мкс
+        bucket = 1 << int(elapsed * 1e6).bit_length()
+        with self.timings_lock:
+            stats = self.timings.setdefault(cmd, {'count': 0, 'total_us': 0.0, 'max_us': 0.0, 'histogram': {}})
+            stats['count'] += 1
+            stats['total_us'] += elapsed * 1e6
+            stats['max_us'] = max(stats['max_us'], elapsed * 1e6)
+            stats['histogram'][bucket] = stats['histogram'].get(bucket, 0) + 1
+
+    def write_timings(self):
+        # Сохраняет гистограммы времени команд в YAML
+        with self.timings_lock:
+            if not self.timings:
+                return
+            report = {}
+            for cmd, stats in sorted(self.timings.items()):
+                report[cmd] = {
+                    'count': stats['count'],
+                    'mean_us': round(stats['total_us'] / stats['count'], 1),
+                    'max_us': round(stats['max_us'], 1),
+                    'histogram_us': {f'<{bucket}': n for bucket, n in sorted(stats['histogram'].items())},
+                }
+        with open(self.timing_log, 'w') as f:
+            yaml.safe_dump(report, f, sort_keys=False)
+
+    def dispatch(self, command):
         args = command.split()
         cmd = args[0]
 
         if cmd == 'exit':
-            print("Exiting shell.")
-            exit(0)
+            # Только завершает оболочку или сценарий; ФС закрывает тот, кто её открыл
+            print("Exiting shell.", file=self.stdout)
+            sys.exit(0)
         elif cmd == 'ls':
-            self.ls()
+            return self.ls()
         elif cmd == 'cd':
-            self.cd(args[1] if len(args) > 1 else '/')
+            return self.cd(args[1] if len(args) > 1 else '/')
         elif cmd == 'mkdir':
-            if len(args) < 2:
-                print("mkdir: missing operand")
-            else:
-                self.mkdir(args[1])
+            operands = [a for a in args[1:] if a != '-p']
+            if len(operands) < 1:
+                print("mkdir: missing operand", file=self.stdout)
+                return 1
+            return self.mkdir(operands[0], parents='-p' in args)
         elif cmd == 'chown':
-            if len(args) < 3:
-                print("chown: missing operand")
-            else:
-                self.chown(args[1], args[2])
-        else:
-            print(f'{cmd}: command not found')
+            operands = [a for a in args[1:] if a != '-R']
+            if len(operands) < 2:
+                print("chown: missing operand", file=self.stdout)
+                return 1
+            return self.chown(operands[0], operands[1], recursive='-R' in args)
+        elif cmd == 'find':
+            pattern = None
+            if '-name' in args:
+                i = args.index('-name')
+                if i + 1 >= len(args):
+                    print("find: missing argument to '-name'", file=self.stdout)
+                    return 1
+                pattern = args[i + 1]
+                args = args[:i] + args[i + 2:]
+            return self.find(args[1] if len(args) > 1 else '.', pattern)
+        elif cmd == 'stats':
+            return self.stats()
+        elif cmd == 'du':
+            return self.du(args[1] if len(args) > 1 else '.')
+        elif cmd == 'cat':
+            if len(args) < 2:
+                print("cat: missing operand", file=self.stdout)
+                return 1
+            return self.cat(args[1])
+        print(f'{cmd}: command not found', file=self.stdout)
+        return 127
+
+    def iter_batch(self, lines):
+        """
+        Выполняет команды из потока строк над одной загруженной ФС.
+        Вывод каждой команды буферизуется; возвращает CommandResult по мере выполнения.
+        """
+        stdout = self.stdout
+        try:
+            for line in lines:
+                command = line.strip()
+                if not command or command.startswith('#'):
+                    continue
+                self.stdout = buffer = io.StringIO()
+                try:
+                    code = self.execute_command(command)
+                except SystemExit:
+                    # exit завершает сценарий, но не процесс
+                    yield CommandResult(command, buffer.getvalue(), 0)
+                    return
+                yield CommandResult(command, buffer.getvalue(), code)
+        finally:
+            self.stdout = stdout
+
+    def run_batch(self, lines):
+        """Выполняет сценарий целиком и возвращает список результатов команд."""
+        return list(self.iter_batch(lines))
 
     def ls(self):
-        # Список файлов в текущей директории внутри архива
-        path = self.current_dir.lstrip('/')
-        entries = {p for p in self.fs.keys() if p.startswith(path)}
-        for entry in entries:
-            relative_entry = os.path.relpath(entry, path)
-            print(relative_entry.split('/')[0])  # Only print top-level files in the current directory
+        # Список непосредственных потомков текущей директории
+        parts = self.split_path('.')
+        node = self.lookup(parts)
+        with self.path_locks(parts):
+            names = sorted(node.children)
+        print(''.join(name + '\n' for name in names), end='', file=self.stdout)
+        return 0
 
     def cd(self, path):
-        # Переход в другую директорию внутри словаря fs
-        new_dir = os.path.normpath(os.path.join(self.current_dir, path)).lstrip('/')
-        if new_dir in self.fs and self.fs[new_dir] is None:  # Проверка на существование директории
-            self.current_dir = new_dir
-        else:
-            print(f"cd: {path}: No such directory")
+        # Переход в другую директорию по дереву
+        parts = self.split_path(path)
+        node = self.lookup(parts)
+        if node is not None and node.is_dir:  # Проверка на существование директории
+            self.current_dir = '/'.join(parts) or '/'
+            return 0
+        print(f"cd: {path}: No such directory", file=self.stdout)
+        return 1
 
-    def mkdir(self, path):
-        # Создание новой директории в словаре fs
-        new_dir = os.path.normpath(os.path.join(self.current_dir, path)).lstrip('/')
-        if new_dir in self.fs:
-            print(f"mkdir: cannot create directory '{path}': Directory exists")
-        else:
-            self.fs[new_dir] = None  # Добавляем директорию в fs
-            self.owners[new_dir] = self.username  # Назначаем владельца текущего пользователя
-            print(f"Directory '{path}' created.")
-
-    def chown(self, user, path):
-        # Изменение владельца файла/директории в словаре owners
-        target_path = os.path.normpath(os.path.join(self.current_dir, path)).lstrip('/')
-        if target_path in self.fs:
-            self.owners[target_path] = user  # Изменяем владельца
-            print(f"Owner of '{path}' changed to {user}.")
-        else:
-            print(f"chown: cannot access '{path}': No such file or directory")
+    def cat(self, path):
+        # Вывод содержимого файла, в ленивом режиме распаковывается только этот файл
+        node = self.lookup(self.split_path(path))
+        if node is None:
+            print(f"cat: {path}: No such file or directory", file=self.stdout)
+            return 1
+        if node.is_dir:
+            print(f"cat: {path}: Is a directory", file=self.stdout)
+            return 1
+        text = str(self.read_file(node), 'utf-8', errors='replace')
+        print(text, end='' if text.endswith('\n') else '\n', file=self.stdout)
+        return 0
+
+    def find(self, path, pattern=None):
+        # Вывод всех путей поддерева (в порядке обхода в глубину), с фильтром по имени
+        node = self.lookup(self.split_path(path))
+        if node is None:
+            print(f"find: '{path}': No such file or directory", file=self.stdout)
+            return 1
+        lines = []
+        stack = [(path, node)]
+        while stack:
+            shown, node = stack.pop()
+            if pattern is None or fnmatch.fnmatchcase(posixpath.basename(shown) or shown, pattern):
+                lines.append(shown + '\n')
+            if node.children:
+                prefix = shown.rstrip('/') + '/'
+                stack.extend((prefix + name, node.children[name]) for name in sorted(node.children, reverse=True))
+        print(''.join(lines), end='', file=self.stdout)
+        return 0
+
+    def du(self, path):
+        # Суммарный размер файлов поддерева (как du -s), в байтах
+        node = self.lookup(self.split_path(path))
+        if node is None:
+            print(f"du: cannot access '{path}': No such file or directory", file=self.stdout)
+            return 1
+        total = sum(self.file_size(child) for child in self.walk(node) if not child.is_dir)
+        print(f"{total}\t{path}", file=self.stdout)
+        return 0
+
+    def stats(self):
+        # Статистика хранилища содержимого: дедупликация и занимаемая память
+        files = sum(1 for node in self.walk(self.root) if not node.is_dir)
+        blobs = self.blobs
+        unique_bytes = blobs.resident_bytes + blobs.mapped_bytes
+        ratio = blobs.logical_bytes / unique_bytes if unique_bytes else 1.0
+        print(f"files: {files}", file=self.stdout)
+        print(f"loaded: {blobs.refs}", file=self.stdout)
+        print(f"unique blobs: {len(blobs.blobs)}", file=self.stdout)
+        print(f"logical bytes: {blobs.logical_bytes}", file=self.stdout)
+        print(f"resident bytes: {blobs.resident_bytes}", file=self.stdout)
+        print(f"mapped bytes: {blobs.mapped_bytes}", file=self.stdout)
+        print(f"dedupe ratio: {ratio:.2f}", file=self.stdout)
+        return 0
 
+    def mkdir(self, path, parents=False):
+        # Создание новой директории в дереве
+        parts = self.split_path(path)
+        if parents:
+            return self.mkdir_parents(path, parts)
+        with self.path_locks(parts[:-1]):
+            parent = self.lookup(parts[:-1])
+            if parent is not None and not parent.is_dir:
+                print(f"mkdir: cannot create directory '{path}': Not a directory", file=self.stdout)
+                return 1
+            if not parts or (parent is not None and parts[-1] in parent.children):
+                print(f"mkdir: cannot create directory '{path}': Directory exists", file=self.stdout)
+                return 1
+            if parent is None:
+                print(f"mkdir: cannot create directory '{path}': No such file or directory", file=self.stdout)
+                return 1
+            # Назначаем владельца текущего пользователя
+            parent.children[parts[-1]] = Node(parts[-1], parent, owner=self.username)
+            self.persist('mkdir', parts, self.username)
+        print(f"Directory '{path}' created.", file=self.stdout)
+        return 0
+
+    def mkdir_parents(self, path, parts):
+        # mkdir -p: создаёт все недостающие директории пути за один проход
+        node = self.root
+        created = False
+        for i, part in enumerate(parts):
+            if not node.is_dir:
+                break
+            with self.path_locks(parts[:i]):
+                child = node.children.get(part)
+                if child is None:
+                    child = Node(part, node, owner=self.username)
+                    node.children[part] = child
+                    created = True
+            node = child
+        if not node.is_dir:
+            print(f"mkdir: cannot create directory '{path}': Not a directory", file=self.stdout)
+            return 1
+        if created:
+            self.persist('mkdir', parts, self.username)
+            print(f"Directory '{path}' created.", file=self.stdout)
+        return 0
+
+    def chown(self, user, path, recursive=False):
+        # Изменение владельца файла/директории (с -R - всего поддерева), владелец хранится в узле
+        parts = self.split_path(path)
+        node = self.lookup(parts)
+        if node is None:
+            print(f"chown: cannot access '{path}': No such file or directory", file=self.stdout)
+            return 1
+        with self.path_locks(parts):
+            for child in (self.walk(node) if recursive else [node]):
+                child.owner = user  # Изменяем владельца
+            self.persist('chown', parts, user, recursive)
+        print(f"Owner of '{path}' changed to {user}.", file=self.stdout)
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Эмулятор командной оболочки над zip-архивом.")
+    parser.add_argument("--config", default="config.yaml", help="Путь к конфигурационному файлу.")
+    parser.add_argument("--script", help="Файл со сценарием команд ('-' - стандартный ввод).")
+    parser.add_argument("--json", action="store_true", help="Вывести результаты сценария в формате JSON.")
+    args = parser.parse_args()
+
+    emulator = ShellEmulator(args.config)
+    if args.script is None:
+        emulator.run()
+        return
+
+    # Пакетный режим: все команды выполняются над одной загруженной ФС
+    script = sys.stdin if args.script == '-' else open(args.script, 'r', encoding='utf-8')
+    failed = 0
+    try:
+        results = emulator.iter_batch(script)
+        if args.json:
+            results = list(results)
+            json.dump([result._asdict() for result in results], sys.stdout, ensure_ascii=False, indent=2)
+            print()
+            failed = sum(result.code != 0 for result in results)
+        else:
+            for result in results:
+                sys.stdout.write(result.output)
+                failed += result.code != 0
+    finally:
+        emulator.close()
+        if script is not sys.stdin:
+            script.close()
+    sys.exit(1 if failed else 0)
 
 if __name__ == "__main__":
-    emulator = ShellEmulator('config.yaml')
-    emulator.run()
+    main()
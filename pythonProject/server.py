@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from main import ShellEmulator
+
+
+async def handle_session(emulator, executor, reader, writer):
+    """Обслуживает одно подключение: отдельная сессия над общей загруженной ФС."""
+    loop = asyncio.get_running_loop()
+    writer.write(b'login: ')
+    await writer.drain()
+    username = (await reader.readline()).decode('utf-8', errors='replace').strip()
+    session = emulator.session(username)
+    try:
+        while True:
+            writer.write(f'{session.username}@shell:{session.current_dir}$ '.encode('utf-8'))
+            await writer.drain()
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode('utf-8', errors='replace').strip()
+            args = command.split()
+            if args and args[0] == 'exit':
+                # exit завершает только сессию, общая ФС остаётся открытой
+                writer.write(b'Exiting shell.\n')
+                break
+            # Команды выполняются в пуле потоков, чтобы распаковка и fsync не блокировали цикл событий
+            results = await loop.run_in_executor(executor, session.run_batch, [command])
+            for result in results:
+                writer.write(result.output.encode('utf-8'))
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(emulator, host='127.0.0.1', port=8022, unix_path=None, workers=None):
+    """Запускает TCP- или Unix-сервер, все сессии которого разделяют одну загруженную ФС."""
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def handler(reader, writer):
+        await handle_session(emulator, executor, reader, writer)
+
+    if unix_path:
+        return await asyncio.start_unix_server(handler, path=unix_path)
+    return await asyncio.start_server(handler, host, port)
+
+
+async def serve(args):
+    emulator = ShellEmulator(args.config)
+    server = await start_server(emulator, args.host, args.port, args.unix, args.workers)
+    addresses = ', '.join(str(sock.getsockname()) for sock in server.sockets)
+    print(f"Сервер запущен: {addresses}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        emulator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Многосессионный сервер эмулятора командной оболочки.")
+    parser.add_argument("--config", default="config.yaml", help="Путь к конфигурационному файлу.")
+    parser.add_argument("--host", default="127.0.0.1", help="Адрес для TCP-подключений.")
+    parser.add_argument("--port", type=int, default=8022, help="Порт для TCP-подключений.")
+    parser.add_argument("--unix", help="Путь к Unix-сокету (вместо TCP).")
+    parser.add_argument("--workers", type=int, help="Число потоков для выполнения команд.")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
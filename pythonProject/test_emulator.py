@@ -1,37 +1,231 @@
 import unittest
 import os
 import shutil
+import tempfile
+import zipfile
+import yaml
 from main import ShellEmulator
 
 class TestShellEmulator(unittest.TestCase):
     def setUp(self):
         # Создаем тестовый эмулятор и виртуальную файловую систему
-        self.emulator = ShellEmulator('config.yaml')
+        self.tmp_dir = tempfile.mkdtemp()
+        fs_path = os.path.join(self.tmp_dir, 'filesystem.zip')
+        with zipfile.ZipFile(fs_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr('testdir/', '')
+            zip_file.writestr('testdir/inner.txt', 'inner')
+            zip_file.writestr('testdir/sub/deep.txt', 'deep')  # Промежуточная директория без записи
+            zip_file.writestr('testfile', 'hello')
+        self.fs_path = fs_path
+        self.emulator = self._make_emulator()
         self.emulator.init_fs()
 
+    def _make_emulator(self, **options):
+        config_path = os.path.join(self.tmp_dir, 'config.yaml')
+        with open(config_path, 'w') as f:
+            yaml.safe_dump({'username': 'user', 'fs_path': self.fs_path, 'journal': True, **options}, f)
+        return ShellEmulator(config_path)
+
     def tearDown(self):
         # Очищаем временные файлы
-        if os.path.exists(self.emulator.mount_point):
-            shutil.rmtree(self.emulator.mount_point)
+        self.emulator.close()
+        if os.path.exists(self.tmp_dir):
+            shutil.rmtree(self.tmp_dir)
 
     def test_ls(self):
         self.emulator.current_dir = '/'
         output = self._run_command('ls')
         self.assertIn('testdir', output)
 
+    def test_ls_direct_children(self):
+        self.emulator.cd('testdir')
+        output = self._run_command('ls')
+        self.assertEqual(output.split('\n'), ['inner.txt', 'sub'])
+
     def test_cd(self):
         self.emulator.current_dir = '/'
         self.emulator.cd('testdir')
         self.assertEqual(self.emulator.current_dir, 'testdir')
 
+    def test_cd_parent_and_root(self):
+        self.emulator.cd('testdir/sub')
+        self.assertEqual(self.emulator.current_dir, 'testdir/sub')
+        self.emulator.cd('../..')
+        self.assertEqual(self.emulator.current_dir, '/')
+        output = self._run_command('cd testfile')
+        self.assertIn('No such directory', output)
+
     def test_mkdir(self):
         self.emulator.current_dir = '/'
         self.emulator.mkdir('newdir')
-        self.assertTrue(os.path.isdir(os.path.join(self.emulator.mount_point, 'newdir')))
+        node = self.emulator.lookup(['newdir'])
+        self.assertTrue(node.is_dir)
+        self.assertEqual(node.owner, 'user')
+
+    def test_mkdir_missing_parent(self):
+        output = self._run_command('mkdir missing/newdir')
+        self.assertIn('No such file or directory', output)
+
+    def test_mkdir_in_file(self):
+        self.assertEqual(self.emulator.execute_command('mkdir testfile/x'), 1)
+        self.assertIn('Not a directory', self._run_command('mkdir testfile/x'))
+        self.assertEqual(self._run_command('cat testfile'), 'hello')
+
+    def test_chown(self):
+        self._run_command('chown admin testdir/inner.txt')
+        self.assertEqual(self.emulator.lookup(['testdir', 'inner.txt']).owner, 'admin')
+
+    def test_cat(self):
+        self.assertEqual(self._run_command('cat testfile'), 'hello')
+        self.assertIn('Is a directory', self._run_command('cat testdir'))
+
+    def test_lazy_load(self):
+        self.emulator.close()
+        self.emulator = self._make_emulator(lazy=True, cache_bytes=5)
+        node = self.emulator.lookup(['testdir', 'inner.txt'])
+        self.assertIsInstance(node.data, zipfile.ZipInfo)  # Содержимое ещё не распаковано
+        self.assertEqual(self._run_command('cat testdir/inner.txt'), 'inner')
+        self.assertEqual(self._run_command('cat testfile'), 'hello')
+        # Лимит кэша в 5 байт вытесняет ранее прочитанный файл
+        self.assertEqual(len(self.emulator.blob_cache), 1)
+        self.assertEqual(self.emulator.blobs.resident_bytes, 5)
+
+    def test_dedupe_stats(self):
+        self.emulator.close()
+        with zipfile.ZipFile(self.fs_path, 'w') as zip_file:
+            for i in range(3):
+                zip_file.writestr(f'vendor{i}/lib.py', 'same')  # Без сжатия: срез отображения архива
+            zip_file.writestr('packed.txt', 'same', zipfile.ZIP_DEFLATED)
+        self.emulator = self._make_emulator()
+        self.assertIsInstance(self.emulator.read_file(self.emulator.lookup(['vendor0', 'lib.py'])), memoryview)
+        self.assertEqual(self._run_command('cat vendor2/lib.py'), 'same')
+        stats = dict(line.split(': ') for line in self._run_command('stats').split('\n'))
+        self.assertEqual(stats['files'], '4')
+        self.assertEqual(stats['unique blobs'], '1')
+        self.assertEqual(stats['logical bytes'], '16')
+        self.assertEqual(stats['mapped bytes'], '4')
+        self.assertEqual(stats['resident bytes'], '0')
+        self.assertEqual(stats['dedupe ratio'], '4.00')
+
+    def test_journal_off_by_default(self):
+        # Без явного journal: true архив не переписывается уплотнением
+        config_path = os.path.join(self.tmp_dir, 'plain.yaml')
+        with open(config_path, 'w') as f:
+            yaml.safe_dump({'username': 'user', 'fs_path': self.fs_path}, f)
+        emulator = ShellEmulator(config_path)
+        self.assertIsNone(emulator.journal)
+        emulator.close()
+
+    def test_journal_survives_restart(self):
+        self._run_command('mkdir newdir')
+        self._run_command('chown admin testdir/inner.txt')
+        self.emulator.close()
+        self.emulator = self._make_emulator(lazy=True)
+        self.assertEqual(self.emulator.lookup(['newdir']).owner, 'user')
+        self.assertEqual(self.emulator.lookup(['testdir', 'inner.txt']).owner, 'admin')
+
+    def test_journal_compaction(self):
+        self.emulator.close()
+        self.emulator = self._make_emulator(compact_bytes=1, journal_fsync=False)
+        self._run_command('chown admin testdir/sub')
+        self.emulator.journal.wait()
+        self._run_command('mkdir newdir')
+        self.emulator.close()
+        # Обе записи перенесены в архив, журнал пуст
+        with zipfile.ZipFile(self.fs_path) as zip_file:
+            self.assertEqual(zip_file.getinfo('testdir/sub/').comment, b'admin')
+            self.assertEqual(zip_file.getinfo('newdir/').comment, b'user')
+        self.assertEqual(os.path.getsize(self.fs_path + '.journal'), 0)
+        self.emulator = self._make_emulator()
+        self.assertEqual(self.emulator.lookup(['testdir', 'sub']).owner, 'admin')
+        self.assertEqual(self._run_command('cat testdir/sub/deep.txt'), 'deep')
+        self.assertTrue(self.emulator.lookup(['newdir']).is_dir)
+
+    def test_root_chown_compaction(self):
+        self._run_command('chown admin /')
+        self.emulator.journal.compact()
+        self.emulator.close()
+        self.emulator = self._make_emulator()
+        self.assertEqual(self.emulator.root.owner, 'admin')
+        self._run_command('chown -R root /')
+        self.emulator.journal.compact()
+        self.emulator.close()
+        self.emulator = self._make_emulator(lazy=True)
+        self.assertEqual({node.owner for node in self.emulator.walk(self.emulator.root)}, {'root'})
+
+    def test_mkdir_parents(self):
+        self.assertEqual(self.emulator.execute_command('mkdir -p a/b/c'), 0)
+        self.assertEqual(self.emulator.lookup(['a', 'b']).owner, 'user')
+        self.assertEqual(self.emulator.execute_command('mkdir -p testdir/sub'), 0)  # Уже существует
+        self.assertIn('Not a directory', self._run_command('mkdir -p testfile/x'))
+
+    def test_chown_recursive(self):
+        self._run_command('chown -R admin testdir')
+        owners = {node.owner for node in self.emulator.walk(self.emulator.lookup(['testdir']))}
+        self.assertEqual(owners, {'admin'})
+        self.assertEqual(self.emulator.lookup(['testfile']).owner, 'system')
+
+    def test_recursive_journal_compaction(self):
+        self._run_command('mkdir -p a/b')
+        self._run_command('chown -R admin testdir')
+        self._run_command('chown root testdir/inner.txt')
+        with open(self.fs_path + '.journal') as f:
+            self.assertEqual(len(f.readlines()), 3)  # Одна запись на команду
+        self.emulator.journal.compact()
+        self.emulator.close()
+        with open(self.fs_path + '.journal') as f:
+            self.assertEqual(f.read(), '')
+        self.emulator = self._make_emulator(lazy=True)
+        lookup = self.emulator.lookup
+        self.assertEqual(lookup(['a']).owner, 'user')
+        self.assertEqual(lookup(['a', 'b']).owner, 'user')
+        self.assertEqual(lookup(['testdir', 'sub']).owner, 'admin')
+        self.assertEqual(lookup(['testdir', 'sub', 'deep.txt']).owner, 'admin')
+        self.assertEqual(lookup(['testdir', 'inner.txt']).owner, 'root')
+
+    def test_find(self):
+        output = self._run_command('find testdir')
+        self.assertEqual(output.split('\n'), ['testdir', 'testdir/inner.txt', 'testdir/sub', 'testdir/sub/deep.txt'])
+        output = self._run_command('find / -name *.txt')
+        self.assertEqual(output.split('\n'), ['/testdir/inner.txt', '/testdir/sub/deep.txt'])
+
+    def test_du(self):
+        self.assertEqual(self._run_command('du testdir'), '9\ttestdir')
+        self.assertEqual(self._run_command('du'), '14\t.')
+
+    def test_run_batch(self):
+        script = ['# подготовка', 'mkdir build', 'cd build', '', 'ls', 'cd missing', 'exit', 'mkdir after_exit']
+        results = self.emulator.run_batch(script)
+        self.assertEqual([r.command for r in results], ['mkdir build', 'cd build', 'ls', 'cd missing', 'exit'])
+        self.assertEqual([r.code for r in results], [0, 0, 0, 1, 0])
+        self.assertEqual(results[0].output, "Directory 'build' created.\n")
+        self.assertIn('No such directory', results[3].output)
+        self.assertIsNone(self.emulator.lookup(['after_exit']))
+
+    def test_batch_exit_keeps_fs_open(self):
+        # exit в сценарии останавливает только сценарий: журнал и архив остаются открытыми
+        self.emulator.close()
+        self.emulator = self._make_emulator(lazy=True, journal_fsync=False)
+        self.emulator.run_batch(['exit'])
+        self.assertEqual(self._run_command('cat testfile'), 'hello')
+        self._run_command('mkdir after_batch')
+        self.emulator.close()
+        self.emulator = self._make_emulator(lazy=True, journal_fsync=False)
+        self.assertIsNotNone(self.emulator.lookup(['after_batch']))
 
-    def test_chown_invalid_user(self):
-        output = self._run_command('chown invaliduser testfile')
-        self.assertIn("chown: invalid user", output)
+    def test_timing_log(self):
+        self.emulator.close()
+        timing_log = os.path.join(self.tmp_dir, 'timings.yaml')
+        self.emulator = self._make_emulator(timing_log=timing_log)
+        for _ in range(3):
+            self._run_command('ls')
+        self._run_command('cd testdir')
+        self.emulator.close()
+        with open(timing_log) as f:
+            report = yaml.safe_load(f)
+        self.assertEqual(report['ls']['count'], 3)
+        self.assertEqual(sum(report['ls']['histogram_us'].values()), 3)
+        self.assertEqual(report['cd']['count'], 1)
 
     def _run_command(self, command):
         from io import StringIO
@@ -0,0 +1,85 @@
+import unittest
+import asyncio
+import os
+import shutil
+import tempfile
+import zipfile
+import yaml
+from main import ShellEmulator
+from server import start_server
+
+class TestShellServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # Общая ФС для всех сессий сервера
+        self.tmp_dir = tempfile.mkdtemp()
+        fs_path = os.path.join(self.tmp_dir, 'filesystem.zip')
+        with zipfile.ZipFile(fs_path, 'w') as zip_file:
+            zip_file.writestr('testdir/inner.txt', 'inner')
+        config_path = os.path.join(self.tmp_dir, 'config.yaml')
+        with open(config_path, 'w') as f:
+            yaml.safe_dump({'username': 'user', 'fs_path': fs_path, 'journal': True, 'journal_fsync': False}, f)
+        self.emulator = ShellEmulator(config_path)
+        self.server = await start_server(self.emulator, port=0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.emulator.close()
+        shutil.rmtree(self.tmp_dir)
+
+    async def _connect(self, username):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        await reader.readuntil(b'login: ')
+        writer.write(f'{username}\n'.encode())
+        await reader.readuntil(b'$ ')
+        return reader, writer
+
+    async def _run(self, client, command):
+        reader, writer = client
+        writer.write(f'{command}\n'.encode())
+        output = await reader.readuntil(b'$ ')
+        head, _, prompt = output.decode().rpartition('\n')
+        return head, prompt
+
+    async def test_sessions_share_fs(self):
+        alice = await self._connect('alice')
+        bob = await self._connect('bob')
+        await self._run(alice, 'cd testdir')
+        output, prompt = await self._run(alice, 'mkdir shared')
+        self.assertEqual(prompt, 'alice@shell:testdir$ ')
+        # Текущая директория у каждой сессии своя, а изменения ФС видны всем
+        output, prompt = await self._run(bob, 'ls')
+        self.assertEqual(prompt, 'bob@shell:/$ ')
+        output, _ = await self._run(bob, 'cd testdir')
+        output, _ = await self._run(bob, 'ls')
+        self.assertEqual(output.split('\n'), ['inner.txt', 'shared'])
+        self.assertEqual(self.emulator.lookup(['testdir', 'shared']).owner, 'alice')
+        self.assertEqual(self.emulator.current_dir, '/')
+        for _, writer in (alice, bob):
+            writer.close()
+
+    async def test_concurrent_mkdir(self):
+        clients = await asyncio.gather(*(self._connect(f'user{i}') for i in range(20)))
+        outputs = await asyncio.gather(*(self._run(client, 'mkdir race') for client in clients))
+        created = [output for output, _ in outputs if 'created' in output]
+        self.assertEqual(len(created), 1)
+        for _, writer in clients:
+            writer.close()
+
+    async def test_exit_ends_only_session(self):
+        # Любая форма exit закрывает только соединение, общая ФС остаётся открытой
+        for command in ('exit', 'exit 1', 'exit   '):
+            reader, writer = await self._connect('alice')
+            writer.write(f'{command}\n'.encode())
+            self.assertEqual(await reader.read(), b'Exiting shell.\n')
+            writer.close()
+        bob = await self._connect('bob')
+        output, _ = await self._run(bob, 'cat testdir/inner.txt')
+        self.assertEqual(output, 'inner')
+        self.assertIsNotNone(self.emulator.zip_file)
+        self.assertIsNotNone(self.emulator.journal)
+        bob[1].close()
+
+if __name__ == '__main__':
+    unittest.main()